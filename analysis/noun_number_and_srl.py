@@ -1,28 +1,28 @@
 from pathlib import Path
 
-from babybertsrl.io import load_propositions_from_file, load_utterances_from_file
+from babybertsrl.io import load_utterances_from_file
+from babybertsrl.corpus_index import CorpusIndex
 
 
 # ========================================================== SRL
 
 root = Path(__file__).parent.parent
 data_path_train_srl = root / 'data' / 'training' / f'childes-20191206_no-dev_srl.txt'
-propositions = load_propositions_from_file(data_path_train_srl)
+index = CorpusIndex.load_or_make(data_path_train_srl)
 
 nouns_singular = set((root / 'analysis' / 'nouns_singular_annotator2.txt').open().read().split())
 nouns_plural = set((root / 'analysis' / 'nouns_plural_annotator2.txt').open().read().split())
 
-tag2number = {}
-for words, pred_id, tags in propositions:
-    for w, t in zip(words, tags):
-        if w in nouns_singular:
-            tag2number.setdefault(t, {'s': 0, 'p': 0})['s'] += 1
-        elif w in nouns_plural:
-            tag2number.setdefault(t, {'s': 0, 'p': 0})['p'] += 1
+# count of tags of singular (row 0) and plural (row 1) nouns - on ids.
+# the index holds all propositions, and only those loaded for training are counted, as in load_propositions_from_file()
+word_groups = index.group_words([nouns_singular, nouns_plural])
+tag_s, tag_p = index.co_occurrence(word_groups, column='tags', is_included=index.is_within_length_limits())
 
-for tag, number in tag2number.items():
-    total = number['s'] + number['p']
-    print(f'{tag:<16} s={number["s"]/total:.2f} p={number["p"]/total:.2f}')
+for tag, s, p in zip(index.store.tags, tag_s, tag_p):
+    total = s + p
+    if total == 0:
+        continue
+    print(f'{tag:<16} s={s/total:.2f} p={p/total:.2f}')
 
 # ========================================================== MLM
 
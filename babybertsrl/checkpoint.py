@@ -0,0 +1,116 @@
+"""
+saving and loading of trained models, including an inference-only int8 export for CPU.
+
+a checkpoint is a directory containing:
+ - params.json: the params of the job that trained the model
+ - bert_config.json: the architecture of the encoder
+ - input_vocab.txt, input_vocab.sha1: the word-piece vocab, saved with babybertsrl.vocab.save_vocab()
+ - vocab_mlm, vocab_srl: the output vocabularies, saved by Allen NLP
+ - state_dict.pt: the model weights
+"""
+
+import json
+import attr
+from pathlib import Path
+from typing import Dict, Tuple
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig
+
+from allennlp.data.vocabulary import Vocabulary
+
+from babybertsrl.encoder import make_bert_model
+from babybertsrl.model_mt import MTBert
+from babybertsrl.params import param2default
+from babybertsrl.vocab import save_vocab, load_saved_vocab
+
+
+def save_checkpoint(mt_bert: MTBert,
+                    input_vocab: Dict[str, int],
+                    params,
+                    checkpoint_path: Path,
+                    quantized: bool = False,
+                    ) -> None:
+    print(f'Saving checkpoint to {checkpoint_path}')
+
+    checkpoint_path.mkdir(parents=True, exist_ok=True)
+    param2val = attr.asdict(params)
+    param2val['quantized'] = quantized
+    (checkpoint_path / 'params.json').write_text(json.dumps(param2val, indent=2))
+    (checkpoint_path / 'bert_config.json').write_text(mt_bert.bert_model.config.to_json_string())
+    save_vocab(input_vocab, checkpoint_path / 'input_vocab.txt')
+    mt_bert.vocab_mlm.save_to_files(str(checkpoint_path / 'vocab_mlm'))
+    mt_bert.vocab_srl.save_to_files(str(checkpoint_path / 'vocab_srl'))
+    torch.save(mt_bert.state_dict(), checkpoint_path / 'state_dict.pt')
+
+
+def load_params(checkpoint_path: Path):
+    """
+    params of a checkpoint saved before a param was added get the default value of that param,
+    and params which no longer exist are ignored.
+    """
+    from babybertsrl.job import Params  # import here to avoid circular import
+
+    param2val = json.loads((checkpoint_path / 'params.json').read_text())
+    names = [a.name for a in attr.fields(Params)]
+    for name in names:
+        if name not in param2val:
+            print(f'WARNING: {name} not in checkpoint params. Using default={param2default[name]}')
+    return Params(**{name: param2val.get(name, param2default[name]) for name in names})
+
+
+def is_quantized(checkpoint_path: Path) -> bool:
+    """whether the checkpoint holds a quantized model, which runs on CPU only"""
+    param2val = json.loads((checkpoint_path / 'params.json').read_text())
+    return param2val.get('quantized', False)
+
+
+def load_checkpoint(checkpoint_path: Path,
+                    ) -> Tuple[MTBert, Dict[str, int]]:
+    """
+    load model and input vocab. the model is in eval mode, and on CPU if it is quantized.
+    """
+    quantized = is_quantized(checkpoint_path)
+    params = load_params(checkpoint_path)
+
+    input_vocab = load_saved_vocab(checkpoint_path / 'input_vocab.txt')
+    bert_config = BertConfig.from_json_file(str(checkpoint_path / 'bert_config.json'))
+    mt_bert = MTBert(vocab_mlm=Vocabulary.from_files(str(checkpoint_path / 'vocab_mlm')),
+                     vocab_srl=Vocabulary.from_files(str(checkpoint_path / 'vocab_srl')),
+                     bert_model=make_bert_model(params.encoder, bert_config),
+                     embedding_dropout=params.embedding_dropout,
+                     precision='fp32' if quantized else params.precision)
+    if quantized:
+        quantize(mt_bert)  # quantized modules must exist before their state can be loaded
+    state_dict = torch.load(checkpoint_path / 'state_dict.pt', map_location='cpu')
+    mt_bert.load_state_dict(state_dict)
+    mt_bert.eval()
+
+    return mt_bert, input_vocab
+
+
+def quantize(mt_bert: MTBert,
+             ) -> MTBert:
+    """
+    replace all linear layers (in encoder and both projection heads) in place with dynamically quantized int8 layers.
+    weights are stored in int8, activations are quantized on the fly. for inference on CPU only.
+    """
+    mt_bert.cpu()
+    mt_bert.eval()
+    mt_bert.precision = 'fp32'
+    torch.quantization.quantize_dynamic(mt_bert,
+                                        qconfig_spec={torch.nn.Linear},
+                                        dtype=torch.qint8,
+                                        inplace=True)
+    mt_bert.clear_logits_fns()
+    return mt_bert
+
+
+def export_quantized(checkpoint_path: Path,
+                     export_path: Path,
+                     ) -> None:
+    """
+    make an inference-only int8 checkpoint from a trained fp32 checkpoint.
+    """
+    mt_bert, input_vocab = load_checkpoint(checkpoint_path)
+    quantize(mt_bert)
+    save_checkpoint(mt_bert, input_vocab, load_params(checkpoint_path), export_path, quantized=True)
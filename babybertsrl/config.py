@@ -5,6 +5,7 @@ class Dirs:
     root = Path(__file__).parent.parent
     data = root / 'data'
     data_tools = root / 'data_tools'
+    cache = data / 'cache'  # derived data which can be safely deleted
 
 
 class Data:
@@ -18,6 +19,7 @@ class Eval:
     test_sentences = False
     train_split = False
     print_perl_script_output = False  # happens at every batch so not very useful
+    save_probing_predictions = False  # save predictions for each probing sentence, in addition to accuracy
 
     probing_names = [
         'agreement_across_adjectives',
@@ -1,5 +1,7 @@
-from typing import Iterator, List, Tuple, Union
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 import numpy as np
+import torch
 
 from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
 
@@ -7,39 +9,84 @@ from allennlp.data.token_indexers import SingleIdTokenIndexer
 from allennlp.data import Instance, Token
 from allennlp.data.fields import TextField, SequenceLabelField, MetadataField
 
-from babybertsrl.word_pieces import wordpiece, convert_tags_to_wordpiece_tags, convert_verb_indices_to_wordpiece_indices
-
-
-def mask_one_wordpiece(words: List[str],
-                       masked_id: int,
-                       ) -> Tuple[List[str], List[int], List[str]]:
-
-    mlm_in = ['[MASK]' if i == masked_id else words[i] for i in range(len(words))]
-    mlm_mask = [1 if i == masked_id else 0 for i in range(len(words))]
-    mlm_tags = [w if w != '[MASK]' else '[UNK]' for w in words]  # [MASK] symbol is not in output vocab
-
-    if all([x == 0 for x in mlm_mask]):
-        raise ValueError('Mask indicator contains zeros only. ')
-
-    return mlm_in, mlm_mask, mlm_tags
+from babybertsrl.proposition_store import PropositionStore
+from babybertsrl.word_pieces import wordpiece, convert_verb_indices_to_wordpiece_indices
+from babybertsrl.word_pieces import CachedWordpieceTokenizer, encode_bio_tags, decode_bio_tags, mask_whole_words
+from babybertsrl.word_pieces import convert_tags_to_wordpiece_tags_batch, convert_verb_indices_to_wordpiece_indices_batch
+
+
+def wrap_tokenizer(wordpiece_tokenizer: Union[WordpieceTokenizer, CachedWordpieceTokenizer],
+                   ) -> CachedWordpieceTokenizer:
+    """cache word pieces of each word type, unless already cached"""
+    if isinstance(wordpiece_tokenizer, CachedWordpieceTokenizer):
+        return wordpiece_tokenizer
+    return CachedWordpieceTokenizer(wordpiece_tokenizer)
+
+
+def make_inference_batch(sentences: List[Tuple[List[str], Optional[int]]],
+                         wordpiece_tokenizer: WordpieceTokenizer,
+                         ) -> Dict[str, Any]:
+    """
+    convert sentences directly to the tensors and metadata expected by MTBert.forward(), without gold tags.
+    each sentence is a tuple (words, verb_index) for SRL, or (words, None) for MLM, with words masked by "[MASK]".
+    """
+    vocab = wordpiece_tokenizer.vocab
+    all_token_ids = []
+    all_indicators = []
+    metadata = []
+    for words, verb_index in sentences:
+        words_wp, offsets, start_offsets = wordpiece(words, wordpiece_tokenizer, lowercase_input=False)
+        if verb_index is not None:
+            verb_indices = [int(i == verb_index) for i in range(len(words))]
+            indicator = convert_verb_indices_to_wordpiece_indices(verb_indices, offsets)
+        else:
+            indicator = [int(w == '[MASK]') for w in words_wp]
+        all_token_ids.append([vocab.get(w, vocab['[UNK]']) for w in words_wp])
+        all_indicators.append(indicator)
+        metadata.append({'in': words, 'verb_index': verb_index, 'gold_tags': [], 'start_offsets': start_offsets})
+
+    # pad
+    max_length = max([len(ids) for ids in all_token_ids])
+    token_ids = torch.zeros(len(sentences), max_length, dtype=torch.long)
+    indicator = torch.zeros(len(sentences), max_length, dtype=torch.long)
+    for n, (ids, ind) in enumerate(zip(all_token_ids, all_indicators)):
+        token_ids[n, :len(ids)] = torch.tensor(ids)
+        indicator[n, :len(ind)] = torch.tensor(ind)
+
+    return {'tokens': {'tokens': token_ids}, 'indicator': indicator, 'metadata': metadata}
+
+
+def count_in_order_of_occurrence(ids: np.ndarray,
+                                 weights: Optional[np.ndarray] = None,
+                                 ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    return the unique ids, in order of first occurrence, and their (optionally weighted) counts.
+    """
+    unique_ids, first_indices = np.unique(ids, return_index=True)
+    counts = np.bincount(ids, weights=weights)[unique_ids]
+    order = np.argsort(first_indices, kind='stable')
+    return unique_ids[order], np.rint(counts[order]).astype(np.int64)
 
 
 class ConverterMLM:
 
     def __init__(self,
                  params,
-                 wordpiece_tokenizer: WordpieceTokenizer,
+                 wordpiece_tokenizer: Union[WordpieceTokenizer, CachedWordpieceTokenizer],
                  ):
         """
         converts utterances into Allen NLP toolkit instances format
         for training with BERT.
         designed to use with CHILDES sentences
 
+        label_counter counts the word-piece tags of all instances made with make_instances(),
+        in order of first occurrence, and is used to build the output vocab.
         """
 
         self.params = params
-        self.wordpiece_tokenizer = wordpiece_tokenizer
+        self.wordpiece_tokenizer = wrap_tokenizer(wordpiece_tokenizer)
         self.token_indexers = {'tokens': SingleIdTokenIndexer()}  # specifies how a token is indexed
+        self.label_counter = Counter()
 
     def _text_to_instance(self,
                           mlm_in: List[str],
@@ -48,6 +95,7 @@ class ConverterMLM:
                           mlm_tags_wp: List[str],
                           start_offsets: List[int],
                           mlm_mask_wp: List[int],
+                          mlm_in_ids: Optional[List[int]] = None,
                           ) -> Instance:
 
         # meta data only has whole words
@@ -57,7 +105,9 @@ class ConverterMLM:
         metadata_dict['gold_tags'] = mlm_tags  # is just a copy of the input without the mask
 
         # fields
-        tokens = [Token(t, text_id=self.wordpiece_tokenizer.vocab[t]) for t in mlm_in_wp]
+        if mlm_in_ids is None:
+            mlm_in_ids = [self.wordpiece_tokenizer.vocab[t] for t in mlm_in_wp]
+        tokens = [Token(t, text_id=i) for t, i in zip(mlm_in_wp, mlm_in_ids)]
         text_field = TextField(tokens, self.token_indexers)
 
         assert len(mlm_in_wp) == len(mlm_tags_wp)
@@ -73,42 +123,57 @@ class ConverterMLM:
                        utterances:  List[List[str]],
                        ) -> List[Instance]:
         """
-        convert on utterance into possibly multiple Allen NLP instances
-
-
-
-        # TODO 1. convert wo wp 2. mask word in whole-word sequence 3. use offsets to compute wp sequence with [MASK]
+        convert each utterance into num_masked Allen NLP instances, each with a different masked word.
 
+        utterances are converted to word pieces once, BEFORE masking.
+        a whole word is masked, by masking all of its word pieces, located with the start and end offsets,
+        such that the output (the original word pieces) is aligned with the input.
         """
-
-        raise NotImplementedError
-
+        encoded = self.wordpiece_tokenizer.encode(utterances)
+
+        # sample words to mask in each utterance
+        sentence_ids = []
+        word_ids = []
+        for n, num_words in enumerate(np.diff(encoded.word_offsets)):
+            num_masked = min(num_words, self.params.num_masked)
+            word_ids.extend(np.random.choice(num_words, num_masked, replace=False))
+            sentence_ids.extend([n] * num_masked)
+        sentence_ids = np.array(sentence_ids, dtype=np.int64)
+        word_ids = np.array(word_ids, dtype=np.int64)
+
+        # mask all at once
+        mask_id = self.wordpiece_tokenizer.vocab['[MASK]']
+        input_ids, tag_ids, mask, offsets = mask_whole_words(encoded, sentence_ids, word_ids, mask_id)
+
+        # count tags - each utterance is counted once for each of its masked copies
+        ids_to_tokens = self.wordpiece_tokenizer.ids_to_tokens
+        num_copies = np.bincount(sentence_ids, minlength=len(encoded.sentence_offsets) - 1)
+        weights = np.repeat(num_copies, np.diff(encoded.sentence_offsets))
+        for i, count in zip(*count_in_order_of_occurrence(encoded.ids, weights)):
+            if count:
+                self.label_counter[ids_to_tokens[i]] += int(count)
+
+        # to instances - word pieces are shared strings from the vocab, not copies
+        input_ids = input_ids.tolist()
+        mlm_in_wp = [ids_to_tokens[i] for i in input_ids]
+        mlm_tags_wp = [ids_to_tokens[i] for i in tag_ids.tolist()]
+        mlm_mask_wp = mask.tolist()
+        start_offsets = encoded.start_offsets.tolist()
         res = []
-        for mlm_in in utterances:
-
-            # to word-pieces (do this BEFORE masking)  TODO test
-            mlm_in_wp, offsets, start_offsets = wordpiece(mlm_in,
-                                                          self.wordpiece_tokenizer,
-                                                          lowercase_input=False)
-            mlm_tags = mlm_in.copy()
-            mlm_tags_wp = mlm_in_wp.copy()
-
-            # collect each multiple times, each time with a different masked word
-            num_wps = len(mlm_tags_wp)
-            num_masked = min(num_wps, self.params.num_masked)
-            for masked_id in np.random.choice(num_wps, num_masked, replace=False):
-                # mask
-                mlm_in_wp, mlm_mask_wp, mlm_tags_wp = mask_one_wordpiece(mlm_tags_wp, masked_id)
-                # to instance
-                instance = self._text_to_instance(mlm_in,
-                                                  mlm_in_wp,
-                                                  mlm_tags,
-                                                  mlm_tags_wp,
-                                                  start_offsets,
-                                                  mlm_mask_wp)
-                res.append(instance)
+        for i, n in enumerate(sentence_ids.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            mlm_in = utterances[n]
+            instance = self._text_to_instance(mlm_in,
+                                              mlm_in_wp[start: end],
+                                              mlm_in,  # whole-word tags are the unmasked input
+                                              mlm_tags_wp[start: end],
+                                              start_offsets[encoded.word_offsets[n]: encoded.word_offsets[n + 1]],
+                                              mlm_mask_wp[start: end],
+                                              input_ids[start: end])
+            res.append(instance)
 
         print(f'With num_masked={self.params.num_masked}, made {len(res)} utterances')
+        self.wordpiece_tokenizer.print_stats()
 
         return res
 
@@ -116,33 +181,41 @@ class ConverterMLM:
                                utterances:  List[List[str]],
                                ) -> List[Instance]:
         """
-        convert on utterance into exactly one Allen NLP instances - WITHOUT MASKING (assuming masking is already done)
+        convert each utterance into exactly one Allen NLP instance - the word "[MASK]" is already in each utterance.
 
+        as in make_instances(), the masked word is located with the start and end offsets,
+        and masked by mask_whole_words(), such that probing and training instances are made the same way.
         """
-
+        encoded = self.wordpiece_tokenizer.encode(utterances)
+
+        # the masked word of each utterance
+        sentence_ids = np.arange(len(utterances), dtype=np.int64)
+        word_ids = np.array([u.index('[MASK]') for u in utterances], dtype=np.int64)
+        mask_id = self.wordpiece_tokenizer.vocab['[MASK]']
+        input_ids, tag_ids, mask, offsets = mask_whole_words(encoded, sentence_ids, word_ids, mask_id)
+        tag_ids[tag_ids == mask_id] = self.wordpiece_tokenizer.vocab['[UNK]']  # [MASK] is not in output vocab
+
+        # to instances
+        input_ids = input_ids.tolist()
+        ids_to_tokens = self.wordpiece_tokenizer.ids_to_tokens
+        mlm_in_wp = [ids_to_tokens[i] for i in input_ids]
+        mlm_tags_wp = [ids_to_tokens[i] for i in tag_ids.tolist()]
+        mlm_mask_wp = mask.tolist()
+        start_offsets = encoded.start_offsets.tolist()
         res = []
-        for mlm_in in utterances:
-            # to word-pieces (do this BEFORE masking)  TODO test
-            mlm_in_wp, offsets, start_offsets = wordpiece(mlm_in,
-                                                          self.wordpiece_tokenizer,
-                                                          lowercase_input=False)
-
-            mlm_tags = mlm_in  # irrelevant for probing
-            mlm_tags_wp = mlm_in_wp  # irrelevant for probing
-
-            # mask
-            masked_id = mlm_in.index('[MASK]')
-            mlm_in_wp, mlm_mask_wp, mlm_tags_wp = mask_one_wordpiece(mlm_tags_wp, masked_id)
-            # to instance
+        for n, mlm_in in enumerate(utterances):
+            start, end = offsets[n], offsets[n + 1]
             instance = self._text_to_instance(mlm_in,
-                                              mlm_in_wp,
-                                              mlm_tags,
-                                              mlm_tags_wp,
-                                              start_offsets,
-                                              mlm_mask_wp)
+                                              mlm_in_wp[start: end],
+                                              mlm_in,  # irrelevant for probing
+                                              mlm_tags_wp[start: end],
+                                              start_offsets[encoded.word_offsets[n]: encoded.word_offsets[n + 1]],
+                                              mlm_mask_wp[start: end],
+                                              input_ids[start: end])
             res.append(instance)
 
         print(f'Without masking, made {len(res)} utterances')
+        self.wordpiece_tokenizer.print_stats()
 
         return res
 
@@ -151,48 +224,34 @@ class ConverterSRL:
 
     def __init__(self,
                  params,
-                 wordpiece_tokenizer: WordpieceTokenizer,
+                 wordpiece_tokenizer: Union[WordpieceTokenizer, CachedWordpieceTokenizer],
                  ):
         """
         converts propositions into Allen NLP toolkit instances format
         for training a BERT-based SRL tagger.
         designed to use with conll-05 style formatted SRL data.
+
+        label_counter counts the word-piece tags of all instances made with make_instances(),
+        in order of first occurrence, and is used to build the output vocab.
         """
 
         self.params = params
-        self.wordpiece_tokenizer = wordpiece_tokenizer
+        self.wordpiece_tokenizer = wrap_tokenizer(wordpiece_tokenizer)
         self.token_indexers = {'tokens': SingleIdTokenIndexer()}
-
-    @staticmethod
-    def make_verb_indices(proposition):
-        """
-        return a one-hot list where hot value marks verb
-        :param proposition: a tuple with structure (words, predicate, labels)
-        :return: one-hot list, [sentence length]
-        """
-        num_w_in_proposition = len(proposition[0])
-        res = [int(i == proposition[1]) for i in range(num_w_in_proposition)]
-
-        if all([x == 0 for x in res]):
-            raise ValueError('Verb indicator contains zeros only. ')
-
-        return res
+        self.label_counter = Counter()
 
     def _text_to_instance(self,
                           srl_in: List[str],
-                          srl_verb_indices: List[int],
+                          srl_in_wp: List[str],
+                          srl_ids_wp: List[int],
+                          verb_index: int,
+                          verb_indices_wp: List[int],
                           srl_tags: List[str],
+                          srl_tags_wp: List[str],
+                          start_offsets: List[int],
                           ) -> Instance:
 
-        # to word-pieces
-        srl_in_wp, offsets, start_offsets = wordpiece(srl_in,
-                                                      self.wordpiece_tokenizer,
-                                                      lowercase_input=False)
-        srl_tags_wp = convert_tags_to_wordpiece_tags(srl_tags, offsets)
-        verb_indices_wp = convert_verb_indices_to_wordpiece_indices(srl_verb_indices, offsets)
-
         # compute verb
-        verb_index = srl_verb_indices.index(1)
         verb = srl_in_wp[verb_index]
 
         # metadata only has whole words
@@ -204,7 +263,7 @@ class ConverterSRL:
         metadata_dict['gold_tags'] = srl_tags  # non word-piece tags
 
         # fields
-        tokens = [Token(t, text_id=self.wordpiece_tokenizer.vocab[t]) for t in srl_in_wp]
+        tokens = [Token(t, text_id=i) for t, i in zip(srl_in_wp, srl_ids_wp)]
         text_field = TextField(tokens, self.token_indexers)
 
         fields = {'tokens': text_field,
@@ -214,23 +273,71 @@ class ConverterSRL:
 
         return Instance(fields)
 
-    def make_instances(self, propositions: List[Tuple[List[str], int, List[str]]],
+    def make_instances(self,
+                       propositions: Union[List[Tuple[List[str], int, List[str]]], PropositionStore],
                        ) -> List[Instance]:
         """
         roughly equivalent to Allen NLP toolkit dataset.read().
         return a list rather than a generator,
          because DataIterator requires being able to iterate multiple times to implement multiple epochs.
 
+        conversion to word pieces is done for all propositions at once, on integer-encoded arrays.
+        propositions are converted to a PropositionStore, unless they already are one,
+        such that each word and tag type is converted only once.
         """
+        if not isinstance(propositions, PropositionStore):
+            propositions = PropositionStore.from_propositions(propositions)
+        store = propositions
+
+        # to word-pieces
+        encoded = self.wordpiece_tokenizer.encode_word_ids(store.word_ids, store.offsets, store.words)
+
+        # verb indicators
+        predicate_indices = np.asarray(store.predicate_indices, dtype=np.int64)
+        if np.any((predicate_indices < 0) | (predicate_indices >= store.lengths)):
+            raise ValueError('Verb indicator contains zeros only. ')
+        verb_indices = np.zeros(len(store.word_ids), dtype=np.int32)
+        verb_indices[store.offsets[:-1] + predicate_indices] = 1
+        verb_indices_wp = convert_verb_indices_to_wordpiece_indices_batch(verb_indices, encoded).tolist()
+
+        # tags - each tag type is split into BIO code and label once
+        label2id = {}
+        type_bio, type_label_ids = encode_bio_tags(store.tags, label2id)
+        bio, label_ids = type_bio[store.tag_ids], type_label_ids[store.tag_ids]
+        bio_wp, label_ids_wp = convert_tags_to_wordpiece_tags_batch(bio, label_ids, encoded)
+        srl_tags_wp = decode_bio_tags(bio_wp, label_ids_wp, sorted(label2id, key=label2id.get))
+
+        # count tags, on combined ids of BIO code and label
+        num_label_ids = len(label2id) + 1  # including -1 for "O"
+        tag_ids_wp = bio_wp.astype(np.int64) * num_label_ids + label_ids_wp + 1
+        unique_tag_ids, counts = count_in_order_of_occurrence(tag_ids_wp)
+        for tag, count in zip(decode_bio_tags(unique_tag_ids // num_label_ids,
+                                              unique_tag_ids % num_label_ids - 1,
+                                              sorted(label2id, key=label2id.get)),
+                              counts.tolist()):
+            self.label_counter[tag] += count
+
+        # to instances - words, tags and word pieces are shared strings from the tables, not copies
+        ids = encoded.ids.tolist()
+        srl_in_wp = [self.wordpiece_tokenizer.ids_to_tokens[i] for i in ids]
+        srl_in_all = [store.words[i] for i in store.word_ids.tolist()]
+        srl_tags_all = [store.tags[i] for i in store.tag_ids.tolist()]
+        start_offsets = encoded.start_offsets.tolist()
         res = []
-        for proposition in propositions:
-            srl_in = proposition[0]
-            srl_verb_indices = self.make_verb_indices(proposition)
-            srl_tags = proposition[2]
-
-            # to instance
-            instance = self._text_to_instance(srl_in,
-                                              srl_verb_indices,
-                                              srl_tags)
+        for n, verb_index in enumerate(store.predicate_indices.tolist()):
+            start, end = encoded.sentence_offsets[n], encoded.sentence_offsets[n + 1]
+            word_start, word_end = store.offsets[n], store.offsets[n + 1]
+            instance = self._text_to_instance(srl_in_all[word_start: word_end],
+                                              srl_in_wp[start: end],
+                                              ids[start: end],
+                                              verb_index,
+                                              verb_indices_wp[start: end],
+                                              srl_tags_all[word_start: word_end],
+                                              srl_tags_wp[start: end],
+                                              start_offsets[word_start: word_end])
             res.append(instance)
-        return res
\ No newline at end of file
+
+        print(f'Made {len(res)} propositions')
+        self.wordpiece_tokenizer.print_stats()
+
+        return res
@@ -0,0 +1,223 @@
+"""
+a columnar index of an SRL corpus, for analyses of the data which would otherwise loop over strings.
+
+on top of the arrays of a PropositionStore, the index holds
+ - bio: int8, [num_tokens], the BIO code of each tag (see word_pieces.BIO_O, BIO_B, BIO_I)
+ - label_ids: int32, [num_tokens], ids into labels of the tag without "B-" or "I-". the id of "O" is 0
+ - proposition_hashes: uint64, [num_propositions], of the predicate index and words of each proposition
+ - line_hashes: uint64, [num_propositions], of the predicate index, words and tags of each proposition
+
+hashes are computed from strings, not ids, such that they can be compared across corpora.
+counts, co-occurrences and membership tests are computed on these arrays, with bincount and isin.
+
+an index is saved as a directory containing the arrays above, labels.txt, and the store in "propositions".
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+import numpy as np
+
+from babybertsrl import config
+from babybertsrl.proposition_store import PropositionStore
+from babybertsrl.word_pieces import encode_bio_tags
+
+ARRAY_NAMES = ['bio', 'label_ids', 'proposition_hashes', 'line_hashes']
+
+MULTIPLIER = np.uint64(1099511628211)  # odd, such that multiplication is invertible modulo 2 ** 64
+
+
+def hash_strings(strings: Iterable[str]) -> np.ndarray:
+    """64-bit hash of each string, independent of the Python process"""
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for s in strings], dtype=np.uint64)
+
+
+def hash_sequences(type_hashes: np.ndarray,
+                   ids: np.ndarray,
+                   offsets: np.ndarray,
+                   ) -> np.ndarray:
+    """
+    64-bit hash of each sequence ids[offsets[i]: offsets[i + 1]], given the hash of each type.
+    the hash is a polynomial in MULTIPLIER, with coefficients the hashes of the types, wrapping around 2 ** 64.
+    """
+    lengths = np.diff(offsets)
+    positions = np.arange(len(ids)) - np.repeat(offsets[:-1], lengths)
+    powers = np.cumprod(np.full(int(lengths.max(initial=0)) + 1, MULTIPLIER, dtype=np.uint64))
+    token_hashes = type_hashes[ids] * powers[positions]
+
+    res = lengths.astype(np.uint64) * powers[0]
+    is_empty = lengths == 0
+    if len(token_hashes):
+        res[~is_empty] += np.add.reduceat(token_hashes, offsets[:-1][~is_empty])
+    return res
+
+
+class CorpusIndex:
+
+    def __init__(self,
+                 store: PropositionStore,
+                 bio: np.ndarray,
+                 label_ids: np.ndarray,
+                 labels: List[str],
+                 proposition_hashes: np.ndarray,
+                 line_hashes: np.ndarray,
+                 ):
+        self.store = store
+        self.bio = bio
+        self.label_ids = label_ids
+        self.labels = labels
+        self.proposition_hashes = proposition_hashes
+        self.line_hashes = line_hashes
+
+    @classmethod
+    def from_store(cls,
+                   store: PropositionStore,
+                   ) -> 'CorpusIndex':
+        # BIO codes and labels of tag types, then of tokens
+        label2id = {}
+        type_bio, type_label_ids = encode_bio_tags(store.tags, label2id)
+        labels = ['O'] + sorted(label2id, key=label2id.get)
+
+        # hashes
+        word_hashes = hash_sequences(hash_strings(store.words), store.word_ids, store.offsets)
+        tag_hashes = hash_sequences(hash_strings(store.tags), store.tag_ids, store.offsets)
+        proposition_hashes = word_hashes * MULTIPLIER + np.asarray(store.predicate_indices).astype(np.uint64)
+
+        return cls(store=store,
+                   bio=type_bio[store.tag_ids],
+                   label_ids=type_label_ids[store.tag_ids] + 1,
+                   labels=labels,
+                   proposition_hashes=proposition_hashes,
+                   line_hashes=proposition_hashes * MULTIPLIER + tag_hashes)
+
+    @classmethod
+    def from_file(cls,
+                  file_path: Path,
+                  ) -> 'CorpusIndex':
+        """index all propositions in the file, including those which are too short or too long for training"""
+        return cls.from_store(PropositionStore.from_file(file_path, filter_lengths=False))
+
+    @classmethod
+    def load_or_make(cls,
+                     file_path: Path,
+                     ) -> 'CorpusIndex':
+        """
+        load index from cache, keyed by the content of the text file, or make it and save it to the cache.
+        """
+        h = hashlib.sha1(file_path.read_bytes()).hexdigest()
+        index_path = config.Dirs.cache / 'corpus_index' / f'{file_path.stem}_{h}'
+        if (index_path / 'labels.txt').exists():  # written last
+            print(f'Loading index of {file_path.name} from {index_path}')
+            return cls.load(index_path)
+        res = cls.from_file(file_path)
+        res.save(index_path)
+        return res
+
+    def save(self, index_path: Path) -> None:
+        self.store.save(index_path / 'propositions')
+        for name in ARRAY_NAMES:
+            np.save(index_path / f'{name}.npy', getattr(self, name))
+        (index_path / 'labels.txt').write_text('\n'.join(self.labels) + '\n', encoding='utf-8')
+
+    @classmethod
+    def load(cls,
+             index_path: Path,
+             mmap: bool = True,
+             ) -> 'CorpusIndex':
+        name2array = {name: np.load(index_path / f'{name}.npy', mmap_mode='r' if mmap else None)
+                      for name in ARRAY_NAMES}
+        return cls(store=PropositionStore.load(index_path / 'propositions', mmap=mmap),
+                   labels=(index_path / 'labels.txt').read_text(encoding='utf-8').split('\n')[:-1],
+                   **name2array)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    # ---------------------------------------------------------------- words
+
+    def get_word_ids(self, words: Iterable[str]) -> np.ndarray:
+        """id of each word in the table of word types, or -1 if it does not occur in the corpus"""
+        word2id = {w: i for i, w in enumerate(self.store.words)}
+        return np.array([word2id.get(w, -1) for w in words], dtype=np.int32)
+
+    def group_words(self, word_sets: List[Set[str]]) -> np.ndarray:
+        """
+        the group of each word type: the index of the first set in word_sets containing it, or -1.
+        """
+        res = np.full(len(self.store.words), -1, dtype=np.int32)
+        for group, word_set in reversed(list(enumerate(word_sets))):
+            ids = self.get_word_ids(word_set)
+            res[ids[ids != -1]] = group
+        return res
+
+    # ---------------------------------------------------------------- counts
+
+    def count_words(self) -> np.ndarray:
+        """number of occurrences of each word type"""
+        return np.bincount(self.store.word_ids, minlength=len(self.store.words))
+
+    def count_tags(self) -> np.ndarray:
+        """number of occurrences of each tag type, e.g. "B-ARG0" and "I-ARG0" are counted separately"""
+        return np.bincount(self.store.tag_ids, minlength=len(self.store.tags))
+
+    def count_labels(self) -> np.ndarray:
+        """number of occurrences of each label, i.e. tags without "B-" or "I-" """
+        return np.bincount(self.label_ids, minlength=len(self.labels))
+
+    def count_lengths(self) -> np.ndarray:
+        """histogram of proposition lengths, in words"""
+        return np.bincount(self.store.lengths)
+
+    def is_within_length_limits(self) -> np.ndarray:
+        """
+        whether each proposition is kept by the length filter of io.gen_propositions_from_file(),
+        i.e. is included in the data loaded for training with load_propositions_from_file()
+        """
+        lengths = self.store.lengths
+        return (lengths > config.Data.min_input_length) & (lengths <= config.Data.max_input_length)
+
+    def co_occurrence(self,
+                      word_groups: Optional[np.ndarray] = None,
+                      column: str = 'labels',
+                      is_included: Optional[np.ndarray] = None,
+                      ) -> np.ndarray:
+        """
+        number of tokens of each group of word types (e.g. from group_words()), with each tag, label or BIO code.
+        rows are word types if word_groups is None. tokens of word types in group -1 are not counted.
+        if is_included is given, only tokens of propositions where it is True are counted.
+        """
+        if column == 'tags':
+            column_ids, num_columns = self.store.tag_ids, len(self.store.tags)
+        elif column == 'labels':
+            column_ids, num_columns = self.label_ids, len(self.labels)
+        elif column == 'bio':
+            column_ids, num_columns = self.bio.astype(np.int32), 3
+        else:
+            raise AttributeError('Invalid arg to "column"')
+
+        if word_groups is None:
+            row_ids, num_rows = self.store.word_ids, len(self.store.words)
+        else:
+            row_ids, num_rows = word_groups[self.store.word_ids], int(word_groups.max(initial=-1)) + 1
+        is_counted = row_ids != -1
+        if is_included is not None:
+            is_counted &= np.repeat(is_included, self.store.lengths)
+        cells = row_ids[is_counted].astype(np.int64) * num_columns + column_ids[is_counted]
+        return np.bincount(cells, minlength=num_rows * num_columns).reshape(num_rows, num_columns)
+
+    # ---------------------------------------------------------------- membership
+
+    def isin(self, other: 'CorpusIndex') -> np.ndarray:
+        """whether each proposition (predicate and words, ignoring tags) occurs in the other corpus"""
+        return np.isin(self.proposition_hashes, other.proposition_hashes)
+
+    def get_unique_lines(self) -> np.ndarray:
+        """indices of the first occurrence of each distinct proposition (predicate, words and tags), in order"""
+        _, first_indices = np.unique(self.line_hashes, return_index=True)
+        return np.sort(first_indices)
+
+    def format_line(self, i: int) -> str:
+        """proposition i in the format of the text file"""
+        words, predicate_index, tags = self.store[i]
+        return f'{predicate_index} {" ".join(words)} ||| {" ".join(tags)}'
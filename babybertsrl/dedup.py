@@ -0,0 +1,186 @@
+"""
+exact and near-duplicate detection of sentences, by MinHash signatures of word n-grams and locality-sensitive hashing.
+
+sentences are normalized before hashing - lowercased, and without punctuation -
+such that e.g. "Play checkers ." and "play checkers !" are exact duplicates.
+sentences whose sets of n-grams have a Jaccard similarity above a threshold are near-duplicates:
+ - the signature of a sentence is the minimum of NUM_BANDS * NUM_ROWS hash functions over its n-grams.
+   two signatures agree at each position with probability equal to the Jaccard similarity of the sentences
+ - sentences whose signatures agree in all rows of at least one band are candidates
+ - candidates whose signatures agree at a fraction of positions >= threshold are linked,
+   and clusters are the connected components of links
+
+candidates of different bands are verified in parallel, by a pool of workers.
+"""
+
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+
+from babybertsrl.corpus_index import hash_strings
+
+NGRAM_SIZE = 2
+NUM_BANDS = 16
+NUM_ROWS = 8  # per band. sentences with similarity 0.8 are candidates with p=0.95, estimated with std=0.035
+SEED = 0
+MULTIPLIER = np.uint64(1099511628211)
+
+
+def normalize(words: List[str]) -> List[str]:
+    return [w.lower() for w in words if any(c.isalnum() for c in w)]
+
+
+def get_words(item: Union[List[str], tuple]) -> List[str]:
+    """words of an utterance or proposition - the predicate does not matter for leakage of a sentence"""
+    if isinstance(item, tuple):
+        return item[0]
+    return item
+
+
+def get_dedup_key(item: Union[List[str], tuple]) -> str:
+    return ' '.join(normalize(get_words(item)))
+
+
+def hash_tokens(words: Iterable[str],
+                token2hash: Dict[str, Optional[int]],
+                ) -> List[int]:
+    """hashes of the normalized words, where token2hash caches the hash of each word, or None for punctuation"""
+    res = []
+    for w in words:
+        try:
+            h = token2hash[w]
+        except KeyError:
+            normalized = normalize([w])
+            h = int(hash_strings(normalized)[0]) if normalized else None
+            token2hash[w] = h
+        if h is not None:
+            res.append(h)
+    return res
+
+
+def make_signatures(sentences: List[List[str]]) -> np.ndarray:
+    """
+    MinHash signatures of normalized sentences, uint64, [num_sentences, NUM_BANDS * NUM_ROWS].
+    sentences shorter than NGRAM_SIZE have a single n-gram, of all their words, padded.
+    """
+    if not sentences:
+        return np.zeros((0, NUM_BANDS * NUM_ROWS), dtype=np.uint64)
+
+    # hashes of normalized tokens of all sentences, padded to at least NGRAM_SIZE tokens
+    token2hash = {}
+    token_hashes = []
+    lengths = []
+    for words in sentences:
+        tokens = hash_tokens(words, token2hash)
+        tokens += [0] * (NGRAM_SIZE - len(tokens))
+        token_hashes.extend(tokens)
+        lengths.append(len(tokens))
+    token_hashes = np.array(token_hashes, dtype=np.uint64)
+    lengths = np.array(lengths, dtype=np.int64)
+
+    # n-grams start at each token, except the last NGRAM_SIZE - 1 tokens of each sentence
+    token_offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(len(token_hashes)) - np.repeat(token_offsets, lengths)
+    starts = np.flatnonzero(positions <= np.repeat(lengths - NGRAM_SIZE, lengths))
+    ngram_hashes = np.zeros(len(starts), dtype=np.uint64)
+    for n in range(NGRAM_SIZE):  # polynomial in MULTIPLIER, wrapping around 2 ** 64
+        ngram_hashes = ngram_hashes * MULTIPLIER + token_hashes[starts + n]
+    num_ngrams = lengths - NGRAM_SIZE + 1
+    offsets = np.cumsum(num_ngrams) - num_ngrams
+
+    # hash functions (x ^ a) * b, where b is odd, are permutations of 64-bit integers
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(0, np.iinfo(np.uint64).max, size=NUM_BANDS * NUM_ROWS, dtype=np.uint64, endpoint=True)
+    b = rng.integers(0, np.iinfo(np.uint64).max, size=NUM_BANDS * NUM_ROWS, dtype=np.uint64, endpoint=True) | 1
+    # one hash function per row, such that the minimum over n-grams is over contiguous memory
+    res = np.minimum.reduceat((ngram_hashes ^ a[:, np.newaxis]) * b[:, np.newaxis], offsets, axis=1)
+    return np.ascontiguousarray(res.T)
+
+
+def get_band_keys(signatures: np.ndarray) -> np.ndarray:
+    """one hash of the rows of each band, uint64, [num_sentences, NUM_BANDS]"""
+    bands = signatures.reshape(len(signatures), NUM_BANDS, NUM_ROWS)
+    res = np.zeros((len(signatures), NUM_BANDS), dtype=np.uint64)
+    for row in range(NUM_ROWS):
+        res = res * MULTIPLIER + bands[:, :, row]
+    return res
+
+
+def get_connected_components(num_nodes: int,
+                             i: np.ndarray,
+                             j: np.ndarray,
+                             ) -> np.ndarray:
+    """the smallest node of the component of each node, given edges between i and j"""
+    res = np.arange(num_nodes)
+    while True:
+        new = res.copy()
+        np.minimum.at(new, i, res[j])
+        np.minimum.at(new, j, res[i])
+        new = new[new]  # labels are nodes of the same component, so labels of labels are too
+        if np.array_equal(new, res):
+            return res
+        res = new
+
+
+def link_band(signatures: np.ndarray,
+              keys: np.ndarray,
+              threshold: float,
+              chunk_size: int,
+              ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    edges between candidates with the same key in one band, and with estimated similarity above threshold.
+    signatures of candidates are compared chunk_size pairs at a time, to bound memory.
+    """
+    # candidates: each sentence and the first sentence with the same key, such that edges are linear in sentences
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    firsts = order[is_first][np.cumsum(is_first) - 1]
+    i = order[~is_first]
+    j = firsts[~is_first]
+
+    # keep candidates with estimated similarity above threshold
+    is_similar = np.zeros(len(i), dtype=bool)
+    for start in range(0, len(i), chunk_size):
+        ci, cj = i[start: start + chunk_size], j[start: start + chunk_size]
+        is_similar[start: start + chunk_size] = (signatures[ci] == signatures[cj]).mean(axis=1) >= threshold
+    return i[is_similar], j[is_similar]
+
+
+# set in each worker
+worker_signatures = None
+
+
+def init_worker(signatures: np.ndarray) -> None:
+    global worker_signatures
+    worker_signatures = signatures
+
+
+def link_band_in_worker(keys: np.ndarray,
+                        threshold: float,
+                        chunk_size: int,
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+    return link_band(worker_signatures, keys, threshold, chunk_size)
+
+
+def find_clusters(signatures: np.ndarray,
+                  threshold: float = 0.8,
+                  chunk_size: int = 2 ** 16,
+                  num_workers: int = 1,
+                  ) -> np.ndarray:
+    """
+    the cluster of each sentence, identified by its first sentence. sentences without duplicates are their own cluster.
+    with num_workers > 1, bands are linked by a pool of workers, each holding a copy of the signatures.
+    """
+    band_keys = get_band_keys(signatures)
+    tasks = [(np.ascontiguousarray(band_keys[:, band]), threshold, chunk_size) for band in range(NUM_BANDS)]
+    if num_workers > 1:
+        with Pool(num_workers, initializer=init_worker, initargs=(signatures,)) as pool:
+            edges = pool.starmap(link_band_in_worker, tasks)
+    else:
+        edges = [link_band(signatures, *task) for task in tasks]
+
+    return get_connected_components(len(signatures),
+                                    np.concatenate([i for i, _ in edges]),
+                                    np.concatenate([j for _, j in edges]))
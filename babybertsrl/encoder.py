@@ -0,0 +1,217 @@
+"""
+A BERT encoder which is a drop-in replacement for pytorch_pretrained_bert.BertModel.
+
+Parameter names are identical, such that the state dict of one can be loaded into the other.
+Attention is computed with torch.nn.functional.scaled_dot_product_attention, which dispatches to fused kernels,
+and layer normalization and GELU use the fused implementations in torch.
+Requires torch>=2.0.
+"""
+
+from typing import List, Optional, Tuple, Union
+import torch
+from torch.nn import Linear, Dropout, Embedding, LayerNorm, Module, ModuleList, functional as F
+from pytorch_pretrained_bert.modeling import BertModel, BertConfig
+
+
+class NativeBertEmbeddings(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.word_embeddings = Embedding(config.vocab_size, config.hidden_size, padding_idx=0)
+        self.position_embeddings = Embedding(config.max_position_embeddings, config.hidden_size)
+        self.token_type_embeddings = Embedding(config.type_vocab_size, config.hidden_size)
+        self.LayerNorm = LayerNorm(config.hidden_size, eps=1e-12)
+        self.dropout = Dropout(config.hidden_dropout_prob)
+
+    def forward(self,
+                input_ids: torch.Tensor,
+                token_type_ids: torch.Tensor,
+                ) -> torch.Tensor:
+        position_ids = torch.arange(input_ids.size(1), dtype=torch.long, device=input_ids.device)
+        embeddings = self.word_embeddings(input_ids) \
+            + self.position_embeddings(position_ids).unsqueeze(0) \
+            + self.token_type_embeddings(token_type_ids)
+        return self.dropout(self.LayerNorm(embeddings))
+
+
+class NativeBertSelfAttention(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        if config.hidden_size % config.num_attention_heads != 0:
+            raise ValueError(f'hidden_size={config.hidden_size} is not a multiple of '
+                             f'num_attention_heads={config.num_attention_heads}')
+        self.num_attention_heads = config.num_attention_heads
+        self.attention_head_size = config.hidden_size // config.num_attention_heads
+        self.query = Linear(config.hidden_size, config.hidden_size)
+        self.key = Linear(config.hidden_size, config.hidden_size)
+        self.value = Linear(config.hidden_size, config.hidden_size)
+        self.dropout_prob = config.attention_probs_dropout_prob
+
+    def split_heads(self, x: torch.Tensor) -> torch.Tensor:
+        batch_size, sequence_length, _ = x.size()
+        x = x.view(batch_size, sequence_length, self.num_attention_heads, self.attention_head_size)
+        return x.transpose(1, 2)  # [batch_size, num_heads, sequence_length, head_size]
+
+    def forward(self,
+                hidden_states: torch.Tensor,
+                attention_mask: torch.Tensor,  # boolean, True where attention is allowed
+                ) -> torch.Tensor:
+        query = self.split_heads(self.query(hidden_states))
+        key = self.split_heads(self.key(hidden_states))
+        value = self.split_heads(self.value(hidden_states))
+        context = F.scaled_dot_product_attention(query, key, value,
+                                                 attn_mask=attention_mask,
+                                                 dropout_p=self.dropout_prob if self.training else 0.0)
+        batch_size, _, sequence_length, _ = context.size()
+        return context.transpose(1, 2).reshape(batch_size, sequence_length, -1)
+
+
+class NativeBertSelfOutput(Module):
+
+    def __init__(self, config: BertConfig, input_size: int):
+        super().__init__()
+        self.dense = Linear(input_size, config.hidden_size)
+        self.LayerNorm = LayerNorm(config.hidden_size, eps=1e-12)
+        self.dropout = Dropout(config.hidden_dropout_prob)
+
+    def forward(self,
+                hidden_states: torch.Tensor,
+                input_tensor: torch.Tensor,
+                ) -> torch.Tensor:
+        return self.LayerNorm(self.dropout(self.dense(hidden_states)) + input_tensor)
+
+
+class NativeBertAttention(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.self = NativeBertSelfAttention(config)
+        self.output = NativeBertSelfOutput(config, config.hidden_size)
+
+    def forward(self,
+                hidden_states: torch.Tensor,
+                attention_mask: torch.Tensor,
+                ) -> torch.Tensor:
+        return self.output(self.self(hidden_states, attention_mask), hidden_states)
+
+
+class NativeBertIntermediate(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.dense = Linear(config.hidden_size, config.intermediate_size)
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return F.gelu(self.dense(hidden_states))  # exact (erf) GELU, as in pytorch_pretrained_bert
+
+
+class NativeBertLayer(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.attention = NativeBertAttention(config)
+        self.intermediate = NativeBertIntermediate(config)
+        self.output = NativeBertSelfOutput(config, config.intermediate_size)
+
+    def forward(self,
+                hidden_states: torch.Tensor,
+                attention_mask: torch.Tensor,
+                ) -> torch.Tensor:
+        attention_output = self.attention(hidden_states, attention_mask)
+        return self.output(self.intermediate(attention_output), attention_output)
+
+
+class NativeBertEncoder(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.layer = ModuleList([NativeBertLayer(config) for _ in range(config.num_hidden_layers)])
+
+    def forward(self,
+                hidden_states: torch.Tensor,
+                attention_mask: torch.Tensor,
+                ) -> List[torch.Tensor]:
+        res = []
+        for layer_module in self.layer:
+            hidden_states = layer_module(hidden_states, attention_mask)
+            res.append(hidden_states)
+        return res
+
+
+class NativeBertPooler(Module):
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        self.dense = Linear(config.hidden_size, config.hidden_size)
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return torch.tanh(self.dense(hidden_states[:, 0]))
+
+
+class NativeBertModel(Module):
+    """
+    BERT encoder with the same interface and parameter names as pytorch_pretrained_bert.BertModel.
+    """
+
+    def __init__(self, config: BertConfig):
+        super().__init__()
+        if config.hidden_act != 'gelu':
+            raise ValueError('Only hidden_act="gelu" is supported')
+        self.config = config
+        self.embeddings = NativeBertEmbeddings(config)
+        self.encoder = NativeBertEncoder(config)
+        self.pooler = NativeBertPooler(config)
+        self.apply(self.init_bert_weights)
+
+    def init_bert_weights(self, module: Module) -> None:
+        """same initialization as pytorch_pretrained_bert"""
+        if isinstance(module, (Linear, Embedding)):
+            module.weight.data.normal_(mean=0.0, std=self.config.initializer_range)
+        elif isinstance(module, LayerNorm):
+            module.weight.data.fill_(1.0)
+            module.bias.data.zero_()
+        if isinstance(module, Linear) and module.bias is not None:
+            module.bias.data.zero_()
+
+    @classmethod
+    def from_legacy(cls, bert_model: BertModel) -> 'NativeBertModel':
+        """make a native encoder with the weights of a pytorch_pretrained_bert.BertModel"""
+        res = cls(bert_model.config)
+        res.load_state_dict(bert_model.state_dict())
+        return res.to(next(bert_model.parameters()).device)
+
+    def forward(self,
+                input_ids: torch.Tensor,
+                token_type_ids: Optional[torch.Tensor] = None,
+                attention_mask: Optional[torch.Tensor] = None,
+                output_all_encoded_layers: bool = True,
+                ) -> Tuple[Union[List[torch.Tensor], torch.Tensor], torch.Tensor]:
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+
+        # padding-aware attention: [batch_size, 1, 1, sequence_length] broadcasts over heads and queries
+        attention_mask = attention_mask.bool()[:, None, None, :]
+
+        embedding_output = self.embeddings(input_ids, token_type_ids)
+        encoded_layers = self.encoder(embedding_output, attention_mask)
+        pooled_output = self.pooler(encoded_layers[-1])
+        if not output_all_encoded_layers:
+            encoded_layers = encoded_layers[-1]
+        return encoded_layers, pooled_output
+
+
+def make_bert_model(encoder: str,
+                    config: BertConfig,
+                    ) -> Module:
+    """
+    "legacy" is pytorch_pretrained_bert.BertModel, "native" uses fused attention.
+    """
+    if encoder == 'legacy':
+        return BertModel(config=config)
+    elif encoder == 'native':
+        return NativeBertModel(config=config)
+    else:
+        raise AttributeError('Invalid arg to "encoder"')
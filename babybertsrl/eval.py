@@ -1,16 +1,26 @@
 import torch
-from typing import Iterator, Optional
+from typing import Dict, Iterator, Optional, Tuple
 from pathlib import Path
 
 from babybertsrl.scorer import SrlEvalScorer, convert_bio_tags_to_conll_format
 from babybertsrl.model_mt import MTBert
+from babybertsrl.probing import ProbingData, NOUN, COPULA
+from babybertsrl.predictions import BackgroundWriter, encode_predictions, save_predictions
 
 
 def predict_masked_sentences(model: MTBert,
                              instances_generator: Iterator,
                              out_path: Path,
                              print_gold: bool = True,
-                             verbose: bool = False):
+                             verbose: bool = False,
+                             writer: Optional[BackgroundWriter] = None,
+                             ):
+    """
+    predict masked words, and save predictions to out_path.
+    if out_path ends with .npz, predictions are saved in binary format (see babybertsrl/predictions.py),
+    by writer in a background thread if given, and otherwise as text.
+    gold tags are not saved unless print_gold is True.
+    """
     model.eval()
 
     mlm_in = []
@@ -30,6 +40,18 @@ def predict_masked_sentences(model: MTBert,
         gold_mlm_tags += output_dict['gold_tags']
         assert len(mlm_in) == len(predicted_mlm_tags) == len(gold_mlm_tags)
 
+    # save to binary file
+    if out_path.suffix == '.npz':
+        print(f'Saving MLM prediction results to {out_path}')
+        if not print_gold:
+            gold_mlm_tags = [[] for _ in mlm_in]
+        predictions = encode_predictions(mlm_in, predicted_mlm_tags, gold_mlm_tags)
+        if writer is not None:
+            writer.submit(save_predictions, out_path, predictions)
+        else:
+            save_predictions(out_path, predictions)
+        return
+
     # save to file
     print(f'Saving MLM prediction results to {out_path}')
     with out_path.open('w') as f:
@@ -46,12 +68,52 @@ def predict_masked_sentences(model: MTBert,
     print('Done')
 
 
+def evaluate_model_on_agreement(model: MTBert,
+                                probing_data: ProbingData,
+                                candidate_ids: Dict[Tuple[int, bool], torch.Tensor],
+                                batch_size: int = 512,
+                                ) -> float:
+    """
+    proportion of probing sentences in which the best plural candidate at the [MASK] scores higher
+    than the best singular candidate if and only if the correct word is plural.
+    logits of all sentences in a batch are compared at once.
+    """
+    model.eval()
+
+    num_correct = 0
+    for start in range(0, len(probing_data), batch_size):
+        token_ids = probing_data.token_ids[start: start + batch_size]
+        indicator = probing_data.indicator[start: start + batch_size]
+        mask = (token_ids != 0).long()
+        max_length = int(mask.sum(dim=1).max())
+        token_ids, indicator, mask = token_ids[:, :max_length], indicator[:, :max_length], mask[:, :max_length]
+
+        # logits at [MASK] position
+        with torch.no_grad():
+            logits_fn = model.get_logits_fn('mlm', token_ids, indicator, mask)
+            logits = logits_fn(token_ids, indicator, mask)
+        logits_at_mask = logits[torch.arange(len(logits), device=logits.device), indicator.argmax(dim=1)]
+
+        # best singular and plural candidate of each sentence, depending on the kind of sentence
+        is_noun = probing_data.kinds[start: start + batch_size] == NOUN
+        best = {}
+        for is_plural in [False, True]:
+            best_noun = logits_at_mask[:, candidate_ids[NOUN, is_plural]].max(dim=1).values
+            best_copula = logits_at_mask[:, candidate_ids[COPULA, is_plural]].max(dim=1).values
+            best[is_plural] = torch.where(is_noun, best_noun, best_copula)
+
+        predicted_plural = best[True] > best[False]
+        num_correct += (predicted_plural == probing_data.is_plural[start: start + batch_size]).sum().item()
+
+    return num_correct / max(1, len(probing_data))
+
+
 def evaluate_model_on_pp(model: MTBert,
                          instances_generator: Iterator,
                          ) -> float:
     model.eval()
 
-    pp_sum = torch.zeros(size=(1,)).cuda()
+    pp_sum = torch.zeros(size=(1,), device=model.device)
     num_steps = 0
     for step, batch in enumerate(instances_generator):
 
@@ -80,7 +142,8 @@ def evaluate_model_on_f1(model: MTBert,
     for step, batch in enumerate(instances_generator):
 
         # get predictions
-        output_dict = model(task='srl', **batch)  # input is dict[str, tensor]
+        with torch.no_grad():
+            output_dict = model(task='srl', **batch)  # input is dict[str, tensor]
 
         # metadata
         metadata = batch['metadata']
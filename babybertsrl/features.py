@@ -0,0 +1,127 @@
+"""
+a cache of contextualized word-piece embeddings of SRL propositions, computed once by a frozen encoder,
+such that SRL heads (e.g. a linear probe) can be trained on them without running the encoder again.
+
+a feature cache is a directory containing:
+ - features.npy: float16, [num_word_pieces, hidden_size], loaded memory-mapped
+ - tag_ids.npy: int32, [num_word_pieces], ids into tags.txt of the word-piece tag of each row
+ - sentence_offsets.npy, word_offsets.npy, start_offsets.npy: as in word_pieces.EncodedCorpus
+ - tags.txt: the table of word-piece tags
+ - propositions: the propositions, saved with PropositionStore.save()
+"""
+
+import hashlib
+from pathlib import Path
+from typing import List, NamedTuple
+import numpy as np
+import torch
+
+from babybertsrl import config
+from babybertsrl.model_mt import MTBert
+from babybertsrl.proposition_store import PropositionStore, get_cache_key
+from babybertsrl.word_pieces import CachedWordpieceTokenizer, encode_bio_tags, decode_bio_tags
+from babybertsrl.word_pieces import convert_tags_to_wordpiece_tags_batch, convert_verb_indices_to_wordpiece_indices_batch
+
+ARRAY_NAMES = ['features', 'tag_ids', 'sentence_offsets', 'word_offsets', 'start_offsets']
+
+
+class FeatureCache(NamedTuple):
+    features: np.ndarray
+    tag_ids: np.ndarray
+    sentence_offsets: np.ndarray
+    word_offsets: np.ndarray
+    start_offsets: np.ndarray
+    tags: List[str]
+    propositions: PropositionStore
+
+
+def get_cache_path(checkpoint_path: Path,
+                   srl_path: Path,
+                   ) -> Path:
+    """features depend on the weights of the encoder, and the propositions loaded from the SRL data"""
+    h = hashlib.sha1((checkpoint_path / 'state_dict.pt').read_bytes())
+    h.update(get_cache_key(srl_path).encode())  # propositions are loaded with the length filter
+    return config.Dirs.cache / 'features' / f'{srl_path.stem}_{h.hexdigest()}'
+
+
+def make_feature_cache(model: MTBert,
+                       wordpiece_tokenizer: CachedWordpieceTokenizer,
+                       store: PropositionStore,
+                       cache_path: Path,
+                       batch_size: int = 256,
+                       ) -> None:
+    """
+    run the encoder once over all propositions, and write the embedding of each word piece to cache_path.
+    """
+    print(f'Caching features of {len(store):,} propositions in {cache_path}')
+    cache_path.mkdir(parents=True, exist_ok=True)
+    store.save(cache_path / 'propositions')
+
+    # to word pieces - as in ConverterSRL.make_instances()
+    encoded = wordpiece_tokenizer.encode_word_ids(store.word_ids, store.offsets, store.words)
+    verb_indices = np.zeros(len(store.word_ids), dtype=np.int32)
+    verb_indices[store.offsets[:-1] + np.asarray(store.predicate_indices, dtype=np.int64)] = 1
+    verb_indices_wp = convert_verb_indices_to_wordpiece_indices_batch(verb_indices, encoded)
+    label2id = {}
+    type_bio, type_label_ids = encode_bio_tags(store.tags, label2id)
+    bio_wp, label_ids_wp = convert_tags_to_wordpiece_tags_batch(type_bio[store.tag_ids],
+                                                                type_label_ids[store.tag_ids],
+                                                                encoded)
+    tag2id = {}
+    tag_ids = np.array([tag2id.setdefault(tag, len(tag2id))
+                        for tag in decode_bio_tags(bio_wp, label_ids_wp, sorted(label2id, key=label2id.get))],
+                       dtype=np.int32)
+
+    # encode batches of propositions of similar length, and write embeddings in order of propositions
+    hidden_size = model.bert_model.config.hidden_size
+    features = np.lib.format.open_memmap(cache_path / 'features.npy', mode='w+',
+                                         dtype=np.float16, shape=(len(encoded.ids), hidden_size))
+    lengths = np.diff(encoded.sentence_offsets)
+    model.eval()
+    for batch_ids in np.array_split(np.argsort(lengths, kind='stable'), max(1, len(lengths) // batch_size)):
+        max_length = int(lengths[batch_ids].max())
+        input_ids = torch.zeros(len(batch_ids), max_length, dtype=torch.long)
+        indicator = torch.zeros(len(batch_ids), max_length, dtype=torch.long)
+        for row, n in enumerate(batch_ids):
+            start, end = encoded.sentence_offsets[n], encoded.sentence_offsets[n + 1]
+            input_ids[row, :end - start] = torch.from_numpy(encoded.ids[start: end].astype(np.int64))
+            indicator[row, :end - start] = torch.from_numpy(verb_indices_wp[start: end].astype(np.int64))
+        input_ids = input_ids.to(model.device)
+        indicator = indicator.to(model.device)
+        mask = (input_ids != 0).long()
+
+        with torch.no_grad(), model.autocast():
+            embeddings, _ = model.bert_model(input_ids=input_ids,
+                                             token_type_ids=indicator,
+                                             attention_mask=mask,
+                                             output_all_encoded_layers=False)
+        embeddings = embeddings.half().cpu().numpy()
+        for row, n in enumerate(batch_ids):
+            start, end = encoded.sentence_offsets[n], encoded.sentence_offsets[n + 1]
+            features[start: end] = embeddings[row, :end - start]
+
+    features.flush()
+    del features
+    np.save(cache_path / 'tag_ids.npy', tag_ids)
+    np.save(cache_path / 'sentence_offsets.npy', encoded.sentence_offsets)
+    np.save(cache_path / 'word_offsets.npy', encoded.word_offsets)
+    np.save(cache_path / 'start_offsets.npy', encoded.start_offsets)
+    (cache_path / 'tags.txt').write_text('\n'.join(sorted(tag2id, key=tag2id.get)) + '\n')
+
+
+def load_feature_cache(cache_path: Path) -> FeatureCache:
+    name2array = {name: np.load(cache_path / f'{name}.npy', mmap_mode='r') for name in ARRAY_NAMES}
+    return FeatureCache(tags=(cache_path / 'tags.txt').read_text().split('\n')[:-1],
+                        propositions=PropositionStore.load(cache_path / 'propositions'),
+                        **name2array)
+
+
+def load_or_make_feature_cache(model: MTBert,
+                               wordpiece_tokenizer: CachedWordpieceTokenizer,
+                               checkpoint_path: Path,
+                               srl_path: Path,
+                               ) -> FeatureCache:
+    cache_path = get_cache_path(checkpoint_path, srl_path)
+    if not (cache_path / 'tags.txt').exists():  # written last
+        make_feature_cache(model, wordpiece_tokenizer, PropositionStore.from_file(srl_path), cache_path)
+    return load_feature_cache(cache_path)
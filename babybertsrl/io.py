@@ -1,74 +1,62 @@
+import gzip
+import hashlib
 import numpy as np
-from typing import List
+from collections import Counter
+from typing import Dict, Generator, Iterable, List, Optional, TextIO, Tuple, Union
 from pathlib import Path
-import random
-from collections import OrderedDict
 
 from babybertsrl import config
 
 
-def load_childes_vocab(vocab_file, vocab_size):
-
-    vocab = OrderedDict()
-    vocab['[PAD]'] = 0
-    vocab['[UNK]'] = 1
-    vocab['[CLS]'] = 2
-    vocab['[SEP]'] = 3
-    vocab['[MASK]'] = 4
-    index = 5
-    with open(vocab_file, "r", encoding="utf-8") as reader:
-        while len(vocab) < vocab_size + 5:
-            line = reader.readline()
-            if not line:
-                break
-            token = line.split()[1]
-            vocab[token] = index
-            index += 1
-    return vocab
-
-
-def load_vocab(childes_vocab_file, google_vocab_file, vocab_size):
-
-    childes_vocab = set([w for w, i in load_childes_vocab(childes_vocab_file, vocab_size).items()])
-    print(childes_vocab)
-
-    vocab = OrderedDict()
-    index = 0
-    with open(google_vocab_file, "r", encoding="utf-8") as reader:
-        while True:
-            token = reader.readline()
-            if not token:
-                break
-            if token not in childes_vocab:
-                # print(token)
-                continue
-            token = token.strip()
-            vocab[token] = index
-            index += 1
-
-    print(vocab)
+def get_split_key(item) -> bytes:
+    """
+    the content of an utterance or proposition, which determines its split.
+    a proposition is identified by its words and predicate, such that duplicates end up in the same split.
+    """
+    if isinstance(item, tuple):
+        words, predicate_index, _ = item
+        return f'{predicate_index} {" ".join(words)}'.encode('utf-8')
+    else:
+        return ' '.join(item).encode('utf-8')
 
-    return vocab
 
+def hash_to_unit_interval(keys: Iterable[bytes],
+                          salt: bytes,
+                          ) -> np.ndarray:
+    """
+    map each key to a number in [0, 1) by a stable hash, which does not depend on the other keys.
+    """
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(key, digest_size=8, key=salt).digest(), 'little')
+                          for key in keys), dtype=np.uint64)
+    return hashes / 2 ** 64
 
-def split(data: List, seed: int = 2):
 
-    random.seed(seed)
+def assign_splits(data: Iterable,
+                  seed: int = 2,
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    whether each item is in the train, devel or test split, by a stable hash of its content, salted with seed.
+    the assignment of an item does not depend on any other item,
+    such that adding or removing items does not change the split of the remaining items.
+    the global random state is not used.
+    """
+    u = hash_to_unit_interval((get_split_key(i) for i in data), salt=str(seed).encode())
+    is_train = u < config.Data.train_prob
+    is_devel = ~is_train & (u < config.Data.train_prob + (1 - config.Data.train_prob) / 2)
+    is_test = ~is_train & ~is_devel
+    return is_train, is_devel, is_test
 
-    train = []
-    devel = []
-    test = []
 
-    for i in data:
+def split(data: List, seed: int = 2):
+    """
+    split items into train, devel and test, as assigned by assign_splits().
+    see data_tools/find_near_duplicates.py for sentences of devel and test which (nearly) occur in train.
+    """
+    is_train, is_devel, is_test = assign_splits(data, seed)
 
-        if random.choices([True, False],
-                          weights=[config.Data.train_prob, 1 - config.Data.train_prob])[0]:
-            train.append(i)
-        else:
-            if random.choices([True, False], weights=[0.5, 0.5])[0]:
-                devel.append(i)
-            else:
-                test.append(i)
+    train = [data[i] for i in np.flatnonzero(is_train)]
+    devel = [data[i] for i in np.flatnonzero(is_devel)]
+    test = [data[i] for i in np.flatnonzero(is_test)]
 
     print(f'num train={len(train):,}')
     print(f'num devel={len(devel):,}')
@@ -77,25 +65,93 @@ def split(data: List, seed: int = 2):
     return train, devel, test
 
 
-def load_utterances_from_file(file_path: Path,
-                              ) -> List[List[str]]:
+def open_text(file_path: Path) -> TextIO:
     """
-    load utterances for language modeling from text file
+    open a text file for reading, decompressing it on the fly if it ends with .gz or .zst
     """
+    if file_path.suffix == '.gz':
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    elif file_path.suffix == '.zst':
+        import io
+        import zstandard  # optional dependency, only needed for zstd-compressed corpora
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(file_path.open('rb')), encoding='utf-8')
+    else:
+        return file_path.open('r', encoding='utf-8')
 
-    print(f'Loading {file_path}')
 
-    res = []
+class LengthStats:
+    """
+    running statistics of sequence lengths, and counts of sequences skipped because of their length.
+    lengths are kept in a histogram, such that the median is exact without storing all lengths.
+    """
+
+    def __init__(self):
+        self.length2count = Counter()
+        self.num_too_small = 0
+        self.num_too_large = 0
+
+    def add(self, length: int) -> None:
+        self.length2count[length] += 1
+
+    @property
+    def num(self) -> int:
+        return sum(self.length2count.values())
+
+    @property
+    def max(self) -> int:
+        return max(self.length2count)
+
+    @property
+    def mean(self) -> float:
+        return sum(length * count for length, count in self.length2count.items()) / self.num
+
+    @property
+    def median(self) -> float:
+        lengths = sorted(self.length2count)
+        counts = np.cumsum([self.length2count[length] for length in lengths])
+        lower = lengths[np.searchsorted(counts, (self.num - 1) // 2, side='right')]
+        upper = lengths[np.searchsorted(counts, self.num // 2, side='right')]
+        return (lower + upper) / 2
+
+    def print_summary(self, name: str) -> None:
+        print(f'WARNING: Skipped {self.num_too_small} {name}s which are shorter than {config.Data.min_input_length}.')
+        print(f'WARNING: Skipped {self.num_too_large} {name}s which are larger than {config.Data.max_input_length}.')
+
+        print('Found {:,} {}s'.format(self.num, name))
+        if self.num:
+            print(f'Max    {name} length: {self.max:.2f}')
+            print(f'Mean   {name} length: {self.mean:.2f}')
+            print(f'Median {name} length: {self.median:.2f}')
+        print()
+
+
+def encode_words(words: List[str],
+                 word2id: Dict[str, int],
+                 ) -> np.ndarray:
+    """
+    map words to integer ids, adding new words to word2id
+    """
+    return np.array([word2id.setdefault(w, len(word2id)) for w in words], dtype=np.int32)
+
+
+def gen_utterances_from_file(file_path: Path,
+                             stats: Optional[LengthStats] = None,
+                             word2id: Optional[Dict[str, int]] = None,
+                             ) -> Generator[Union[List[str], np.ndarray], None, None]:
+    """
+    stream utterances for language modeling from (optionally compressed) text file, one line at a time.
+    utterances which are too short or too long are skipped, and counted in stats.
+    if word2id is given, yield an array of word ids instead of a list of words.
+    """
+    if stats is None:
+        stats = LengthStats()
     punctuation = {'.', '?', '!'}
-    num_too_small = 0
-    num_too_large = 0
-    with file_path.open('r') as f:
+    with open_text(file_path) as f:
 
-        for line in f.readlines():
+        for line in f:
 
             # tokenize transcript
-            transcript = line.strip().split()  # a transcript containing multiple utterances
-            transcript = [w for w in transcript]
+            transcript = line.split()  # a transcript containing multiple utterances
 
             # split transcript into utterances
             utterances = [[]]
@@ -109,73 +165,90 @@ def load_utterances_from_file(file_path: Path,
 
                 # check  length
                 if len(utterance) < config.Data.min_input_length:
-                    num_too_small += 1
+                    stats.num_too_small += 1
                     continue
                 if len(utterance) > config.Data.max_input_length:
-                    num_too_large += 1
+                    stats.num_too_large += 1
                     continue
 
-                res.append(utterance)
+                stats.add(len(utterance))
+                if word2id is None:
+                    yield utterance
+                else:
+                    yield encode_words(utterance, word2id)
 
-    print(f'WARNING: Skipped {num_too_small} utterances which are shorter than {config.Data.min_input_length}.')
-    print(f'WARNING: Skipped {num_too_large} utterances which are larger than {config.Data.max_input_length}.')
 
-    lengths = [len(u) for u in res]
-    print('Found {:,} utterances'.format(len(res)))
-    print(f'Max    utterance length: {np.max(lengths):.2f}')
-    print(f'Mean   utterance length: {np.mean(lengths):.2f}')
-    print(f'Median utterance length: {np.median(lengths):.2f}')
-    print()
+def load_utterances_from_file(file_path: Path,
+                              ) -> List[List[str]]:
+    """
+    load utterances for language modeling from text file
+    """
+
+    print(f'Loading {file_path}')
+
+    stats = LengthStats()
+    res = list(gen_utterances_from_file(file_path, stats))
+    stats.print_summary('utterance')
 
     return res
 
 
-def load_propositions_from_file(file_path):
+def gen_propositions_from_file(file_path: Path,
+                               stats: Optional[LengthStats] = None,
+                               word2id: Optional[Dict[str, int]] = None,
+                               tag2id: Optional[Dict[str, int]] = None,
+                               filter_lengths: bool = True,
+                               ) -> Generator[Tuple[Union[List[str], np.ndarray], int, Union[List[str], np.ndarray]],
+                                              None, None]:
     """
-    Read tokenized propositions from file.
+    stream tokenized propositions from (optionally compressed) file, one line at a time.
     File format: {predicate_id} [word0, word1 ...] ||| [label0, label1 ...]
-    Return:
-        A list with elements of structure [[words], predicate position, [labels]]
+    propositions which are too short or too long are skipped, and counted in stats, unless filter_lengths is False.
+    if word2id and tag2id are given, yield arrays of word and tag ids instead of lists of strings.
     """
+    if stats is None:
+        stats = LengthStats()
+    with open_text(file_path) as f:
 
-    print(f'Loading {file_path}')
-
-    num_too_small = 0
-    num_too_large = 0
-    res = []
-    with file_path.open('r') as f:
-
-        for line in f.readlines():
+        for line in f:
 
-            inputs = line.strip().split('|||')
-            left_input = inputs[0].strip().split()
-            right_input = inputs[1].strip().split()
+            left_input, right_input = line.split('|||')
+            left_input = left_input.split()
 
             # predicate
             predicate_index = int(left_input[0])
 
             # words + labels
             words = left_input[1:]
-            labels = right_input
+            labels = right_input.split()
 
             # check  length
-            if len(words) <= config.Data.min_input_length:
-                num_too_small += 1
+            if filter_lengths and len(words) <= config.Data.min_input_length:
+                stats.num_too_small += 1
                 continue
-            if len(words) > config.Data.max_input_length:
-                num_too_large += 1
+            if filter_lengths and len(words) > config.Data.max_input_length:
+                stats.num_too_large += 1
                 continue
 
-            res.append((words, predicate_index, labels))
+            stats.add(len(words))
+            if word2id is None or tag2id is None:
+                yield words, predicate_index, labels
+            else:
+                yield encode_words(words, word2id), predicate_index, encode_words(labels, tag2id)
+
 
-    print(f'WARNING: Skipped {num_too_small} propositions which are shorter than {config.Data.min_input_length}.')
-    print(f'WARNING: Skipped {num_too_large} propositions which are larger than {config.Data.max_input_length}.')
+def load_propositions_from_file(file_path):
+    """
+    Read tokenized propositions from file.
+    File format: {predicate_id} [word0, word1 ...] ||| [label0, label1 ...]
+    Return:
+        A list with elements of structure [[words], predicate position, [labels]]
+    """
+
+    print(f'Loading {file_path}')
 
-    lengths = [len(p[0]) for p in res]
-    print('Found {:,} propositions'.format(len(res)))
-    print(f'Max    proposition length: {np.max(lengths):.2f}')
-    print(f'Mean   proposition length: {np.mean(lengths):.2f}')
-    print(f'Median proposition length: {np.median(lengths):.2f}')
-    print()
+    stats = LengthStats()
+    res = list(gen_propositions_from_file(file_path, stats))
+    stats.print_summary('proposition')
 
     return res
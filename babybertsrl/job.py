@@ -5,31 +5,37 @@ import attr
 from pathlib import Path
 import torch
 import random
-from itertools import chain
 
 from allennlp.data.vocabulary import Vocabulary
 from allennlp.data.iterators import BucketIterator
 from allennlp.training.util import move_optimizer_to_cuda
 
 from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
-from pytorch_pretrained_bert.modeling import BertModel, BertConfig
+from pytorch_pretrained_bert.modeling import BertConfig
 from pytorch_pretrained_bert import BertAdam
 
 from babybertsrl import config
 from babybertsrl.io import load_utterances_from_file
 from babybertsrl.io import load_propositions_from_file
-from babybertsrl.io import load_vocab
 from babybertsrl.io import split
 from babybertsrl.converter import ConverterMLM, ConverterSRL
+from babybertsrl.word_pieces import CachedWordpieceTokenizer
 from babybertsrl.eval import evaluate_model_on_pp
 from babybertsrl.eval import predict_masked_sentences
 from babybertsrl.model_mt import MTBert
+from babybertsrl.encoder import make_bert_model
+from babybertsrl.checkpoint import save_checkpoint
+from babybertsrl.vocab import make_vocab, save_vocab
 from babybertsrl.eval import evaluate_model_on_f1
+from babybertsrl.eval import evaluate_model_on_agreement
+from babybertsrl.probing import load_probing_data, make_candidate_ids
+from babybertsrl.predictions import BackgroundWriter
 
 
 @attr.s
 class Params(object):
     batch_size = attr.ib(validator=attr.validators.instance_of(int))
+    micro_batch_size = attr.ib(validator=attr.validators.instance_of(int))
     lr = attr.ib(validator=attr.validators.instance_of(float))
     embedding_dropout = attr.ib(validator=attr.validators.instance_of(float))
     num_layers = attr.ib(validator=attr.validators.instance_of(int))
@@ -42,6 +48,9 @@ class Params(object):
     num_masked = attr.ib(validator=attr.validators.instance_of(int))
     vocab_size = attr.ib(validator=attr.validators.instance_of(int))
     corpus_name = attr.ib(validator=attr.validators.instance_of(str))
+    precision = attr.ib(validator=attr.validators.in_(['fp32', 'bf16', 'fp16']))
+    encoder = attr.ib(validator=attr.validators.in_(['legacy', 'native']))
+    compile_mode = attr.ib(validator=attr.validators.in_(['none', 'compile', 'trace']))
 
     @classmethod
     def from_param2val(cls, param2val):
@@ -72,16 +81,12 @@ def main(param2val):
     childes_vocab_path = project_path / 'data' / f'{params.corpus_name}_vocab.txt'
     google_vocab_path = project_path / 'data' / 'bert-base-cased.txt'  # to get word pieces
 
-    # word-piece tokenizer - defines input vocabulary
-    vocab = load_vocab(childes_vocab_path, google_vocab_path, params.vocab_size)
+    # word-piece tokenizer - defines input vocabulary (ids of special tokens are checked when making vocab)
+    vocab = make_vocab(childes_vocab_path, google_vocab_path, params.vocab_size)
+    save_vocab(vocab, save_path / 'vocab.txt')
     # TODO testing google vocab with wordpieces
 
-    assert vocab['[PAD]'] == 0  # AllenNLP expects this
-    assert vocab['[UNK]'] == 1  # AllenNLP expects this
-    assert vocab['[CLS]'] == 2
-    assert vocab['[SEP]'] == 3
-    assert vocab['[MASK]'] == 4
-    wordpiece_tokenizer = WordpieceTokenizer(vocab)
+    wordpiece_tokenizer = CachedWordpieceTokenizer(WordpieceTokenizer(vocab))  # shared by MLM and SRL converters
     print(f'Number of types in vocab={len(vocab):,}')
 
     # load utterances for MLM task
@@ -104,11 +109,11 @@ def main(param2val):
 
     # get output_vocab
     # note: Allen NLP vocab holds labels, wordpiece_tokenizer.vocab holds input tokens
-    # what from_instances() does:
-    # 1. it iterates over all instances, and all fields, and all token indexers
-    # 2. the token indexer is used to update vocabulary count, skipping words whose text_id is already set
-    # 4. a PADDING and MASK symbol are added to 'tokens' namespace resulting in vocab size of 2
+    # the 'labels' namespace is built from the tags counted by the converters while making instances,
+    # which is equivalent to Vocabulary.from_instances() but does not iterate over instances:
+    # labels are ordered by count, and ties are broken by order of first occurrence.
     # input tokens are not indexed, as they are already indexed by bert tokenizer vocab.
+    # a PADDING and OOV symbol are added to 'tokens' namespace resulting in vocab size of 2
     # this ensures that the model is built with inputs for all vocab words,
     # such that words that occur only in LM or SRL task can still be input
 
@@ -119,14 +124,14 @@ def main(param2val):
     train_instances_srl = converter_srl.make_instances(train_propositions)
     devel_instances_srl = converter_srl.make_instances(devel_propositions)
     test_instances_srl = converter_srl.make_instances(test_propositions)
-    all_instances_mlm = chain(train_instances_mlm, devel_instances_mlm, test_instances_mlm)
-    all_instances_srl = chain(train_instances_srl, devel_instances_srl, test_instances_srl)
-
-    # make vocab from all instances
-    output_vocab_mlm = Vocabulary.from_instances(all_instances_mlm)
-    output_vocab_srl = Vocabulary.from_instances(all_instances_srl)
-    # print(f'mlm vocab size={output_vocab_mlm.get_vocab_size()}')  # contain just 2 tokens
-    # print(f'srl vocab size={output_vocab_srl.get_vocab_size()}')  # contain just 2 tokens
+
+    # make vocab from tags of all instances
+    output_vocab_mlm = Vocabulary(counter={'labels': converter_mlm.label_counter})
+    output_vocab_srl = Vocabulary(counter={'labels': converter_srl.label_counter})
+    output_vocab_mlm.save_to_files(str(save_path / 'vocab_mlm'))
+    output_vocab_srl.save_to_files(str(save_path / 'vocab_srl'))
+    print(f'Number of MLM labels={output_vocab_mlm.get_vocab_size("labels"):,}')
+    print(f'Number of SRL labels={output_vocab_srl.get_vocab_size("labels"):,}')
     assert output_vocab_mlm.get_vocab_size('tokens') == output_vocab_srl.get_vocab_size('tokens')
 
     # BERT
@@ -137,21 +142,25 @@ def main(param2val):
                              num_hidden_layers=params.num_layers,  # was 12
                              num_attention_heads=params.num_attention_heads,  # was 12
                              intermediate_size=params.intermediate_size)  # was 3072
-    bert_model = BertModel(config=bert_config)
+    bert_model = make_bert_model(params.encoder, bert_config)
     # Multi-tasking BERT
     mt_bert = MTBert(vocab_mlm=output_vocab_mlm,
                      vocab_srl=output_vocab_srl,
                      bert_model=bert_model,
-                     embedding_dropout=params.embedding_dropout)
-    mt_bert.cuda()
+                     embedding_dropout=params.embedding_dropout,
+                     precision=params.precision,
+                     compile_mode=params.compile_mode)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    mt_bert.to(device)
     num_params = sum(p.numel() for p in mt_bert.parameters() if p.requires_grad)
     print('Number of model parameters: {:,}'.format(num_params), flush=True)
 
     # optimizers
     optimizer_mlm = BertAdam(params=mt_bert.parameters(), lr=params.lr)
     optimizer_srl = BertAdam(params=mt_bert.parameters(), lr=params.lr)
-    move_optimizer_to_cuda(optimizer_mlm)
-    move_optimizer_to_cuda(optimizer_srl)
+    if device.type == 'cuda':
+        move_optimizer_to_cuda(optimizer_mlm)
+        move_optimizer_to_cuda(optimizer_srl)
 
     # batching
     bucket_batcher_mlm = BucketIterator(batch_size=params.batch_size, sorting_keys=[('tokens', "num_tokens")])
@@ -165,11 +174,20 @@ def main(param2val):
     bucket_batcher_mlm_large.index_with(output_vocab_mlm)
     bucket_batcher_srl_large.index_with(output_vocab_srl)
 
+    # probing data - loaded and tensorized once
+    probing_data_list = load_probing_data(project_path / 'data' / 'probing', converter_mlm, output_vocab_mlm, device)
+    candidate_ids = make_candidate_ids(output_vocab_mlm, device) if probing_data_list else None
+
+    # prediction files are written in the background
+    writer = BackgroundWriter()
+
     # init performance collection
     name2col = {
         'devel_pps': [],
         'devel_f1s': [],
     }
+    for probing_data in probing_data_list:
+        name2col[f'probing_{probing_data.name}_accuracies'] = []
 
     # init
     eval_steps = []
@@ -189,6 +207,7 @@ def main(param2val):
     print(f'Will stop training at step={max_step:,}')
 
 
+    random.seed(2)  # the order of tasks is random when srl_interleaved
     while step < max_step:
 
         # TRAINING
@@ -204,16 +223,19 @@ def main(param2val):
                 else:
                     no_mlm_batches = True
             else:
-                loss_mlm = mt_bert.train_on_batch('mlm', batch_mlm, optimizer_mlm)
+                loss_mlm = mt_bert.train_on_batch('mlm', batch_mlm, optimizer_mlm,
+                                                  micro_batch_size=params.micro_batch_size)
 
             # semantic role labeling task
             if params.srl_interleaved:
                 if random.random() < params.srl_probability:
                     batch_srl = next(train_generator_srl)
-                    mt_bert.train_on_batch('srl', batch_srl, optimizer_srl)
+                    mt_bert.train_on_batch('srl', batch_srl, optimizer_srl,
+                                           micro_batch_size=params.micro_batch_size)
             elif no_mlm_batches:
                 batch_srl = next(train_generator_srl)
-                mt_bert.train_on_batch('srl', batch_srl, optimizer_srl)
+                mt_bert.train_on_batch('srl', batch_srl, optimizer_srl,
+                                       micro_batch_size=params.micro_batch_size)
 
         # EVALUATION
         if step % config.Eval.interval == 0:
@@ -229,30 +251,20 @@ def main(param2val):
             # test sentences
             if config.Eval.test_sentences:
                 test_generator_mlm = bucket_batcher_mlm_large(test_instances_mlm, num_epochs=1)
-                out_path = save_path / f'test_split_mlm_results_{step}.txt'
-                predict_masked_sentences(mt_bert, test_generator_mlm, out_path)
+                out_path = save_path / f'test_split_mlm_results_{step}.npz'
+                predict_masked_sentences(mt_bert, test_generator_mlm, out_path, writer=writer)
 
             # probing - test sentences for specific syntactic tasks
-            for name in config.Eval.probing_names:
-                # prepare data
-                probing_data_path_mlm = project_path / 'data' / 'probing' / f'{name}.txt'
-                if not probing_data_path_mlm.exists():
-                    print(f'WARNING: {probing_data_path_mlm} does not exist')
-                    continue
-                probing_utterances_mlm = load_utterances_from_file(probing_data_path_mlm)
-                # check that probing words are in vocab
-                for u in probing_utterances_mlm:
-                    # print(u)
-                    for w in u:
-                        if w == '[MASK]':
-                            continue  # not in output vocab
-                        # print(w)
-                        assert output_vocab_mlm.get_token_index(w, namespace='labels'), w
-                # probing + save results to text
-                probing_instances_mlm = converter_mlm.make_probing_instances(probing_utterances_mlm)
-                probing_generator_mlm = bucket_batcher_mlm(probing_instances_mlm, num_epochs=1)
-                out_path = save_path / f'probing_{name}_results_{step}.txt'
-                predict_masked_sentences(mt_bert, probing_generator_mlm, out_path, print_gold=False, verbose=True)
+            for probing_data in probing_data_list:
+                accuracy = evaluate_model_on_agreement(mt_bert, probing_data, candidate_ids)
+                name2col[f'probing_{probing_data.name}_accuracies'].append(accuracy)
+                print(f'probing {probing_data.name} accuracy={accuracy:.4f}', flush=True)
+                # save results to text
+                if config.Eval.save_probing_predictions:
+                    probing_generator_mlm = bucket_batcher_mlm(probing_data.instances, num_epochs=1)
+                    out_path = save_path / f'probing_{probing_data.name}_results_{step}.npz'
+                    predict_masked_sentences(mt_bert, probing_generator_mlm, out_path, print_gold=False,
+                                             writer=writer)
 
             # evaluate devel f1
             devel_generator_srl = bucket_batcher_srl_large(devel_instances_srl, num_epochs=1)
@@ -289,22 +301,23 @@ def main(param2val):
     # test sentences
     if config.Eval.test_sentences:
         test_generator_mlm = bucket_batcher_mlm(test_instances_mlm, num_epochs=1)
-        out_path = save_path / f'test_split_mlm_results_{step}.txt'
-        predict_masked_sentences(mt_bert, test_generator_mlm, out_path)
+        out_path = save_path / f'test_split_mlm_results_{step}.npz'
+        predict_masked_sentences(mt_bert, test_generator_mlm, out_path, writer=writer)
 
     # probing - test sentences for specific syntactic tasks
-    for name in config.Eval.probing_names:
-        # prepare data
-        probing_data_path_mlm = project_path / 'data' / 'probing' / f'{name}.txt'
-        if not probing_data_path_mlm.exists():
-            print(f'WARNING: {probing_data_path_mlm} does not exist')
-            continue
-        probing_utterances_mlm = load_utterances_from_file(probing_data_path_mlm)
-        probing_instances_mlm = converter_mlm.make_probing_instances(probing_utterances_mlm)
+    for probing_data in probing_data_list:
+        accuracy = evaluate_model_on_agreement(mt_bert, probing_data, candidate_ids)
+        print(f'probing {probing_data.name} accuracy={accuracy:.4f}', flush=True)
         # batch and do inference
-        probing_generator_mlm = bucket_batcher_mlm(probing_instances_mlm, num_epochs=1)
-        out_path = save_path / f'probing_{name}_results_{step}.txt'
-        predict_masked_sentences(mt_bert, probing_generator_mlm, out_path, print_gold=False, verbose=True)
+        if config.Eval.save_probing_predictions:
+            probing_generator_mlm = bucket_batcher_mlm(probing_data.instances, num_epochs=1)
+            out_path = save_path / f'probing_{probing_data.name}_results_{step}.npz'
+            predict_masked_sentences(mt_bert, probing_generator_mlm, out_path, print_gold=False, writer=writer)
+
+    writer.close()
+
+    # save model for inference, e.g. with int8 quantization (see data_tools/evaluate_quantized_model.py)
+    save_checkpoint(mt_bert, vocab, params, save_path / 'checkpoint')
 
     # put train-pp and train-f1 into pandas Series
     s1 = pd.Series([train_pp], index=[eval_steps[-1]])
@@ -1,4 +1,5 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Callable
+from functools import partial
 import torch
 from torch.nn import Linear, Dropout, functional as F
 from pytorch_pretrained_bert.modeling import BertModel
@@ -6,11 +7,79 @@ from pytorch_pretrained_bert.modeling import BertModel
 from allennlp.data import Vocabulary
 from allennlp.nn.util import get_text_field_mask
 from allennlp.nn.util import sequence_cross_entropy_with_logits
-from allennlp.nn.util import get_lengths_from_binary_sequence_mask
-from allennlp.nn.util import viterbi_decode
 from allennlp.training.util import rescale_gradients
 
 
+PRECISION2DTYPE = {
+    'fp32': torch.float32,
+    'bf16': torch.bfloat16,  # on CPU and on GPU
+    'fp16': torch.float16,  # on GPU only, requires loss scaling
+}
+
+
+def autocast(precision: str,
+             device: torch.device,
+             ):
+    """
+    context in which the BERT encoder and the projection layers run in reduced precision.
+    a no-op when precision is fp32.
+    """
+    if precision == 'fp16' and device.type != 'cuda':
+        raise AttributeError('Invalid arg to "precision": fp16 requires a GPU, use bf16 on CPU')
+    return torch.autocast(device_type=device.type,
+                          dtype=PRECISION2DTYPE[precision],
+                          enabled=precision != 'fp32')
+
+
+def compute_logits(bert_model: torch.nn.Module,
+                   embedding_dropout: torch.nn.Module,
+                   projection_layer: torch.nn.Module,
+                   precision: str,
+                   input_ids: torch.Tensor,
+                   indicator: torch.Tensor,
+                   mask: torch.Tensor,
+                   ) -> torch.Tensor:
+    with autocast(precision, input_ids.device):
+
+        # get BERT contextualized embeddings
+        bert_embeddings, _ = bert_model(input_ids=input_ids,
+                                        token_type_ids=indicator,
+                                        attention_mask=mask,
+                                        output_all_encoded_layers=False)
+        embedded_text_input = embedding_dropout(bert_embeddings)
+        logits = projection_layer(embedded_text_input)
+
+    # softmax and loss are computed in fp32 for numerical safety
+    return logits.float()
+
+
+class LogitsCore(torch.nn.Module):
+    """
+    the tensor computation of MTBert for a single task, so that it can be compiled or traced.
+    holds the encoder and the projection layer of the task, not MTBert, such that there is no reference cycle.
+    """
+
+    def __init__(self,
+                 bert_model: torch.nn.Module,
+                 embedding_dropout: torch.nn.Module,
+                 projection_layer: torch.nn.Module,
+                 precision: str,
+                 ):
+        super().__init__()
+        self.bert_model = bert_model
+        self.embedding_dropout = embedding_dropout
+        self.projection_layer = projection_layer
+        self.precision = precision
+
+    def forward(self,
+                input_ids: torch.Tensor,
+                indicator: torch.Tensor,
+                mask: torch.Tensor,
+                ) -> torch.Tensor:
+        return compute_logits(self.bert_model, self.embedding_dropout, self.projection_layer, self.precision,
+                              input_ids, indicator, mask)
+
+
 class MTBert(torch.nn.Module):
     """
     Multi-task BERT.
@@ -22,11 +91,19 @@ class MTBert(torch.nn.Module):
                  vocab_srl: Vocabulary,
                  bert_model: BertModel,
                  embedding_dropout: float = 0.0,
+                 precision: str = 'fp32',
+                 compile_mode: str = 'none',
                  ) -> None:
 
         super().__init__()
         self.bert_model = bert_model
 
+        # mixed precision - master weights always remain in fp32
+        if precision not in PRECISION2DTYPE:
+            raise AttributeError('Invalid arg to "precision"')
+        self.precision = precision
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
+
         self.vocab_mlm = vocab_mlm
         self.vocab_srl = vocab_srl
 
@@ -40,6 +117,70 @@ class MTBert(torch.nn.Module):
 
         self.embedding_dropout = Dropout(p=embedding_dropout)
 
+        # compilation of tensor computation ("none", "compile" for torch.compile, or "trace" for TorchScript)
+        if compile_mode not in {'none', 'compile', 'trace'}:
+            raise AttributeError('Invalid arg to "compile_mode"')
+        self.compile_mode = compile_mode
+        self._key2logits_fn = {}  # plain dict, such that compiled functions are not part of the state dict
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.parameters()).device
+
+    def autocast(self):
+        """
+        context in which the BERT encoder and the projection layers run in reduced precision.
+        a no-op when precision is fp32.
+        """
+        return autocast(self.precision, self.device)
+
+    def get_projection_layer(self, task: str) -> torch.nn.Module:
+        if task == 'mlm':
+            return self.projection_layer_mlm
+        elif task == 'srl':
+            return self.projection_layer_srl
+        else:
+            raise AttributeError('Invalid arg to "task"')
+
+    def compute_logits(self,
+                       task: str,
+                       input_ids: torch.Tensor,
+                       indicator: torch.Tensor,
+                       mask: torch.Tensor,
+                       ) -> torch.Tensor:
+        """
+        pure tensor computation of the forward pass, without metadata handling.
+        this is the part of the forward pass which is compiled when compile_mode is not "none".
+        """
+        return compute_logits(self.bert_model, self.embedding_dropout, self.get_projection_layer(task), self.precision,
+                              input_ids, indicator, mask)
+
+    def get_logits_fn(self,
+                      task: str,
+                      *example_inputs: torch.Tensor,
+                      ) -> Callable[..., torch.Tensor]:
+        """
+        return function mapping (input_ids, indicator, mask) to logits for a task.
+        compiled functions are made once, and re-used for all sequence lengths.
+        traced functions are made once per task and mode (train or eval), because dropout is traced as a constant.
+        """
+        projection_layer = self.get_projection_layer(task)
+        if self.compile_mode == 'none':
+            return partial(self.compute_logits, task)
+
+        key = (task, self.training)
+        if key not in self._key2logits_fn:
+            core = LogitsCore(self.bert_model, self.embedding_dropout, projection_layer, self.precision)
+            if self.compile_mode == 'compile':
+                self._key2logits_fn[key] = torch.compile(core, dynamic=True)
+            else:
+                self._key2logits_fn[key] = torch.jit.trace(core, example_inputs, check_trace=False)
+        return self._key2logits_fn[key]
+
+    def clear_logits_fns(self) -> None:
+        """must be called when modules are replaced (e.g. by quantization), because cores hold references to them"""
+        self._key2logits_fn.clear()
+
     def forward(self,
                 task: str,
                 tokens: Dict[str, torch.Tensor],
@@ -78,32 +219,20 @@ class MTBert(torch.nn.Module):
             A scalar loss to be optimised.
         """
 
-        # move to GPU
-        tokens['tokens'] = tokens['tokens'].cuda()
-        indicator = indicator.cuda()
+        # move to device of model
+        tokens['tokens'] = tokens['tokens'].to(self.device)
+        indicator = indicator.to(self.device)
         if tags is not None:
-            tags = tags.cuda()
+            tags = tags.to(self.device)
 
-        # get BERT contextualized embeddings
+        # tensor computation - possibly compiled
+        input_ids = tokens['tokens']
         mask = get_text_field_mask(tokens)
-        bert_embeddings, _ = self.bert_model(input_ids=tokens['tokens'],
-                                             token_type_ids=indicator,
-                                             attention_mask=mask,
-                                             output_all_encoded_layers=False)
-        embedded_text_input = self.embedding_dropout(bert_embeddings)
-        batch_size, sequence_length, _ = embedded_text_input.size()
-
-        # use correct head for task
-        if task == 'mlm':
-            logits = self.projection_layer_mlm(embedded_text_input)
-            num_out = self.num_out_mlm
-        elif task == 'srl':
-            logits = self.projection_layer_srl(embedded_text_input)
-            num_out = self.num_out_srl
-        else:
-            raise AttributeError('Invalid arg to "task"')
+        logits_fn = self.get_logits_fn(task, input_ids, indicator, mask)
+        logits = logits_fn(input_ids, indicator, mask)
 
         # compute output
+        batch_size, sequence_length, num_out = logits.size()
         reshaped_logits = logits.view(-1, num_out)  # collapse time steps and batches
         class_probabilities = F.softmax(reshaped_logits, dim=-1).view([batch_size,
                                                                        sequence_length,
@@ -140,11 +269,6 @@ class MTBert(torch.nn.Module):
         Note: decoding is performed on word-pieces, and word-pieces are then converted to whole words
         """
 
-        # get probabilities
-        all_predictions = output_dict['class_probabilities']
-        predictions_list = [all_predictions[i].detach().cpu() for i in range(all_predictions.size(0))]
-        sequence_lengths = get_lengths_from_binary_sequence_mask(output_dict['mask']).data.tolist()
-
         # vocab
         if task == 'mlm':
             vocab = self.vocab_mlm
@@ -154,39 +278,74 @@ class MTBert(torch.nn.Module):
             num_out = self.num_out_srl
         else:
             raise AttributeError('Invalid arg to "task"')
-
-        # ph: transition matrices contain only ones (and no -inf, which would signal illegal transition)
         all_labels = vocab.get_index_to_token_vocabulary("labels")
-        num_labels = len(all_labels)
-        assert num_out == num_labels
-        transition_matrix = torch.zeros([num_labels, num_labels])
+        assert num_out == len(all_labels)
+
+        # with a transition matrix of zeros (no -inf, which would signal illegal transition),
+        # viterbi decoding is the most likely tag at each word piece.
+        # this avoids building a [num_labels, num_labels] matrix, and a viterbi pass over it, per sentence
+        all_tag_ids = output_dict['class_probabilities'].argmax(dim=-1).cpu().tolist()
 
         # decode
         tags = []
-        for predictions, length, offsets, gold_tags in zip(predictions_list,
-                                                           sequence_lengths,
-                                                           output_dict['start_offsets'],
-                                                           output_dict['gold_tags']):
-            tag_probabilities = predictions[:length]
-            max_likelihood_tag_ids, _ = viterbi_decode(tag_probabilities,
-                                                       transition_matrix)
-            tags_word_pieces = [vocab.get_token_from_index(x, namespace="labels")
-                                for x in max_likelihood_tag_ids]
-            tags.append([tags_word_pieces[i] for i in offsets])
+        for tag_ids, offsets in zip(all_tag_ids, output_dict['start_offsets']):
+            tags.append([all_labels[tag_ids[i]] for i in offsets])
 
         return tags
 
-    def train_on_batch(self, task, batch, optimizer):
-        # forward + loss
+    def train_on_batch(self, task, batch, optimizer, micro_batch_size=None):
+        """
+        one optimizer step on a logical batch.
+        if micro_batch_size is smaller than the batch, the batch is split into micro-batches,
+        and gradients are accumulated before rescaling and updating, so that the effective batch size is unchanged.
+        """
         optimizer.zero_grad()
-        output_dict = self(task, **batch)  # input is dict[str, tensor]
-        loss = output_dict['loss']
-        if torch.isnan(loss):
-            raise ValueError("nan loss encountered")
+        micro_batches = split_batch(batch, micro_batch_size)
+        batch_size = len(batch['metadata'])
+
+        loss = 0.0
+        for micro_batch in micro_batches:
+            # forward + loss
+            output_dict = self(task, **micro_batch)  # input is dict[str, tensor]
+            micro_loss = output_dict['loss']
+            if torch.isnan(micro_loss):
+                raise ValueError("nan loss encountered")
 
-        # backward + update
-        loss.backward()
+            # backward - loss is averaged over sequences, so weight by proportion of sequences in logical batch
+            weight = len(micro_batch['metadata']) / batch_size
+            self.grad_scaler.scale(micro_loss * weight).backward()
+            loss += micro_loss.detach() * weight
+
+        # update once per logical batch - gradients must be unscaled before clipping (no-op unless fp16)
+        self.grad_scaler.unscale_(optimizer)
         rescale_gradients(self, grad_norm=1.0)
-        optimizer.step()
+        self.grad_scaler.step(optimizer)
+        self.grad_scaler.update()
+
+        return loss
+
+
+def split_batch(batch: Dict[str, Any],
+                micro_batch_size: Optional[int] = None,
+                ) -> List[Dict[str, Any]]:
+    """
+    split a batch produced by an AllenNLP iterator into micro-batches of at most micro_batch_size sequences.
+    padding columns which are not needed by any sequence in a micro-batch are trimmed.
+    """
+    batch_size = len(batch['metadata'])
+    if micro_batch_size is None or micro_batch_size >= batch_size:
+        return [batch]
+
+    res = []
+    for start in range(0, batch_size, micro_batch_size):
+        end = start + micro_batch_size
+        token_ids = batch['tokens']['tokens'][start:end]
+        max_length = int((token_ids != 0).sum(dim=1).max())
+        micro_batch = {'tokens': {'tokens': token_ids[:, :max_length]},
+                       'indicator': batch['indicator'][start:end, :max_length],
+                       'metadata': batch['metadata'][start:end]}
+        if batch.get('tags') is not None:
+            micro_batch['tags'] = batch['tags'][start:end, :max_length]
+        res.append(micro_batch)
 
-        return loss
\ No newline at end of file
+    return res
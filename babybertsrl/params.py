@@ -34,6 +34,12 @@ and larger hidden sizes speed dev-f1 but do not affect end-of training dev-f1
 
 best hidden size is 256, any lower increases dev-pp
 
+micro_batch_size only controls memory use and speed - gradients are accumulated over micro-batches,
+so the effective batch size is always batch_size.
+
+precision='bf16' or 'fp16' runs the encoder and projection layers under autocast, keeping fp32 master weights.
+compare speed, devel-pp and devel-f1 against precision='fp32' with data_tools/benchmark_precision.py.
+
 Notes:
     because best performance on both MLM and SRL are achieved when interleaved compared to sequential,
     this suggests that hypothesis space at last layer in BERT is still very unconstrained.
@@ -55,6 +61,7 @@ param2debug = {
 
 param2default = {
     'batch_size': 16,
+    'micro_batch_size': 16,  # batches are split into micro-batches with gradient accumulation if smaller
     'embedding_dropout': 0.1,
     'lr': 1e-4,
     'hidden_size': 256,
@@ -67,4 +74,7 @@ param2default = {
     'num_masked': 3,
     'corpus_name': 'childes-20191206',
     'vocab_size': 4000,
+    'precision': 'fp32',  # or 'bf16' (CPU or GPU), or 'fp16' (GPU only)
+    'encoder': 'legacy',  # or 'native' (fused attention, requires torch>=2.0)
+    'compile_mode': 'none',  # or 'compile' (torch.compile, requires torch>=2.0) or 'trace' (TorchScript)
 }
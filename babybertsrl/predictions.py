@@ -0,0 +1,144 @@
+"""
+binary storage of MLM predictions, as written by eval.predict_masked_sentences().
+
+a prediction file is a compressed .npz file containing:
+ - table: all strings (words and tags) occurring in the file, shared by the arrays below
+ - in_ids, predicted_ids, gold_ids: flat int32 arrays of ids into table, of all sentences
+ - offsets: sentence i is [offsets[i]: offsets[i + 1]] in each array
+
+files are written in a background thread, such that writing overlaps with training.
+"""
+
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+
+class Predictions(NamedTuple):
+    table: np.ndarray  # str
+    offsets: np.ndarray  # int64, [num_sentences + 1]
+    in_ids: np.ndarray  # int32, [num_words]
+    predicted_ids: np.ndarray  # int32, [num_words]
+    gold_ids: np.ndarray  # int32, [num_words]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def has_gold(self) -> bool:
+        """gold tags are empty strings if they were not saved, e.g. for probing sentences"""
+        return bool(np.any(self.table[self.gold_ids] != ''))
+
+    def gen_sentences(self) -> Iterator[Tuple[List[str], List[str], List[str]]]:
+        """yield words, predicted tags and gold tags of each sentence"""
+        table = self.table.tolist()
+        in_words = [table[i] for i in self.in_ids.tolist()]
+        predicted_tags = [table[i] for i in self.predicted_ids.tolist()]
+        gold_tags = [table[i] for i in self.gold_ids.tolist()]
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield in_words[start: end], predicted_tags[start: end], gold_tags[start: end]
+
+
+def encode_predictions(mlm_in: List[List[str]],
+                       predicted_mlm_tags: List[List[str]],
+                       gold_mlm_tags: List[List[str]],
+                       ) -> Predictions:
+    """
+    gold tags may be empty, e.g. for probing sentences, and are then stored as empty strings.
+    """
+    string2id: Dict[str, int] = {}
+
+    def encode(sequences, lengths):
+        res = np.empty(sum(lengths), dtype=np.int32)
+        position = 0
+        for sequence, length in zip(sequences, lengths):
+            res[position: position + len(sequence)] = [string2id.setdefault(s, len(string2id)) for s in sequence]
+            res[position + len(sequence): position + length] = string2id.setdefault('', len(string2id))
+            position += length
+        return res
+
+    lengths = [len(words) for words in mlm_in]
+    in_ids = encode(mlm_in, lengths)
+    predicted_ids = encode(predicted_mlm_tags, lengths)
+    gold_ids = encode(gold_mlm_tags, lengths)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return Predictions(table=np.array(sorted(string2id, key=string2id.get), dtype=str),
+                       offsets=offsets,
+                       in_ids=in_ids,
+                       predicted_ids=predicted_ids,
+                       gold_ids=gold_ids)
+
+
+def save_predictions(out_path: Path,
+                     predictions: Predictions,
+                     ) -> None:
+    np.savez_compressed(out_path, **predictions._asdict())
+
+
+def load_predictions(path: Path) -> Predictions:
+    with np.load(path) as npz:
+        return Predictions(**{name: npz[name] for name in Predictions._fields})
+
+
+def convert_predictions_to_text(path: Path,
+                                out_path: Path,
+                                print_gold: Optional[bool] = None,
+                                ) -> None:
+    """
+    write predictions in the text format of eval.predict_masked_sentences(), for human inspection.
+    by default, gold tags are printed if they were saved, such that the text is identical to the text format.
+    """
+    predictions = load_predictions(path)
+    if print_gold is None:
+        print_gold = predictions.has_gold()
+    with out_path.open('w') as f:
+        for a, b, c in predictions.gen_sentences():
+            for ai, bi, ci in zip(a, b, c):
+                if print_gold:
+                    line = f'{ai:>20} {bi:>20} {ci:>20}\n'
+                else:
+                    line = f'{ai:>20} {bi:>20}\n'
+                f.write(line)
+            f.write('\n')
+
+
+class BackgroundWriter:
+    """
+    run write functions one after the other in a background thread.
+    errors are raised when the next function is submitted, or when the writer is closed.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:  # re-raised in main thread
+                self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn: Callable, *args) -> None:
+        self._check()
+        self._queue.put((fn, args))
+
+    def close(self) -> None:
+        """wait until all submitted functions are done"""
+        self._queue.put(None)
+        self._thread.join()
+        self._check()
@@ -0,0 +1,157 @@
+"""
+probing sentences for subject-verb and determiner-noun agreement, loaded and tensorized once per run.
+
+each sentence contains one [MASK]. the model is correct if, at the [MASK] position,
+the best scoring singular candidate and the best scoring plural candidate are ranked in agreement with
+ - the demonstrative before the [MASK] (e.g. "look at these [MASK] ."): candidates are singular and plural nouns
+ - otherwise, the first noun before the [MASK] (e.g. "the dog with the cats [MASK] true ."): candidates are "is", "are"
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import torch
+from allennlp.data import Instance, Vocabulary
+
+from babybertsrl import config
+from babybertsrl.converter import ConverterMLM, make_inference_batch
+from babybertsrl.io import load_utterances_from_file
+
+DEMONSTRATIVE2IS_PLURAL = {'this': False, 'that': False, 'these': True, 'those': True}
+COPULA_SINGULAR = 'is'
+COPULA_PLURAL = 'are'
+
+# kinds of probing sentence
+NOUN = 0
+COPULA = 1
+
+
+def load_nouns(file_name: str) -> Set[str]:
+    return set((config.Dirs.root / 'analysis' / file_name).read_text().split())
+
+
+def get_agreement(words: List[str],
+                  nouns_singular: Set[str],
+                  nouns_plural: Set[str],
+                  ) -> Optional[Tuple[int, bool]]:
+    """
+    return the kind of the sentence, and whether the correct word at the [MASK] is plural,
+    or None if the number cannot be determined.
+    """
+    context = words[:words.index('[MASK]')]
+    demonstratives = [w for w in context if w in DEMONSTRATIVE2IS_PLURAL]
+    if demonstratives:
+        return NOUN, DEMONSTRATIVE2IS_PLURAL[demonstratives[-1]]
+    for w in context:
+        if w in nouns_singular:
+            return COPULA, False
+        if w in nouns_plural:
+            return COPULA, True
+    return None
+
+
+class ProbingData:
+    """
+    sentences of one probing task, as tensors on the device of the model,
+    and as instances, for saving predictions to file.
+    """
+
+    def __init__(self,
+                 name: str,
+                 utterances: List[List[str]],
+                 instances: List[Instance],
+                 token_ids: torch.Tensor,
+                 indicator: torch.Tensor,
+                 kinds: torch.Tensor,
+                 is_plural: torch.Tensor,
+                 ):
+        self.name = name
+        self.utterances = utterances
+        self.instances = instances
+        self.token_ids = token_ids
+        self.indicator = indicator
+        self.kinds = kinds
+        self.is_plural = is_plural
+
+    @classmethod
+    def from_file(cls,
+                  file_path: Path,
+                  converter_mlm: ConverterMLM,
+                  output_vocab_mlm: Vocabulary,
+                  device: torch.device,
+                  ) -> 'ProbingData':
+        utterances = load_utterances_from_file(file_path)
+
+        # check that probing words are in vocab
+        for u in utterances:
+            for w in u:
+                if w == '[MASK]':
+                    continue  # not in output vocab
+                assert output_vocab_mlm.get_token_index(w, namespace='labels'), w
+
+        # number of each sentence - sentences without clear number are not scored
+        nouns_singular = load_nouns('nouns_singular_annotator2.txt')
+        nouns_plural = load_nouns('nouns_plural_annotator2.txt')
+        agreements = [get_agreement(u, nouns_singular, nouns_plural) for u in utterances]
+        keep = [n for n, a in enumerate(agreements) if a is not None]
+        if len(keep) < len(utterances):
+            print(f'WARNING: Number of {len(utterances) - len(keep)} probing sentences cannot be determined')
+
+        batch = make_inference_batch([(utterances[n], None) for n in keep], converter_mlm.wordpiece_tokenizer)
+        if config.Eval.save_probing_predictions:
+            instances = converter_mlm.make_probing_instances(utterances)
+        else:
+            instances = []
+        return cls(name=file_path.stem,
+                   utterances=utterances,
+                   instances=instances,
+                   token_ids=batch['tokens']['tokens'].to(device),
+                   indicator=batch['indicator'].to(device),
+                   kinds=torch.tensor([agreements[n][0] for n in keep], device=device),
+                   is_plural=torch.tensor([agreements[n][1] for n in keep], device=device))
+
+    def __len__(self):
+        return len(self.token_ids)
+
+
+def get_candidate_ids(words: Set[str],
+                      output_vocab_mlm: Vocabulary,
+                      ) -> List[int]:
+    """ids of words which are whole labels in the MLM output vocab"""
+    token2id = output_vocab_mlm.get_token_to_index_vocabulary('labels')
+    return sorted(token2id[w] for w in words if w in token2id)
+
+
+def load_probing_data(probing_path: Path,
+                      converter_mlm: ConverterMLM,
+                      output_vocab_mlm: Vocabulary,
+                      device: torch.device,
+                      ) -> List[ProbingData]:
+    res = []
+    for name in config.Eval.probing_names:
+        probing_data_path_mlm = probing_path / f'{name}.txt'
+        if not probing_data_path_mlm.exists():
+            print(f'WARNING: {probing_data_path_mlm} does not exist')
+            continue
+        res.append(ProbingData.from_file(probing_data_path_mlm, converter_mlm, output_vocab_mlm, device))
+    return res
+
+
+def make_candidate_ids(output_vocab_mlm: Vocabulary,
+                       device: torch.device,
+                       ) -> Dict[Tuple[int, bool], torch.Tensor]:
+    """
+    ids of candidates at the [MASK], for each kind of probing sentence and number
+    """
+    nouns_singular = load_nouns('nouns_singular_annotator2.txt')
+    nouns_plural = load_nouns('nouns_plural_annotator2.txt')
+    kind_and_number2words = {(NOUN, False): nouns_singular - nouns_plural,
+                             (NOUN, True): nouns_plural - nouns_singular,
+                             (COPULA, False): {COPULA_SINGULAR},
+                             (COPULA, True): {COPULA_PLURAL}}
+    res = {}
+    for key, words in kind_and_number2words.items():
+        ids = get_candidate_ids(words, output_vocab_mlm)
+        if not ids:
+            raise ValueError(f'No candidates for {key} in MLM output vocab')
+        res[key] = torch.tensor(ids, device=device)
+    return res
@@ -0,0 +1,186 @@
+"""
+a compact, columnar store of SRL propositions.
+
+instead of a list of (words, predicate_index, tags) tuples, holding one Python string per token,
+words and tags are stored as flat int32 arrays of ids into tables of word and tag types.
+proposition i is word_ids[offsets[i]: offsets[i + 1]] and tag_ids[offsets[i]: offsets[i + 1]].
+
+a store is saved as a directory containing:
+ - word_ids.npy, tag_ids.npy, offsets.npy, predicate_indices.npy: loaded memory-mapped
+ - words.txt, tags.txt: the tables of word and tag types, one per line, in order of id
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+
+from babybertsrl import config
+from babybertsrl.io import LengthStats, encode_words, gen_propositions_from_file
+
+ARRAY_NAMES = ['word_ids', 'tag_ids', 'offsets', 'predicate_indices']
+
+
+def get_cache_key(file_path: Path,
+                  filter_lengths: bool = True,
+                  ) -> str:
+    """hash of the content of the text file, and of the length filter, which determines the propositions loaded"""
+    h = hashlib.sha1(file_path.read_bytes())
+    if filter_lengths:
+        h.update(f'min_input_length={config.Data.min_input_length}'.encode())
+        h.update(f'max_input_length={config.Data.max_input_length}'.encode())
+    return h.hexdigest()
+
+
+class PropositionStore:
+
+    def __init__(self,
+                 word_ids: np.ndarray,
+                 tag_ids: np.ndarray,
+                 offsets: np.ndarray,
+                 predicate_indices: np.ndarray,
+                 words: List[str],
+                 tags: List[str],
+                 ):
+        self.word_ids = word_ids  # int32, [num_tokens]
+        self.tag_ids = tag_ids  # int32, [num_tokens]
+        self.offsets = offsets  # int64, [num_propositions + 1]
+        self.predicate_indices = predicate_indices  # int32, [num_propositions]
+        self.words = words
+        self.tags = tags
+
+        if len(word_ids) != len(tag_ids):
+            raise ValueError('Number of words and tags must match')
+
+    @classmethod
+    def from_propositions(cls,
+                          propositions: Iterable[Tuple[Union[List[str], np.ndarray], int, Union[List[str], np.ndarray]]],
+                          word2id: Optional[Dict[str, int]] = None,
+                          tag2id: Optional[Dict[str, int]] = None,
+                          ) -> 'PropositionStore':
+        """
+        make store from propositions with either strings,
+        or ids into word2id and tag2id, as yielded by io.gen_propositions_from_file()
+        """
+        if word2id is None:
+            word2id = {}
+        if tag2id is None:
+            tag2id = {}
+
+        all_word_ids = []
+        all_tag_ids = []
+        lengths = [0]
+        predicate_indices = []
+        for words, predicate_index, tags in propositions:
+            if not isinstance(words, np.ndarray):
+                words = encode_words(words, word2id)
+                tags = encode_words(tags, tag2id)
+            all_word_ids.append(words)
+            all_tag_ids.append(tags)
+            lengths.append(len(words))
+            predicate_indices.append(predicate_index)
+
+        return cls(word_ids=np.concatenate(all_word_ids or [np.zeros(0, dtype=np.int32)]).astype(np.int32),
+                   tag_ids=np.concatenate(all_tag_ids or [np.zeros(0, dtype=np.int32)]).astype(np.int32),
+                   offsets=np.cumsum(lengths, dtype=np.int64),
+                   predicate_indices=np.array(predicate_indices, dtype=np.int32),
+                   words=sorted(word2id, key=word2id.get),
+                   tags=sorted(tag2id, key=tag2id.get))
+
+    @classmethod
+    def from_file(cls,
+                  file_path: Path,
+                  filter_lengths: bool = True,
+                  ) -> 'PropositionStore':
+        """
+        stream propositions from text file, without materializing a list of strings for each proposition.
+        """
+        print(f'Loading {file_path}')
+
+        stats = LengthStats()
+        word2id = {}
+        tag2id = {}
+        propositions = gen_propositions_from_file(file_path, stats, word2id, tag2id, filter_lengths)
+        res = cls.from_propositions(propositions, word2id, tag2id)
+        stats.print_summary('proposition')
+
+        return res
+
+    @classmethod
+    def load_or_make(cls,
+                     file_path: Path,
+                     filter_lengths: bool = True,
+                     ) -> 'PropositionStore':
+        """
+        load store from cache, keyed by the content of the text file and the length filter,
+        or make it and save it to the cache.
+        """
+        h = get_cache_key(file_path, filter_lengths)
+        store_path = config.Dirs.cache / 'propositions' / f'{file_path.stem}_{h}'
+        if (store_path / 'tags.txt').exists():  # written last
+            print(f'Loading propositions of {file_path.name} from {store_path}')
+            return cls.load(store_path)
+        res = cls.from_file(file_path, filter_lengths)
+        res.save(store_path)
+        return res
+
+    def save(self, store_path: Path) -> None:
+        store_path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(store_path / f'{name}.npy', getattr(self, name))
+        (store_path / 'words.txt').write_text('\n'.join(self.words) + '\n', encoding='utf-8')
+        (store_path / 'tags.txt').write_text('\n'.join(self.tags) + '\n', encoding='utf-8')
+
+    @classmethod
+    def load(cls,
+             store_path: Path,
+             mmap: bool = True,
+             ) -> 'PropositionStore':
+        name2array = {name: np.load(store_path / f'{name}.npy', mmap_mode='r' if mmap else None)
+                      for name in ARRAY_NAMES}
+        words = (store_path / 'words.txt').read_text(encoding='utf-8').split('\n')[:-1]
+        tags = (store_path / 'tags.txt').read_text(encoding='utf-8').split('\n')[:-1]
+        return cls(words=words, tags=tags, **name2array)
+
+    def __len__(self) -> int:
+        return len(self.predicate_indices)
+
+    def __getitem__(self, i: int) -> Tuple[List[str], int, List[str]]:
+        """
+        materialize proposition i in the format returned by io.load_propositions_from_file()
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return ([self.words[w] for w in self.word_ids[start: end]],
+                int(self.predicate_indices[i]),
+                [self.tags[t] for t in self.tag_ids[start: end]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def select(self, indices: np.ndarray) -> 'PropositionStore':
+        """
+        return a new store with the propositions at indices, e.g. a split. tables of types are shared.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(self.offsets[indices] - offsets[:-1], lengths)
+        return PropositionStore(word_ids=self.word_ids[positions],
+                                tag_ids=self.tag_ids[positions],
+                                offsets=offsets,
+                                predicate_indices=self.predicate_indices[indices],
+                                words=self.words,
+                                tags=self.tags)
+
+    def count_tags(self) -> Dict[str, int]:
+        """
+        number of occurrences of each tag type, computed on ids
+        """
+        counts = np.bincount(self.tag_ids, minlength=len(self.tags))
+        return {tag: int(count) for tag, count in zip(self.tags, counts)}
@@ -0,0 +1,179 @@
+"""
+local HTTP service for querying a trained model.
+
+concurrent requests are coalesced into batches:
+a batch is run as soon as it contains max_batch_size requests, or max_wait_ms after its first request arrived.
+SRL and MLM requests in a batch are run one task after the other, by a single thread.
+
+usage:
+    python -m babybertsrl.server --checkpoint runs/param_001/checkpoint
+
+requests (POST, JSON):
+    /srl {"words": ["the", "dog", "chased", "the", "cat", "."], "verb_index": 2}
+    /mlm {"words": ["the", "[MASK]", "chased", "the", "cat", "."]}
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Dict, List
+import torch
+
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl.checkpoint import load_checkpoint
+from babybertsrl.converter import make_inference_batch
+from babybertsrl.model_mt import MTBert
+from babybertsrl.srl_utils import make_srl_string
+
+
+class Request:
+    """a single query, which is answered by the batching thread"""
+
+    def __init__(self, task: str, words: List[str], verb_index: int = None):
+        self.task = task
+        self.words = words
+        self.verb_index = verb_index
+        self.response = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+
+    def __init__(self,
+                 mt_bert: MTBert,
+                 wordpiece_tokenizer: WordpieceTokenizer,
+                 max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0,
+                 ):
+        self.mt_bert = mt_bert
+        self.wordpiece_tokenizer = wordpiece_tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        # a single thread runs the model, such that it is never called concurrently (e.g. while compiling)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, request: Request) -> Dict[str, Any]:
+        self.queue.put(request)
+        request.done.wait()
+        return request.response
+
+    def run(self) -> None:
+        while True:
+            # collect batch - block until first request, then wait at most max_wait for more
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # one forward pass per task
+            for task in ['srl', 'mlm']:
+                requests = [r for r in batch if r.task == task]
+                if not requests:
+                    continue
+                try:
+                    responses = self.predict(task, requests)
+                except Exception as e:  # do not kill thread - report error to each client instead
+                    responses = [{'error': repr(e)} for _ in requests]
+
+                for request, response in zip(requests, responses):
+                    request.response = response
+                    request.done.set()
+
+    def predict(self, task: str, requests: List[Request]) -> List[Dict[str, Any]]:
+        with torch.no_grad():
+            batch = make_inference_batch([(r.words, r.verb_index) for r in requests], self.wordpiece_tokenizer)
+            output_dict = self.mt_bert(task, **batch)
+        batch_tags = self.mt_bert.decode(output_dict, task=task)
+
+        res = []
+        for r, tags in zip(requests, batch_tags):
+            if task == 'srl':
+                res.append({'tags': tags, 'srl_string': make_srl_string(r.words, tags)})
+            else:
+                res.append({'predictions': {i: tag for i, (w, tag) in enumerate(zip(r.words, tags))
+                                            if w == '[MASK]'}})
+        return res
+
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = 1024  # the default backlog of 5 resets connections of concurrent clients
+    daemon_threads = True
+
+
+def make_handler(micro_batcher: MicroBatcher):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            task = self.path.strip('/')
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                words = body['words']
+                if task == 'srl':
+                    verb_index = int(body['verb_index'])
+                    if not 0 <= verb_index < len(words):
+                        raise ValueError('verb_index out of range')
+                    request = Request(task, words, verb_index)
+                elif task == 'mlm':
+                    if '[MASK]' not in words:
+                        raise ValueError('No [MASK] in words')
+                    request = Request(task, words)
+                else:
+                    raise ValueError(f'Invalid path "{self.path}". Use /srl or /mlm')
+            except (KeyError, ValueError, TypeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+            response = micro_batcher.submit(request)
+            self.send_json(500 if 'error' in response else 200, response)
+
+        def send_json(self, status: int, data: Dict[str, Any]):
+            content = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):  # do not print a line per request
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=Path, required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=64)
+    parser.add_argument('--max_wait_ms', type=float, default=5.0)
+    parser.add_argument('--device', default='cpu', help='"cpu" or "cuda". quantized models run on CPU only')
+    args = parser.parse_args()
+
+    mt_bert, input_vocab = load_checkpoint(args.checkpoint)
+    mt_bert.to(args.device)
+    micro_batcher = MicroBatcher(mt_bert,
+                                 WordpieceTokenizer(input_vocab),
+                                 max_batch_size=args.max_batch_size,
+                                 max_wait_ms=args.max_wait_ms)
+
+    server = Server((args.host, args.port), make_handler(micro_batcher))
+    print(f'Serving {args.checkpoint} on http://{args.host}:{args.port}', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
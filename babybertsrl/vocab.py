@@ -0,0 +1,80 @@
+"""
+the input vocabulary: the word pieces in the Google BERT vocab which are among the most frequent CHILDES words.
+
+the vocab is built once per job and saved next to the job's outputs, together with its hash,
+such that the server and offline tools can load an identical vocab without rebuilding it.
+"""
+
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+
+SPECIAL_TOKEN2ID = OrderedDict([('[PAD]', 0),  # AllenNLP expects this
+                                ('[UNK]', 1),  # AllenNLP expects this
+                                ('[CLS]', 2),
+                                ('[SEP]', 3),
+                                ('[MASK]', 4),
+                                ])
+
+
+def load_childes_vocab(vocab_file: Path,
+                       vocab_size: int,
+                       ) -> Dict[str, int]:
+    """
+    the special tokens and the vocab_size most frequent words in a file with lines of the form "{frequency} {word}".
+    """
+    lines = vocab_file.read_text(encoding='utf-8').split('\n', vocab_size)[:vocab_size]
+    words = [line.split()[1] for line in lines if line]
+    res = OrderedDict(SPECIAL_TOKEN2ID)
+    for index, word in enumerate(words, start=len(SPECIAL_TOKEN2ID)):
+        res[word] = index
+    return res
+
+
+def make_vocab(childes_vocab_file: Path,
+               google_vocab_file: Path,
+               vocab_size: int,
+               ) -> Dict[str, int]:
+    """
+    keep only those word pieces in the Google vocab which are CHILDES words, in the order of the Google vocab.
+    """
+    childes_vocab = load_childes_vocab(childes_vocab_file, vocab_size)
+    google_tokens = google_vocab_file.read_text(encoding='utf-8').split()
+    res = OrderedDict((token, index) for index, token in enumerate(t for t in google_tokens if t in childes_vocab))
+    check_special_tokens(res)
+    return res
+
+
+def check_special_tokens(vocab: Dict[str, int]) -> None:
+    for token, index in SPECIAL_TOKEN2ID.items():
+        if vocab.get(token) != index:
+            raise ValueError(f'Expected {token} to have index {index} but found {vocab.get(token)}')
+
+
+def get_vocab_hash(vocab: Dict[str, int]) -> str:
+    return hashlib.sha1('\n'.join(vocab.keys()).encode('utf-8')).hexdigest()
+
+
+def save_vocab(vocab: Dict[str, int],
+               vocab_path: Path,
+               ) -> None:
+    """
+    save one word piece per line, in order of index, and the hash of the vocab in a separate file.
+    """
+    vocab_path.parent.mkdir(parents=True, exist_ok=True)
+    vocab_path.write_text('\n'.join(vocab.keys()) + '\n', encoding='utf-8')
+    vocab_path.with_suffix('.sha1').write_text(get_vocab_hash(vocab))
+
+
+def load_saved_vocab(vocab_path: Path,
+                     ) -> Dict[str, int]:
+    """
+    load a vocab saved with save_vocab(), and check that it is identical to the one that was saved.
+    """
+    tokens = vocab_path.read_text(encoding='utf-8').split('\n')[:-1]
+    res = OrderedDict((token, index) for index, token in enumerate(tokens))
+    if get_vocab_hash(res) != vocab_path.with_suffix('.sha1').read_text().strip():
+        raise ValueError(f'Hash of {vocab_path} does not match the hash saved with it')
+    check_special_tokens(res)
+    return res
@@ -2,7 +2,148 @@
 obtained from Allen NLP toolkit in September 2019
 """
 
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+import numpy as np
+
+
+class EncodedCorpus(NamedTuple):
+    """
+    flat word piece ids of many sentences, each starting with [CLS] and ending with [SEP].
+    ids of sentence i are ids[sentence_offsets[i]: sentence_offsets[i + 1]].
+    start and end offsets of words in sentence i are start_offsets[word_offsets[i]: word_offsets[i + 1]],
+    relative to the start of the sentence - they are identical to those returned by wordpiece().
+    """
+    ids: np.ndarray  # int32
+    sentence_offsets: np.ndarray  # int64, [num_sentences + 1]
+    word_offsets: np.ndarray  # int64, [num_sentences + 1]
+    start_offsets: np.ndarray  # int32, [num_words]
+    end_offsets: np.ndarray  # int32, [num_words]
+
+
+class CachedWordpieceTokenizer:
+    """
+    wraps a pytorch_pretrained_bert WordpieceTokenizer,
+    and caches the word piece ids of each word type in a bounded LRU cache.
+    because a few thousand types account for nearly all tokens in child-directed speech,
+    nearly all words are tokenized by a single dictionary lookup.
+
+    can be used wherever a WordpieceTokenizer is expected.
+    """
+
+    def __init__(self,
+                 wordpiece_tokenizer,
+                 max_size: int = 100_000,
+                 ):
+        self.wordpiece_tokenizer = wordpiece_tokenizer
+        self.vocab: Dict[str, int] = wordpiece_tokenizer.vocab
+        self.ids_to_tokens: List[str] = [None] * len(self.vocab)
+        for token, index in self.vocab.items():
+            self.ids_to_tokens[index] = token
+        self.cls_id = self.vocab['[CLS]']
+        self.sep_id = self.vocab['[SEP]']
+
+        self.max_size = max_size
+        self._word2ids = OrderedDict()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def tokenize_ids(self, word: str) -> Tuple[int, ...]:
+        try:
+            res = self._word2ids[word]
+        except KeyError:
+            self.num_misses += 1
+            res = tuple([self.vocab[wp] for wp in self.wordpiece_tokenizer.tokenize(word)])
+            self._word2ids[word] = res
+            if len(self._word2ids) > self.max_size:
+                self._word2ids.popitem(last=False)  # evict least recently used
+        else:
+            self.num_hits += 1
+            self._word2ids.move_to_end(word)
+        return res
+
+    def tokenize(self, word: str) -> List[str]:
+        return [self.ids_to_tokens[i] for i in self.tokenize_ids(word)]
+
+    def encode(self, sentences: Iterable[List[str]]) -> EncodedCorpus:
+        """
+        tokenize many sentences in a single call.
+        """
+        ids = []
+        sentence_offsets = [0]
+        word_offsets = [0]
+        start_offsets = []
+        end_offsets = []
+        for words in sentences:
+            ids.append(self.cls_id)
+            cumulative = 0
+            for word in words:
+                word_ids = self.tokenize_ids(word)
+                start_offsets.append(cumulative + 1)
+                cumulative += len(word_ids)
+                end_offsets.append(cumulative)
+                ids.extend(word_ids)
+            ids.append(self.sep_id)
+            sentence_offsets.append(len(ids))
+            word_offsets.append(len(start_offsets))
+
+        return EncodedCorpus(ids=np.array(ids, dtype=np.int32),
+                             sentence_offsets=np.array(sentence_offsets, dtype=np.int64),
+                             word_offsets=np.array(word_offsets, dtype=np.int64),
+                             start_offsets=np.array(start_offsets, dtype=np.int32),
+                             end_offsets=np.array(end_offsets, dtype=np.int32))
+
+    def encode_word_ids(self,
+                        word_ids: np.ndarray,
+                        word_offsets: np.ndarray,
+                        words: List[str],
+                        ) -> EncodedCorpus:
+        """
+        equivalent to encode(), for sentences given as flat word ids into a table of word types (words),
+        where sentence i is word_ids[word_offsets[i]: word_offsets[i + 1]].
+        each word type is tokenized once, and word pieces are gathered with array operations.
+        """
+        # word pieces of each word type
+        type_pieces = [self.tokenize_ids(w) for w in words]
+        type_num_pieces = np.array([len(pieces) for pieces in type_pieces], dtype=np.int64)
+        type_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(type_num_pieces, out=type_offsets[1:])
+        flat_type_pieces = np.fromiter((i for pieces in type_pieces for i in pieces),
+                                       dtype=np.int32, count=type_offsets[-1])
+
+        # offsets of words and sentences
+        num_pieces = type_num_pieces[word_ids]
+        cumulative = np.zeros(len(word_ids) + 1, dtype=np.int64)
+        np.cumsum(num_pieces, out=cumulative[1:])
+        num_words = np.diff(word_offsets)
+        start_offsets = cumulative[:-1] - np.repeat(cumulative[word_offsets[:-1]], num_words) + 1
+        end_offsets = start_offsets + num_pieces - 1
+        sentence_lengths = cumulative[word_offsets[1:]] - cumulative[word_offsets[:-1]] + 2
+        sentence_offsets = np.zeros(len(num_words) + 1, dtype=np.int64)
+        np.cumsum(sentence_lengths, out=sentence_offsets[1:])
+
+        # ids
+        ids = np.empty(sentence_offsets[-1], dtype=np.int32)
+        ids[sentence_offsets[:-1]] = self.cls_id
+        ids[sentence_offsets[1:] - 1] = self.sep_id
+        piece_in_word = np.arange(cumulative[-1]) - np.repeat(cumulative[:-1], num_pieces)
+        word_starts = np.repeat(sentence_offsets[:-1], num_words) + start_offsets
+        ids[np.repeat(word_starts, num_pieces) + piece_in_word] = \
+            flat_type_pieces[np.repeat(type_offsets[word_ids], num_pieces) + piece_in_word]
+
+        return EncodedCorpus(ids=ids,
+                             sentence_offsets=sentence_offsets,
+                             word_offsets=np.asarray(word_offsets, dtype=np.int64),
+                             start_offsets=start_offsets.astype(np.int32),
+                             end_offsets=end_offsets.astype(np.int32))
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_hits / max(1, self.num_hits + self.num_misses)
+
+    def print_stats(self) -> None:
+        print(f'Word piece cache: size={len(self._word2ids):,} '
+              f'hits={self.num_hits:,} misses={self.num_misses:,} hit-rate={self.hit_rate:.4f}')
 
 
 def wordpiece(tokens: List[str],
@@ -133,4 +274,139 @@ def convert_tags_to_wordpiece_tags(tags: List[str],
             j += 1
 
     # Add O tags for cls and sep tokens.
-    return ['O'] + new_tags + ['O']
\ No newline at end of file
+    return ['O'] + new_tags + ['O']
+
+# vectorized conversion of BIO tags and verb indicators of whole corpora to word pieces
+
+BIO_O = 0
+BIO_B = 1
+BIO_I = 2
+
+
+def encode_bio_tags(tags: Iterable[str],
+                    label2id: Dict[str, int],
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    split each BIO tag into a BIO code and the id of its label (e.g. "B-ARG0" -> BIO_B, label2id["ARG0"]).
+    label2id is updated with new labels. the label id of "O" is -1.
+    """
+    tag2codes = {'O': (BIO_O, -1)}
+    bio = []
+    label_ids = []
+    for tag in tags:
+        try:
+            code, label_id = tag2codes[tag]
+        except KeyError:
+            prefix, label = tag.split('-', 1)
+            code = {'B': BIO_B, 'I': BIO_I}[prefix]
+            label_id = label2id.setdefault(label, len(label2id))
+            tag2codes[tag] = code, label_id
+        bio.append(code)
+        label_ids.append(label_id)
+    return np.array(bio, dtype=np.int8), np.array(label_ids, dtype=np.int32)
+
+
+def decode_bio_tags(bio: np.ndarray,
+                    label_ids: np.ndarray,
+                    labels: List[str],
+                    ) -> List[str]:
+    """inverse of encode_bio_tags(), where labels[label_id] is the label with that id"""
+    code2prefix = {BIO_B: 'B-', BIO_I: 'I-'}
+    table = {}
+    res = []
+    for code, label_id in zip(bio.tolist(), label_ids.tolist()):
+        try:
+            res.append(table[code, label_id])
+        except KeyError:
+            tag = 'O' if code == BIO_O else code2prefix[code] + labels[label_id]
+            table[code, label_id] = tag
+            res.append(tag)
+    return res
+
+
+def get_word_piece_positions(encoded: EncodedCorpus,
+                             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    for each word piece belonging to a word (i.e. not [CLS] or [SEP]), return
+     - the index of the word it belongs to
+     - its position in encoded.ids
+     - whether it is the first piece of its word
+    """
+    num_pieces = encoded.end_offsets - encoded.start_offsets + 1
+    word_ids = np.repeat(np.arange(len(num_pieces)), num_pieces)
+    num_words_per_sentence = np.diff(encoded.word_offsets)
+    word_starts = np.repeat(encoded.sentence_offsets[:-1], num_words_per_sentence) + encoded.start_offsets
+    first_piece = np.repeat(np.cumsum(num_pieces) - num_pieces, num_pieces)
+    piece_in_word = np.arange(len(word_ids)) - first_piece
+    positions = word_starts[word_ids] + piece_in_word
+    return word_ids, positions, piece_in_word == 0
+
+
+def convert_tags_to_wordpiece_tags_batch(bio: np.ndarray,
+                                         label_ids: np.ndarray,
+                                         encoded: EncodedCorpus,
+                                         ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    vectorized equivalent of convert_tags_to_wordpiece_tags() for all sentences in encoded corpus.
+    bio and label_ids are word-level, as returned by encode_bio_tags() on the concatenated tags of all sentences.
+    returns BIO codes and label ids aligned with encoded.ids, with "O" at [CLS] and [SEP].
+    """
+    word_ids, positions, is_first = get_word_piece_positions(encoded)
+    res_bio = np.full(len(encoded.ids), BIO_O, dtype=np.int8)
+    res_label_ids = np.full(len(encoded.ids), -1, dtype=np.int32)
+
+    # a word starting with B- continues with I- in subsequent word pieces
+    piece_bio = bio[word_ids]
+    piece_bio[(piece_bio == BIO_B) & ~is_first] = BIO_I
+    res_bio[positions] = piece_bio
+    res_label_ids[positions] = label_ids[word_ids]
+    return res_bio, res_label_ids
+
+
+def convert_verb_indices_to_wordpiece_indices_batch(verb_indices: np.ndarray,
+                                                    encoded: EncodedCorpus,
+                                                    ) -> np.ndarray:
+    """
+    vectorized equivalent of convert_verb_indices_to_wordpiece_indices() for all sentences in encoded corpus.
+    verb_indices are the word-level binary indicators of all sentences, concatenated.
+    """
+    word_ids, positions, _ = get_word_piece_positions(encoded)
+    res = np.zeros(len(encoded.ids), dtype=np.int32)
+    res[positions] = verb_indices[word_ids]
+    return res
+
+
+def mask_whole_words(encoded: EncodedCorpus,
+                     sentence_ids: np.ndarray,
+                     word_ids: np.ndarray,
+                     mask_id: int,
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    make one masked copy of a sentence for each (sentence_id, word_id) pair,
+    where word_id is the index of the masked word in its sentence.
+    all word pieces of the masked word are replaced by mask_id.
+
+    returns flat arrays over all copies:
+     - input ids, with the masked word replaced
+     - tag ids, i.e. the original ids
+     - mask indicator, 1 at each word piece of the masked word
+     - offsets, such that copy i is [offsets[i]: offsets[i + 1]]
+    """
+    starts = encoded.sentence_offsets[sentence_ids]
+    lengths = encoded.sentence_offsets[sentence_ids + 1] - starts
+    offsets = np.zeros(len(sentence_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # gather the word pieces of each copy from the encoded corpus
+    positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+    tag_ids = encoded.ids[positions]
+
+    # mark the span of each masked word
+    words = encoded.word_offsets[sentence_ids] + word_ids
+    boundaries = np.zeros(offsets[-1] + 1, dtype=np.int32)
+    np.add.at(boundaries, offsets[:-1] + encoded.start_offsets[words], 1)
+    np.add.at(boundaries, offsets[:-1] + encoded.end_offsets[words] + 1, -1)
+    mask = np.cumsum(boundaries[:-1], dtype=np.int32)
+
+    input_ids = np.where(mask == 1, mask_id, tag_ids).astype(np.int32)
+    return input_ids, tag_ids, mask, offsets
@@ -0,0 +1,269 @@
+"""
+conversion of human-annotated CHILDES SRL data (TalkBank XML) to propositions in text format:
+{predicate_id} [word0, word1 ...] ||| [label0, label1 ...]
+
+XML files are streamed with iterparse, such that only one utterance is held in memory at a time,
+and files are converted in parallel, in a pool of processes.
+
+the result of converting each file is cached, keyed by the content of the file and CONVERTER_VERSION.
+only new or changed files are converted again.
+increment CONVERTER_VERSION whenever the conversion rules change.
+"""
+
+import hashlib
+import json
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Generator, List, Optional, Tuple
+from nltk import Tree
+
+from babybertsrl import config
+from babybertsrl.srl_utils import make_srl_string
+
+CONVERTER_VERSION = 2
+TALKBANK = '{http://www.talkbank.org/ns/talkbank}'
+OUTSIDE_LABEL = 'O'
+
+# names of skip statistics, in the order in which they are printed
+STAT_NAMES = ['num_no_arguments',
+              'num_no_predicate',
+              'num_bad_head_loc',
+              'num_bad_arg_loc',
+              'num_prepositions',
+              'num_no_props',
+              'num_child',
+              ]
+
+
+def has_props(e):
+    try:
+        next(e.iterfind(f'{TALKBANK}props'))
+    except StopIteration:
+        return False
+    else:
+        return True
+
+
+def is_child(e):
+    """is utterance spoken by child?"""
+    if e.attrib['who'] == 'CHI':
+        return True
+    else:
+        return False
+
+
+def make_span_table(tree: Tree) -> Dict[Tuple[int, ...], Tuple[int, int]]:
+    """
+    map the position of each subtree to the (start, end) indices of its leaves in the sentence.
+    computed in a single pass over the tree, such that each argument span can be looked up in constant time.
+    unlike searching for the leaves of a subtree in the sentence,
+    this locates the correct span even when the same phrase occurs more than once.
+    """
+    res = {}
+    num_leaves = 0
+
+    def visit(subtree, position):
+        nonlocal num_leaves
+        start = num_leaves
+        if isinstance(subtree, Tree):
+            for n, child in enumerate(subtree):
+                visit(child, position + (n,))
+        else:
+            num_leaves += 1
+        res[position] = (start, num_leaves)
+
+    visit(tree, ())
+    return res
+
+
+def gen_utterances(file_path: Path) -> Generator[ET.Element, None, None]:
+    """
+    yield each utterance in file, and free memory of previous utterances.
+    """
+    context = ET.iterparse(str(file_path), events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == f'{TALKBANK}u':
+            yield elem
+            root.clear()  # utterances are children of root
+
+
+def convert_utterance(utterance: ET.Element,
+                      stats: Counter,
+                      verbose: bool = False,
+                      ) -> List[str]:
+    """
+    return one line for each good proposition in the utterance, and update skip statistics.
+    """
+    res = []
+
+    # get parse tree
+    parse_string = utterance.find(f'{TALKBANK}parse').text
+    parse_tree = Tree.fromstring(parse_string)
+
+    # words - get them from parse tree because parsing xml is difficult
+    words = parse_tree.leaves()
+    position2span = make_span_table(parse_tree)
+
+    if verbose:
+        print()
+        print('=============================================')
+        print(f'{utterance.attrib["uID"]}')
+        print(' '.join(words))
+        print('=============================================')
+        print()
+
+    # collect label sequence for each <proposition> in the utterance
+    for proposition in utterance.iter(f'{TALKBANK}proposition'):
+
+        if proposition.attrib['lemma'].endswith('-p'):  # TODO what to do here?
+            stats['num_prepositions'] += 1
+            continue
+
+        if verbose:
+            print(proposition.attrib)
+
+        # initialize label-sequence
+        label_text_list = list(proposition.itertext())
+        labels = [OUTSIDE_LABEL for _ in range(len(words))]
+        is_bad = False
+
+        # loop over arguments in the proposition - reconstructing label-sequence along the way
+        for label_text in label_text_list:
+
+            # parse label_text
+            match = re.findall(r'(\d+):(\d)-(.*)', label_text)[0]
+            head_loc = int(match[0])  # location in sentence of head (not first word) of argument
+            num_up = int(match[1])  # levels up in hierarchy at which all sister-trees are part of argument span
+            tag = str(match[2])
+
+            if verbose:
+                print(f'{head_loc:>2} {num_up:>2} {tag:>12}')
+
+            try:
+                words[head_loc]
+            except IndexError:
+                stats['num_bad_head_loc'] += 1
+                is_bad = True
+                break
+
+            if 'rel' in tag:
+                labels[head_loc] = 'B-V'
+            else:
+                tp = parse_tree.leaf_treeposition(head_loc)
+                start_loc, end_loc = position2span[tp[: - num_up - 1]]  # go up in tree from head of argument
+                argument_length = end_loc - start_loc
+                argument_labels = [f'B-{tag}'] + [f'I-{tag}'] * (argument_length - 1)
+
+                if not labels[start_loc: start_loc + argument_length] == [OUTSIDE_LABEL] * argument_length:
+                    stats['num_bad_arg_loc'] += 1
+                    is_bad = True
+                    break
+                labels[start_loc: start_loc + argument_length] = argument_labels
+
+        if is_bad:
+            continue
+
+        # pre-check console
+        if verbose:
+            for w, l in zip(words, labels):
+                print(f'{w:<12} {l:<12}')
+
+        # checks
+        if labels.count('B-V') != 1:
+            stats['num_no_predicate'] += 1
+            continue
+
+        if sum([1 if l.startswith('B-ARG') else 0 for l in labels]) == 0:
+            stats['num_no_arguments'] += 1
+            continue
+
+        assert len(labels) == len(words)
+
+        # console
+        if verbose:
+            print(make_srl_string(words, labels))
+
+        # make line
+        verb_index = labels.index('B-V')
+        x_string = " ".join(words)
+        y_string = " ".join(labels)
+        res.append(f'{verb_index} {x_string} ||| {y_string}')
+
+    return res
+
+
+def convert_file(file_path: Path,
+                 exclude_child: bool = True,
+                 verbose: bool = False,
+                 ) -> Tuple[List[str], Counter]:
+    """
+    return lines for all good propositions in file, and skip statistics.
+    """
+    lines = []
+    stats = Counter()
+    for utterance in gen_utterances(file_path):
+        if not has_props(utterance):
+            stats['num_no_props'] += 1
+            continue
+        if is_child(utterance) and exclude_child:
+            stats['num_child'] += 1  # note: child utterances are counted, but not excluded
+
+        lines += convert_utterance(utterance, stats, verbose)
+
+    return lines, stats
+
+
+def get_cache_path(file_path: Path, cache_dir: Path) -> Path:
+    h = hashlib.sha1(file_path.read_bytes())
+    h.update(f'version={CONVERTER_VERSION}'.encode())
+    return cache_dir / f'{h.hexdigest()}.json'
+
+
+def convert_corpus(name: str,
+                   num_workers: Optional[int] = None,
+                   use_cache: bool = True,
+                   ) -> Tuple[List[str], Counter]:
+    """
+    convert all XML files of a human-annotated corpus in parallel.
+    lines are returned in the order of sorted file paths, independent of the number of workers.
+    """
+    xml_path = config.Dirs.data / f'srl_{name}' / 'xml'
+    file_paths = sorted(xml_path.rglob('*.xml'))
+    cache_dir = config.Dirs.cache / f'srl_{name}'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # load results of files which have been converted before
+    cache_paths = [get_cache_path(file_path, cache_dir) for file_path in file_paths]
+    file_path2result = {}
+    if use_cache:
+        for file_path, cache_path in zip(file_paths, cache_paths):
+            if cache_path.exists():
+                d = json.loads(cache_path.read_text())
+                file_path2result[file_path] = (d['lines'], Counter(d['stats']))
+    print(f'Found {len(file_path2result)}/{len(file_paths)} files in cache')
+
+    # convert new or changed files
+    todo = [(file_path, cache_path) for file_path, cache_path in zip(file_paths, cache_paths)
+            if file_path not in file_path2result]
+    if todo:
+        with Pool(num_workers) as pool:
+            for (file_path, cache_path), (file_lines, file_stats) in zip(
+                    todo, pool.imap(convert_file, [file_path for file_path, _ in todo])):
+                file_path2result[file_path] = (file_lines, file_stats)
+                cache_path.write_text(json.dumps({'lines': file_lines, 'stats': file_stats}))
+
+    # reassemble in order of sorted file paths
+    lines = []
+    stats = Counter()
+    for file_path in file_paths:
+        file_lines, file_stats = file_path2result[file_path]
+        print('Collected {} good propositions in {}'.format(len(file_lines), file_path.name))
+        lines += file_lines
+        stats.update(file_stats)
+    stats['num_good'] = len(lines)
+
+    return lines, stats
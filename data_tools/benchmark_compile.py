@@ -0,0 +1,72 @@
+"""
+Compare speed of MTBert on CPU with and without compilation of the tensor computation,
+for training and inference, on batches bucketed by length (as produced by BucketIterator).
+"""
+
+import time
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig
+from pytorch_pretrained_bert import BertAdam
+
+from allennlp.data.vocabulary import Vocabulary
+
+from babybertsrl.encoder import make_bert_model
+from babybertsrl.model_mt import MTBert
+from babybertsrl.params import param2default
+
+COMPILE_MODES = ['none', 'trace', 'compile']
+SEQUENCE_LENGTHS = [8, 12, 16, 24]  # one bucket per length
+NUM_REPETITIONS = 20
+NUM_LABELS = 64
+
+
+def make_batch(sequence_length: int):
+    batch_size = param2default['batch_size']
+    input_ids = torch.randint(5, input_vocab_size, (batch_size, sequence_length))
+    indicator = torch.zeros_like(input_ids)
+    indicator[:, 1] = 1
+    tags = torch.randint(0, NUM_LABELS, (batch_size, sequence_length))
+    metadata = [{'in': [], 'gold_tags': [], 'start_offsets': []} for _ in range(batch_size)]
+    return {'tokens': {'tokens': input_ids}, 'indicator': indicator, 'tags': tags, 'metadata': metadata}
+
+
+torch.manual_seed(0)
+input_vocab_size = param2default['vocab_size'] + 5
+vocab = Vocabulary(counter={'labels': {f'label{i}': 1 for i in range(NUM_LABELS)}})
+bert_config = BertConfig(vocab_size_or_config_json_file=input_vocab_size,
+                         hidden_size=param2default['hidden_size'],
+                         num_hidden_layers=param2default['num_layers'],
+                         num_attention_heads=param2default['num_attention_heads'],
+                         intermediate_size=param2default['intermediate_size'])
+batches = [make_batch(length) for length in SEQUENCE_LENGTHS]
+
+for compile_mode in COMPILE_MODES:
+    mt_bert = MTBert(vocab_mlm=vocab,
+                     vocab_srl=vocab,
+                     bert_model=make_bert_model(param2default['encoder'], bert_config),
+                     embedding_dropout=param2default['embedding_dropout'],
+                     compile_mode=compile_mode)
+    optimizer = BertAdam(params=mt_bert.parameters(), lr=param2default['lr'])
+
+    # training - first pass over buckets includes compilation and is excluded from timing
+    mt_bert.train()
+    for batch in batches:
+        mt_bert.train_on_batch('mlm', batch, optimizer)
+    start = time.perf_counter()
+    for _ in range(NUM_REPETITIONS):
+        for batch in batches:
+            mt_bert.train_on_batch('mlm', batch, optimizer)
+    ms_train = (time.perf_counter() - start) / NUM_REPETITIONS / len(batches) * 1000
+
+    # inference
+    mt_bert.eval()
+    with torch.no_grad():
+        for batch in batches:
+            mt_bert('mlm', **batch)
+        start = time.perf_counter()
+        for _ in range(NUM_REPETITIONS):
+            for batch in batches:
+                mt_bert('mlm', **batch)
+    ms_eval = (time.perf_counter() - start) / NUM_REPETITIONS / len(batches) * 1000
+
+    print(f'compile_mode={compile_mode:<8} train={ms_train:>8.2f} ms/batch eval={ms_eval:>8.2f} ms/batch')
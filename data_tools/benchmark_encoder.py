@@ -0,0 +1,48 @@
+"""
+Compare the speed of the native encoder and pytorch_pretrained_bert.BertModel on CPU,
+using the default architecture in params.py.
+numerical equivalence of both is tested in tests/test_encoder.py.
+"""
+
+import time
+import torch
+from pytorch_pretrained_bert.modeling import BertModel, BertConfig
+
+from babybertsrl.encoder import NativeBertModel
+from babybertsrl.params import param2default
+
+NUM_REPETITIONS = 50
+SEQUENCE_LENGTH = 16  # typical length of child-directed utterance in word pieces, including [CLS] and [SEP]
+
+torch.manual_seed(0)
+torch.set_grad_enabled(False)
+
+bert_config = BertConfig(vocab_size_or_config_json_file=param2default['vocab_size'] + 5,
+                         hidden_size=param2default['hidden_size'],
+                         num_hidden_layers=param2default['num_layers'],
+                         num_attention_heads=param2default['num_attention_heads'],
+                         intermediate_size=param2default['intermediate_size'])
+legacy = BertModel(config=bert_config).eval()
+native = NativeBertModel.from_legacy(legacy).eval()
+
+# inputs - sequences of different lengths, padded with zeros
+batch_size = param2default['batch_size']
+input_ids = torch.randint(5, bert_config.vocab_size, (batch_size, SEQUENCE_LENGTH))
+lengths = torch.randint(3, SEQUENCE_LENGTH + 1, (batch_size,))
+attention_mask = (torch.arange(SEQUENCE_LENGTH)[None, :] < lengths[:, None]).long()
+input_ids = input_ids * attention_mask
+token_type_ids = torch.zeros_like(input_ids)
+token_type_ids[:, 1] = 1
+kwargs = dict(input_ids=input_ids,
+              token_type_ids=token_type_ids,
+              attention_mask=attention_mask,
+              output_all_encoded_layers=False)
+
+# benchmark
+for name, model in [('legacy', legacy), ('native', native)]:
+    model(**kwargs)  # warm-up
+    start = time.perf_counter()
+    for _ in range(NUM_REPETITIONS):
+        model(**kwargs)
+    ms_per_batch = (time.perf_counter() - start) / NUM_REPETITIONS * 1000
+    print(f'{name:<8} {ms_per_batch:>8.2f} ms per batch (batch_size={batch_size} length={SEQUENCE_LENGTH})')
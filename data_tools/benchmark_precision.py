@@ -0,0 +1,130 @@
+"""
+Compare reduced precision ("bf16", "fp16") against "fp32", side by side.
+
+1. speed and numerical parity of the encoder and a projection layer, using the default architecture in params.py.
+   this runs without AllenNLP. "fp16" is compared on GPU only.
+2. with --train: devel-pp and devel-f1 at the end of training with each precision,
+   using job.main() with the default params (devel split is human-based-2018).
+
+usage:
+    python data_tools/benchmark_precision.py
+    python data_tools/benchmark_precision.py --train --num_mlm_epochs 1
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import torch
+from pytorch_pretrained_bert.modeling import BertModel, BertConfig
+
+from babybertsrl import config
+from babybertsrl.params import param2default
+
+NUM_REPETITIONS = 20
+SEQUENCE_LENGTH = 16  # typical length of child-directed utterance in word pieces, including [CLS] and [SEP]
+NUM_OUT = 4000  # size of MLM output vocab
+
+PRECISION2DTYPE = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}  # as in model_mt.py
+
+
+def benchmark_encoder(device: torch.device) -> None:
+    torch.manual_seed(0)
+    bert_config = BertConfig(vocab_size_or_config_json_file=param2default['vocab_size'] + 5,
+                             hidden_size=param2default['hidden_size'],
+                             num_hidden_layers=param2default['num_layers'],
+                             num_attention_heads=param2default['num_attention_heads'],
+                             intermediate_size=param2default['intermediate_size'])
+    bert_model = BertModel(config=bert_config).to(device).eval()  # no dropout, such that outputs are comparable
+    projection_layer = torch.nn.Linear(bert_config.hidden_size, NUM_OUT).to(device)
+
+    batch_size = param2default['batch_size']
+    input_ids = torch.randint(5, bert_config.vocab_size, (batch_size, SEQUENCE_LENGTH), device=device)
+    lengths = torch.randint(3, SEQUENCE_LENGTH + 1, (batch_size,), device=device)
+    mask = (torch.arange(SEQUENCE_LENGTH, device=device)[None, :] < lengths[:, None]).long()
+    input_ids = input_ids * mask
+    indicator = torch.zeros_like(input_ids)
+    is_valid = mask.bool()
+
+    def compute_logits(precision: str) -> torch.Tensor:
+        # as in MTBert.compute_logits()
+        with torch.autocast(device_type=device.type,
+                            dtype=PRECISION2DTYPE[precision],
+                            enabled=precision != 'fp32'):
+            embeddings, _ = bert_model(input_ids=input_ids,
+                                       token_type_ids=indicator,
+                                       attention_mask=mask,
+                                       output_all_encoded_layers=False)
+            logits = projection_layer(embeddings)
+        return logits.float()
+
+    precisions = ['fp32', 'bf16'] + (['fp16'] if device.type == 'cuda' else [])
+    with torch.no_grad():
+        reference = compute_logits('fp32')[is_valid]
+        reference_predictions = reference.argmax(dim=-1)
+    print(f'device={device} batch_size={batch_size} length={SEQUENCE_LENGTH}')
+    for precision in precisions:
+
+        # parity
+        with torch.no_grad():
+            logits = compute_logits(precision)[is_valid]
+        max_diff = (logits - reference).abs().max().item()
+        agreement = (logits.argmax(dim=-1) == reference_predictions).float().mean().item()
+
+        # speed of forward and backward
+        compute_logits(precision).sum().backward()  # warm-up
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(NUM_REPETITIONS):
+            compute_logits(precision).sum().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        ms_per_batch = (time.perf_counter() - start) / NUM_REPETITIONS * 1000
+
+        print(f'{precision:<6} {ms_per_batch:>8.2f} ms per train batch '
+              f'max abs logit difference={max_diff:.2e} argmax agreement={agreement:.4f}')
+
+
+def compare_training(num_mlm_epochs: int) -> None:
+    from babybertsrl.job import main  # requires AllenNLP
+
+    precisions = ['fp32', 'bf16'] + (['fp16'] if torch.cuda.is_available() else [])
+    precision2results = {}
+    for precision in precisions:
+        torch.manual_seed(0)
+        with tempfile.TemporaryDirectory() as save_path:
+            param2val = dict(param2default,
+                             precision=precision,
+                             num_mlm_epochs=num_mlm_epochs,
+                             param_name='benchmark_precision',
+                             job_name='benchmark_precision',
+                             project_path=str(config.Dirs.root),
+                             save_path=save_path)
+            start = time.perf_counter()
+            name2series = {s.name: s for s in main(param2val)}
+            elapsed = time.perf_counter() - start
+        precision2results[precision] = (name2series['devel_pps'].iloc[-1],
+                                        name2series['devel_f1s'].iloc[-1],
+                                        elapsed)
+
+    print(f'{"precision":<10} {"devel-pp":>10} {"devel-f1":>10} {"minutes":>10}')
+    for precision, (devel_pp, devel_f1, elapsed) in precision2results.items():
+        print(f'{precision:<10} {devel_pp:>10.2f} {devel_f1:>10.4f} {elapsed / 60:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--train', action='store_true', help='compare devel-pp and devel-f1 after training')
+    parser.add_argument('--num_mlm_epochs', type=int, default=param2default['num_mlm_epochs'])
+    args = parser.parse_args()
+
+    benchmark_encoder(torch.device('cpu'))
+    if torch.cuda.is_available():
+        benchmark_encoder(torch.device('cuda'))
+    if args.train:
+        compare_training(args.num_mlm_epochs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Compare speed of word piece tokenization of the CHILDES corpus with and without caching of word types.
+"""
+
+import time
+
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl import config
+from babybertsrl.io import load_utterances_from_file
+from babybertsrl.params import param2default
+from babybertsrl.vocab import make_vocab
+from babybertsrl.word_pieces import wordpiece, CachedWordpieceTokenizer
+
+CORPUS_NAME = 'childes-20191206'
+
+vocab = make_vocab(config.Dirs.data / f'{CORPUS_NAME}_vocab.txt',
+                   config.Dirs.data / 'bert-base-cased.txt',
+                   param2default['vocab_size'])
+utterances = load_utterances_from_file(config.Dirs.data / 'training' / f'{CORPUS_NAME}_mlm.txt')
+num_words = sum([len(u) for u in utterances])
+
+# no cache
+wordpiece_tokenizer = WordpieceTokenizer(vocab)
+start = time.perf_counter()
+for u in utterances:
+    wordpiece(u, wordpiece_tokenizer, lowercase_input=False)
+elapsed_no_cache = time.perf_counter() - start
+print(f'no cache        : {elapsed_no_cache:>6.2f} sec ({num_words / elapsed_no_cache:>12,.0f} words/sec)')
+
+# cache, one utterance at a time
+cached_tokenizer = CachedWordpieceTokenizer(wordpiece_tokenizer)
+start = time.perf_counter()
+for u in utterances:
+    wordpiece(u, cached_tokenizer, lowercase_input=False)
+elapsed = time.perf_counter() - start
+print(f'cache           : {elapsed:>6.2f} sec ({num_words / elapsed:>12,.0f} words/sec) '
+      f'speedup={elapsed_no_cache / elapsed:.1f}x')
+cached_tokenizer.print_stats()
+
+# cache, whole corpus in one call, returning ids
+cached_tokenizer = CachedWordpieceTokenizer(wordpiece_tokenizer)
+start = time.perf_counter()
+encoded = cached_tokenizer.encode(utterances)
+elapsed = time.perf_counter() - start
+print(f'cache, batch ids: {elapsed:>6.2f} sec ({num_words / elapsed:>12,.0f} words/sec) '
+      f'speedup={elapsed_no_cache / elapsed:.1f}x')
+print(f'Encoded {len(encoded.ids):,} word pieces')
@@ -0,0 +1,27 @@
+"""
+Convert binary MLM prediction files (.npz), saved during training, to text, for human inspection.
+
+usage:
+    python data_tools/convert_predictions_to_text.py runs/param_001/probing_agreement_across_PP_results_0.npz
+"""
+
+import argparse
+from pathlib import Path
+
+from babybertsrl.predictions import convert_predictions_to_text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='+', type=Path, help='.npz files - text is written next to each')
+    parser.add_argument('--no_gold', action='store_true', help='do not print gold tags, even if they were saved')
+    args = parser.parse_args()
+
+    for path in args.path:
+        out_path = path.with_suffix('.txt')
+        print(f'Writing {out_path}')
+        convert_predictions_to_text(path, out_path, print_gold=False if args.no_gold else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,16 @@
 """
-How well does AllenNLP SRL tagger perform on CHILDES 2008 SRL data?
+How well does an SRL tagger perform on CHILDES 2008 SRL data?
+
+Any model can be evaluated, as long as it is wrapped in a backend:
+a callable which maps a batch of (words, verb_index) tuples to a batch of BIO tag sequences.
+Propositions are batched by length, and all predictions are scored at once at the end.
+
+Every proposition in the gold file is scored, except those outside the length limits in config.Data,
+which load_propositions_from_file() skips.
+Previously, a proposition was scored only if spacy tagged its predicate as VERB, and lengths were not filtered.
+Results are therefore not directly comparable to those of the previous protocol, below.
+
+Results of Allen NLP BERT-base SRL tagger (backend="allennlp"), with the previous protocol:
 
           ARG-A1 f1= 0.00
           ARG-A4 f1= 0.00
@@ -36,113 +47,117 @@ How well does AllenNLP SRL tagger perform on CHILDES 2008 SRL data?
          overall f1= 0.88
 """
 
-from spacy.tokens import Doc
-from typing import Generator, List
+import time
 from pathlib import Path
-
-from allennlp.predictors.predictor import Predictor
-from allennlp.data.instance import Instance
+from typing import Callable, List, Tuple
+import torch
 
 from babybertsrl import config
+from babybertsrl.io import load_propositions_from_file
 from babybertsrl.scorer import SrlEvalScorer, convert_bio_tags_to_conll_format
 
 CORPUS_NAME = 'human-based-2008'
-INTERACTIVE = False
+BACKEND = 'allennlp'  # or "mtbert"
+CHECKPOINT_PATH = Path('runs') / 'param_001' / 'checkpoint'  # only used by "mtbert" backend
 BATCH_SIZE = 128
 
+Backend = Callable[[List[Tuple[List[str], int]]], List[List[str]]]
 
-def gen_instances_from_gold(verb_index: int,
-                            words: List[str],
-                            gold_tags: List[str],
-                            ) -> Generator[Instance, None, None]:
-    # POS-tagging
-    spacy_doc = Doc(predictor._tokenizer.spacy.vocab, words=words)
-    for pipe in filter(None, predictor._tokenizer.spacy.pipeline):
-        pipe[1](spacy_doc)  # this does POS tagging
-
-    # to instances - one for each verb in utterance
-    tokens = [token for token in spacy_doc]
-    for i, word in enumerate(tokens):
-        if word.pos_ == "VERB":
-
-            if i != verb_index:  # only evaluate predictions for propositions with same verb index
-                continue
 
-            # instance
-            verb_labels = [0 for _ in words]
-            verb_labels[i] = 1
-            instance = predictor._dataset_reader.text_to_instance(tokens, verb_labels)
+def make_allennlp_backend() -> Backend:
+    from allennlp.predictors.predictor import Predictor
+    from allennlp.data.tokenizers import Token
 
-            # meta data
-            metadata = dict()
-            metadata['in'] = words
-            metadata['verb_index'] = i
-            metadata['gold_tags'] = gold_tags
+    predictor = Predictor.from_path("https://s3-us-west-2.amazonaws.com/allennlp/models/bert-base-srl-2019.06.17.tar.gz",
+                                    cuda_device=0 if torch.cuda.is_available() else -1)
 
-            yield instance, metadata
+    def backend(sentences):
+        instances = []
+        for words, verb_index in sentences:
+            verb_labels = [int(i == verb_index) for i in range(len(words))]
+            instances.append(predictor._dataset_reader.text_to_instance([Token(w) for w in words], verb_labels))
+        return [d['tags'] for d in predictor._model.forward_on_instances(instances)]
 
+    return backend
 
-def gen_instances(file_path: Path) -> Generator[Instance, None, None]:
-    with file_path.open('r') as f:
-        for line in f.readlines():
-            inputs = line.strip().split('|||')
-            left_input = inputs[0].strip().split()
-            right_input = inputs[1].strip().split()
-            verb_index = int(left_input[0])
-            words = left_input[1:]
-            gold_tags = right_input
 
-            instances = gen_instances_from_gold(verb_index, words, gold_tags)
-            # in case no verbs are found
-            if not instances:
-                continue
-            else:
-                yield from instances
+def make_mtbert_backend(checkpoint_path: Path) -> Backend:
+    from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+    from babybertsrl.checkpoint import load_checkpoint
+    from babybertsrl.converter import make_inference_batch
 
+    model, input_vocab = load_checkpoint(checkpoint_path)
+    if torch.cuda.is_available():
+        model.cuda()
+    wordpiece_tokenizer = WordpieceTokenizer(input_vocab)
 
-# srl tagger
-predictor = Predictor.from_path("https://s3-us-west-2.amazonaws.com/allennlp/models/bert-base-srl-2019.06.17.tar.gz",
-                                cuda_device=0)
+    def backend(sentences):
+        with torch.no_grad():
+            output_dict = model('srl', **make_inference_batch(sentences, wordpiece_tokenizer))
+        return model.decode(output_dict, task='srl')
 
-# scorer
-srl_eval_path = config.Dirs.root / 'perl' / 'srl-eval.pl'
-scorer = SrlEvalScorer(srl_eval_path, ignore_classes=['V'])
+    return backend
 
 
-gold_path = config.Dirs.data / 'training' / f'{CORPUS_NAME}_srl.txt'
-for n, (instance, md) in enumerate(gen_instances(gold_path)):
+def evaluate(backend: Backend,
+             propositions: List[Tuple[List[str], int, List[str]]],
+             batch_size: int,
+             srl_eval_path: Path,
+             ):
+    # batch by length to minimize padding
+    propositions = sorted(propositions, key=lambda p: len(p[0]))
 
-    # get SRL predictions (decoding included)
-    output_dict = predictor._model.forward_on_instance(instance)
+    batch_verb_indices = []
+    batch_sentences = []
+    batch_conll_predicted_tags = []
+    batch_conll_gold_tags = []
+    for start in range(0, len(propositions), batch_size):
+        batch = propositions[start: start + batch_size]
 
-    # metadata
-    batch_verb_indices = [md['verb_index']]
-    batch_sentences = [md['in']]
+        # get SRL predictions (decoding included)
+        predicted_tags = backend([(words, verb_index) for words, verb_index, _ in batch])
 
-    # convert to conll
-    batch_conll_predicted_tags = [convert_bio_tags_to_conll_format(output_dict['tags'])]
-    batch_conll_gold_tags = [convert_bio_tags_to_conll_format(md['gold_tags'])]
+        # collect
+        for (words, verb_index, gold_tags), tags in zip(batch, predicted_tags):
+            batch_verb_indices.append(verb_index)
+            batch_sentences.append(words)
+            batch_conll_predicted_tags.append(convert_bio_tags_to_conll_format(tags))
+            batch_conll_gold_tags.append(convert_bio_tags_to_conll_format(gold_tags))
 
-    # console
-    print(batch_sentences)
-    print(batch_conll_predicted_tags)
-    print(batch_conll_gold_tags)
-
-    # update signal detection metrics
+    # score all propositions at once - the perl script is called only once
+    scorer = SrlEvalScorer(srl_eval_path, ignore_classes=['V'])
     scorer(batch_verb_indices,
            batch_sentences,
            batch_conll_predicted_tags,
            batch_conll_gold_tags)
+    return scorer.get_tag2metrics(reset=True)
+
+
+def main():
+    if BACKEND == 'allennlp':
+        backend = make_allennlp_backend()
+        out_path = Path(f'model_vs_{CORPUS_NAME}_f1.csv')
+    elif BACKEND == 'mtbert':
+        backend = make_mtbert_backend(CHECKPOINT_PATH)
+        out_path = Path(f'mtbert_vs_{CORPUS_NAME}_f1.csv')
+    else:
+        raise AttributeError('Invalid arg to "BACKEND"')
+
+    gold_path = config.Dirs.data / 'training' / f'{CORPUS_NAME}_srl.txt'
+    propositions = load_propositions_from_file(gold_path)
+
+    start = time.perf_counter()
+    tag2metrics = evaluate(backend, propositions, BATCH_SIZE, config.Dirs.root / 'perl' / 'srl-eval.pl')
+    elapsed = time.perf_counter() - start
+    print(f'Evaluated {len(propositions):,} propositions at {len(propositions) / elapsed:,.1f} propositions/sec')
 
-    tag2metrics = scorer.get_tag2metrics(reset=False)
-    print(f'proposition={n:>6,} f1={tag2metrics["overall"]["f1"]:.4f}')
-    print()
+    # print f1 summary by tag
+    SrlEvalScorer.print_summary(tag2metrics)
+    print(f'overall f1={tag2metrics["overall"]["f1"]:.4f}')
 
-# compute f1 on accumulated signal detection metrics for each tag and reset
-tag2metrics = scorer.get_tag2metrics(reset=True)
+    # save
+    SrlEvalScorer.save_tag2metrics(out_path, tag2metrics)
 
-# print f1 summary by tag
-scorer.print_summary(tag2metrics)
 
-# save
-scorer.save_tag2metrics(Path(f'model_vs_{CORPUS_NAME}_f1.csv'), tag2metrics)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
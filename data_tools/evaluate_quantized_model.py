@@ -0,0 +1,106 @@
+"""
+Export a trained model to int8, and compare it to the fp32 model on CPU:
+devel-f1 on human-based-2018, agreement of predictions on probing sentences, and latency/throughput.
+
+usage:
+    python data_tools/evaluate_quantized_model.py --checkpoint runs/param_001/checkpoint
+"""
+
+import argparse
+import time
+from pathlib import Path
+import torch
+
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+from allennlp.data.iterators import BucketIterator
+from allennlp.data.vocabulary import Vocabulary
+
+from babybertsrl import config
+from babybertsrl.checkpoint import load_checkpoint, load_params, export_quantized
+from babybertsrl.converter import ConverterMLM, ConverterSRL
+from babybertsrl.eval import evaluate_model_on_f1
+from babybertsrl.io import load_propositions_from_file, load_utterances_from_file
+
+DEVEL_NAME = 'human-based-2018'
+BATCH_SIZE = 512
+
+
+def make_bucket_batcher(vocab: Vocabulary) -> BucketIterator:
+    """
+    without padding noise, instances of the same length are not shuffled,
+    such that both models are evaluated on identical batches, in the same order, and predictions can be paired
+    """
+    res = BucketIterator(batch_size=BATCH_SIZE, sorting_keys=[('tokens', "num_tokens")], padding_noise=0.0)
+    res.index_with(vocab)
+    return res
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=Path, default=Path('runs') / 'param_001' / 'checkpoint',
+                    help='saved at end of job.main')
+CHECKPOINT_PATH = parser.parse_args().checkpoint
+
+export_path = CHECKPOINT_PATH.parent / 'checkpoint_int8'
+if not export_path.exists():
+    export_quantized(CHECKPOINT_PATH, export_path)
+
+params = load_params(CHECKPOINT_PATH)
+model_fp32, input_vocab = load_checkpoint(CHECKPOINT_PATH)
+model_int8, _ = load_checkpoint(export_path)
+name2model = {'fp32': model_fp32, 'int8': model_int8}
+wordpiece_tokenizer = WordpieceTokenizer(input_vocab)
+converter_srl = ConverterSRL(params, wordpiece_tokenizer)
+converter_mlm = ConverterMLM(params, wordpiece_tokenizer)
+
+for name, path in [('fp32', CHECKPOINT_PATH), ('int8', export_path)]:
+    size = (path / 'state_dict.pt').stat().st_size / 1e6
+    print(f'{name} state dict size={size:.1f}MB')
+
+# devel f1
+srl_eval_path = config.Dirs.root / 'perl' / 'srl-eval.pl'
+devel_propositions = load_propositions_from_file(config.Dirs.data / 'training' / f'{DEVEL_NAME}_srl.txt')
+devel_instances_srl = converter_srl.make_instances(devel_propositions)
+name2f1 = {}
+for name, model in name2model.items():
+    bucket_batcher = make_bucket_batcher(model.vocab_srl)
+    start = time.perf_counter()
+    devel_generator = bucket_batcher(devel_instances_srl, num_epochs=1, shuffle=False)
+    name2f1[name] = evaluate_model_on_f1(model, srl_eval_path, devel_generator)
+    elapsed = time.perf_counter() - start
+    print(f'{name} devel-f1={name2f1[name]:.4f} '
+          f'propositions/sec={len(devel_instances_srl) / elapsed:,.0f} (including scoring)')
+print(f'devel-f1 delta={name2f1["int8"] - name2f1["fp32"]:+.4f}')
+
+# probing - agreement of predictions at masked positions, and latency per batch
+for probing_name in config.Eval.probing_names:
+    probing_data_path = config.Dirs.data / 'probing' / f'{probing_name}.txt'
+    if not probing_data_path.exists():
+        print(f'WARNING: {probing_data_path} does not exist')
+        continue
+    probing_utterances = load_utterances_from_file(probing_data_path)
+    probing_instances = converter_mlm.make_probing_instances(probing_utterances)
+
+    name2predictions = {}
+    name2sentences = {}
+    for name, model in name2model.items():
+        bucket_batcher = make_bucket_batcher(model.vocab_mlm)
+        predictions = []
+        sentences = []
+        latencies = []
+        for batch in bucket_batcher(probing_instances, num_epochs=1, shuffle=False):
+            start = time.perf_counter()
+            with torch.no_grad():
+                output_dict = model(task='mlm', **batch)
+            latencies.append(time.perf_counter() - start)
+            for words, tags in zip(output_dict['in'], model.decode(output_dict, task='mlm')):
+                predictions.append(tags[words.index('[MASK]')])
+                sentences.append(words)
+        name2predictions[name] = predictions
+        name2sentences[name] = sentences
+        print(f'{probing_name} {name} ms/batch={sum(latencies) / len(latencies) * 1000:.1f} '
+              f'sentences/sec={len(probing_instances) / sum(latencies):,.0f}')
+
+    assert name2sentences['fp32'] == name2sentences['int8']  # predictions are paired by sentence
+    num_same = sum([a == b for a, b in zip(name2predictions['fp32'], name2predictions['int8'])])
+    print(f'{probing_name} int8 predictions identical to fp32={num_same / len(probing_instances):.4f} '
+          f'number of distinct fp32 predictions={len(set(name2predictions["fp32"]))}')
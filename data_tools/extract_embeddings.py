@@ -0,0 +1,169 @@
+"""
+Extract contextualized embeddings of words from a trained model (see babybertsrl/checkpoint.py),
+e.g. to compare the arguments of "put" and "drink", or singular and plural nouns.
+
+- utterances (MLM format) or propositions (SRL format, with the predicate marked by the indicator) are streamed
+- sentences are batched by length, with a budget on the number of word pieces per batch
+- batches are encoded by a pool of workers, each holding its own model
+- the embedding of each word is the embedding of its first word piece, at each of the selected layers
+- embeddings are written in the order of the corpus to a memory-mapped float16 array, never held in RAM as a whole
+
+output directory:
+ - embeddings.npy: float16, [num_words, num_layers, hidden_size]
+ - word_ids.npy: int32, [num_words], ids into words.txt
+ - sentence_offsets.npy: int64, [num_sentences + 1], the words of sentence i are [offsets[i]: offsets[i + 1]]
+ - predicate_indices.npy: int32, [num_sentences], -1 for utterances
+ - words.txt, layers.txt
+
+usage:
+    python data_tools/extract_embeddings.py --input data/training/childes-20191206_mlm.txt --layers -1 -2
+"""
+
+import argparse
+import os
+from array import array
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import torch
+
+from pytorch_pretrained_bert.modeling import BertConfig
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl.checkpoint import load_checkpoint
+from babybertsrl.io import gen_propositions_from_file, gen_utterances_from_file, LengthStats
+from babybertsrl.word_pieces import CachedWordpieceTokenizer
+
+MAX_NUM_WORD_PIECES = 8192  # per batch, including padding
+CHUNK_SIZE = 2000  # number of sentences per task submitted to the pool
+
+# set in each worker
+model = None
+wordpiece_tokenizer = None
+layers = None
+
+Sentence = Tuple[List[str], Optional[int]]  # words, and predicate index or None
+
+
+def init_worker(checkpoint_path: Path, selected_layers: List[int]):
+    global model, wordpiece_tokenizer, layers
+    torch.set_num_threads(1)  # parallelism comes from the number of workers
+    model, input_vocab = load_checkpoint(checkpoint_path)
+    wordpiece_tokenizer = CachedWordpieceTokenizer(WordpieceTokenizer(input_vocab))
+    layers = selected_layers
+
+
+def gen_sentences(input_path: Path, is_srl: bool) -> Iterator[Sentence]:
+    stats = LengthStats()
+    if is_srl:
+        for words, predicate_index, _ in gen_propositions_from_file(input_path, stats):
+            yield words, predicate_index
+    else:
+        for words in gen_utterances_from_file(input_path, stats):
+            yield words, None
+    stats.print_summary('sentence')
+
+
+def gen_batches(lengths: np.ndarray) -> Iterator[np.ndarray]:
+    """yield indices of sentences of similar length, such that padded size does not exceed budget"""
+    batch = []
+    for n in np.argsort(lengths, kind='stable'):
+        if batch and (len(batch) + 1) * lengths[n] > MAX_NUM_WORD_PIECES:
+            yield np.array(batch)
+            batch = []
+        batch.append(n)
+    if batch:
+        yield np.array(batch)
+
+
+def encode_chunk(chunk: List[Sentence]) -> np.ndarray:
+    """return embeddings of all words in chunk, in order of sentences"""
+    encoded = wordpiece_tokenizer.encode([words for words, _ in chunk])
+    lengths = np.diff(encoded.sentence_offsets)
+    hidden_size = model.bert_model.config.hidden_size
+    res = np.empty((encoded.word_offsets[-1], len(layers), hidden_size), dtype=np.float16)
+
+    for batch_ids in gen_batches(lengths):
+        max_length = int(lengths[batch_ids].max())
+        input_ids = torch.zeros(len(batch_ids), max_length, dtype=torch.long)
+        indicator = torch.zeros(len(batch_ids), max_length, dtype=torch.long)
+        for row, n in enumerate(batch_ids):
+            start, end = encoded.sentence_offsets[n], encoded.sentence_offsets[n + 1]
+            input_ids[row, :end - start] = torch.from_numpy(encoded.ids[start: end].astype(np.int64))
+            predicate_index = chunk[n][1]
+            if predicate_index is not None:  # all word pieces of the predicate are indicated
+                word = encoded.word_offsets[n] + predicate_index
+                indicator[row, encoded.start_offsets[word]: encoded.end_offsets[word] + 1] = 1
+        mask = (input_ids != 0).long()
+
+        with torch.no_grad(), model.autocast():
+            encoded_layers, _ = model.bert_model(input_ids=input_ids,
+                                                 token_type_ids=indicator,
+                                                 attention_mask=mask,
+                                                 output_all_encoded_layers=True)
+        selected = torch.stack([encoded_layers[layer] for layer in layers], dim=2).half().numpy()
+
+        # first word piece of each word
+        for row, n in enumerate(batch_ids):
+            word_start, word_end = encoded.word_offsets[n], encoded.word_offsets[n + 1]
+            res[word_start: word_end] = selected[row, encoded.start_offsets[word_start: word_end]]
+
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=Path, default=Path('runs') / 'param_001' / 'checkpoint')
+    parser.add_argument('--input', type=Path, required=True, help='text file of utterances or propositions')
+    parser.add_argument('--srl', action='store_true', help='input contains propositions')
+    parser.add_argument('--layers', type=int, nargs='+', default=[-1], help='-1 is the last layer')
+    parser.add_argument('--out', type=Path, default=None, help='defaults to input path without suffix')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    out_path = args.out or args.input.with_suffix('')
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    # first pass: index of words and sentences, without holding sentences in memory
+    word2id = {}
+    word_ids = array('i')
+    sentence_lengths = [0]
+    predicate_indices = []
+    for words, predicate_index in gen_sentences(args.input, args.srl):
+        word_ids.extend(word2id.setdefault(w, len(word2id)) for w in words)
+        sentence_lengths.append(len(words))
+        predicate_indices.append(-1 if predicate_index is None else predicate_index)
+    sentence_offsets = np.cumsum(sentence_lengths, dtype=np.int64)
+    np.save(out_path / 'word_ids.npy', np.frombuffer(word_ids, dtype=np.int32))
+    np.save(out_path / 'sentence_offsets.npy', sentence_offsets)
+    np.save(out_path / 'predicate_indices.npy', np.array(predicate_indices, dtype=np.int32))
+    (out_path / 'words.txt').write_text('\n'.join(sorted(word2id, key=word2id.get)) + '\n')
+    (out_path / 'layers.txt').write_text('\n'.join(str(layer) for layer in args.layers) + '\n')
+    num_words = len(word_ids)
+    del word_ids, word2id
+
+    # second pass: embeddings
+    hidden_size = BertConfig.from_json_file(str(args.checkpoint / 'bert_config.json')).hidden_size
+    embeddings = np.lib.format.open_memmap(out_path / 'embeddings.npy', mode='w+', dtype=np.float16,
+                                           shape=(num_words, len(args.layers), hidden_size))
+    sentences = gen_sentences(args.input, args.srl)
+    chunks = iter(lambda: list(islice(sentences, CHUNK_SIZE)), [])
+    position = 0
+    with Pool(args.num_workers, initializer=init_worker, initargs=(args.checkpoint, args.layers)) as pool:
+        # chunks are submitted a few at a time, because the pool would otherwise read the whole input ahead.
+        # imap preserves order of chunks, such that rows are in order of the corpus
+        for window in iter(lambda: list(islice(chunks, 2 * args.num_workers)), []):
+            for chunk_embeddings in pool.imap(encode_chunk, window):
+                embeddings[position: position + len(chunk_embeddings)] = chunk_embeddings
+                position += len(chunk_embeddings)
+            print(f'Extracted embeddings of {position:>12,}/{num_words:,} words', flush=True)
+
+    assert position == num_words
+    embeddings.flush()
+    print(f'Saved embeddings to {out_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Find exact and near-duplicate sentences within and across
+ - the MLM corpus (utterances)
+ - the model-based SRL data (propositions)
+ - the human-based SRL data, used for devel and test (propositions)
+and write copies of the training data, without sentences which are (near-)duplicates of human-based sentences.
+also reports leakage: sentences of the devel and test splits of the training data (see io.split())
+which are (near-)duplicates of sentences of the train split.
+
+this replaces exact matching of "{predicate} {words}" in remove_human_from_model_srl_data.py:
+ - propositions are compared by their sentence, because a sentence leaks into devel and test regardless of predicate
+ - sentences are compared ignoring case and punctuation, and by MinHash signatures (see babybertsrl/dedup.py),
+   computed and linked by a pool of workers
+
+output directory:
+ - report.txt: number of (near-)duplicate sentences within and across corpora, leakage across splits, and examples
+ - {corpus}_mlm.txt: utterances of the MLM corpus, one per line
+ - {corpus}_no-dev_srl.txt: unique lines of the model-based SRL data
+
+usage:
+    python data_tools/find_near_duplicates.py --num_workers 8
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+from babybertsrl import config
+from babybertsrl.dedup import find_clusters, get_dedup_key, get_words, make_signatures, NUM_BANDS, NUM_ROWS
+from babybertsrl.io import assign_splits, gen_propositions_from_file, gen_utterances_from_file
+
+CHUNK_SIZE = 10000  # number of sentences per task submitted to the pool
+NUM_EXAMPLES = 20  # per pair of corpora
+
+
+def format_proposition(proposition: tuple) -> str:
+    words, predicate_index, tags = proposition
+    return f'{predicate_index} {" ".join(words)} ||| {" ".join(tags)}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default='childes-20191206')
+    parser.add_argument('--human', nargs='+', default=['human-based-2008', 'human-based-2018'])
+    parser.add_argument('--threshold', type=float, default=0.8, help='minimum estimated Jaccard similarity')
+    parser.add_argument('--out', type=Path, default=config.Dirs.data / 'deduplicated')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    training_path = config.Dirs.data / 'training'
+    human_names = [f'{name}_srl' for name in args.human]
+    mlm_name = f'{args.corpus}_mlm'
+    model_name = f'{args.corpus}_srl'
+
+    # load corpora - sentences shared within and across corpora are stored once
+    name2items: Dict[str, List] = {
+        mlm_name: list(gen_utterances_from_file(training_path / f'{mlm_name}.txt')),
+        model_name: list(gen_propositions_from_file(training_path / f'{model_name}.txt', filter_lengths=False)),
+    }
+    for name in human_names:
+        name2items[name] = list(gen_propositions_from_file(training_path / f'{name}.txt', filter_lengths=False))
+    sentence2id = {}
+    key2id = {}
+    name2sentence_ids = {}
+    for name, items in name2items.items():
+        name2sentence_ids[name] = np.array([sentence2id.setdefault(' '.join(get_words(i)), len(sentence2id))
+                                            for i in items], dtype=np.int64)
+        print(f'Loaded {len(items):>9,} sentences of {name}')
+    sentences = [s.split() for s in sentence2id]  # in order of id
+    normalized_ids = np.array([key2id.setdefault(get_dedup_key(s), len(key2id)) for s in sentences], dtype=np.int64)
+    del sentence2id, key2id
+
+    # signatures, in order of sentences
+    start = time.perf_counter()
+    chunks = [sentences[i: i + CHUNK_SIZE] for i in range(0, len(sentences), CHUNK_SIZE)]
+    with Pool(args.num_workers) as pool:
+        signatures = np.concatenate(list(pool.imap(make_signatures, chunks))
+                                    or [np.zeros((0, NUM_BANDS * NUM_ROWS), dtype=np.uint64)])
+    print(f'Made signatures of {len(sentences):,} unique sentences in {time.perf_counter() - start:.1f} sec')
+    start = time.perf_counter()
+    clusters = find_clusters(signatures, args.threshold, num_workers=args.num_workers)
+    print(f'Found {len(np.unique(clusters)):,} clusters in {time.perf_counter() - start:.1f} sec')
+
+    # report
+    lines = [f'threshold={args.threshold}', '']
+    lines.append(f'{"corpus":<32} {"sentences":>12} {"unique":>12} {"normalized":>12} {"clusters":>12}')
+    for name, sentence_ids in name2sentence_ids.items():
+        lines.append(f'{name:<32} {len(sentence_ids):>12,} {len(np.unique(sentence_ids)):>12,} '
+                     f'{len(np.unique(normalized_ids[sentence_ids])):>12,} '
+                     f'{len(np.unique(clusters[sentence_ids])):>12,}')
+    lines.append('')
+    lines.append(f'{"sentences of corpus":<32} {"in corpus":<32} {"exact":>12} {"near":>12}')
+    examples = []
+    for name_a, sentence_ids_a in name2sentence_ids.items():
+        for name_b, sentence_ids_b in name2sentence_ids.items():
+            if name_a == name_b:
+                continue
+            is_exact = np.isin(normalized_ids[sentence_ids_a], normalized_ids[sentence_ids_b])
+            is_near = np.isin(clusters[sentence_ids_a], clusters[sentence_ids_b])
+            lines.append(f'{name_a:<32} {name_b:<32} {is_exact.sum():>12,} {is_near.sum():>12,}')
+
+            # examples of near-duplicates which are not exact, from human-based data
+            if name_a not in human_names:
+                continue
+            cluster2sentence_id = dict(zip(clusters[sentence_ids_b].tolist(), sentence_ids_b.tolist()))
+            examples.append(f'{name_a} - {name_b}')
+            for sentence_id in np.unique(sentence_ids_a[is_near & ~is_exact])[:NUM_EXAMPLES].tolist():
+                other_id = cluster2sentence_id[clusters[sentence_id]]
+                examples.append(f'  {" ".join(sentences[sentence_id]):<60} {" ".join(sentences[other_id])}')
+    lines.append('')
+
+    # leakage - the split of an item does not depend on other items, so items are assigned as in job.main()
+    lines.append(f'{"devel or test of corpus":<32} {"split":<8} {"sentences":>12} {"exact":>12} {"near":>12}')
+    for name in [mlm_name, model_name]:
+        sentence_ids = name2sentence_ids[name]
+        is_train, is_devel, is_test = assign_splits(name2items[name])
+        train_normalized_ids = normalized_ids[sentence_ids[is_train]]
+        train_clusters = clusters[sentence_ids[is_train]]
+        for split_name, is_split in [('devel', is_devel), ('test', is_test)]:
+            split_ids = sentence_ids[is_split]
+            is_exact = np.isin(normalized_ids[split_ids], train_normalized_ids)
+            is_near = np.isin(clusters[split_ids], train_clusters)
+            lines.append(f'{name:<32} {split_name:<8} {len(split_ids):>12,} {is_exact.sum():>12,} {is_near.sum():>12,}')
+    lines += [''] + examples
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    report = '\n'.join(lines) + '\n'
+    print(report)
+    (args.out / 'report.txt').write_text(report)
+
+    # write training data without sentences in clusters of human-based sentences
+    human_clusters = np.unique(np.concatenate([clusters[name2sentence_ids[name]] for name in human_names]))
+
+    is_kept = ~np.isin(clusters[name2sentence_ids[mlm_name]], human_clusters)
+    with (args.out / f'{mlm_name}.txt').open('w') as f:
+        for n in np.flatnonzero(is_kept).tolist():
+            f.write(' '.join(name2items[mlm_name][n]) + '\n')
+    print(f'Kept {is_kept.sum():>9,}/{len(is_kept):>9,} utterances of {mlm_name}')
+
+    is_kept = ~np.isin(clusters[name2sentence_ids[model_name]], human_clusters)
+    kept_lines = dict.fromkeys(format_proposition(name2items[model_name][n]) for n in np.flatnonzero(is_kept))
+    with (args.out / f'{args.corpus}_no-dev_srl.txt').open('w') as f:
+        f.write('\n'.join(kept_lines))  # do not write '\n' at end of file
+    print(f'Kept {len(kept_lines):>9,}/{len(is_kept):>9,} unique propositions of {model_name}')
+
+
+if __name__ == '__main__':
+    main()
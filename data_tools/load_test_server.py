@@ -0,0 +1,55 @@
+"""
+Send concurrent requests to a running server (babybertsrl/server.py), and report latency and throughput,
+for SRL requests, MLM requests, and both at once (alternating), such that SRL and MLM requests share batches.
+"""
+
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from babybertsrl import config
+from babybertsrl.io import load_propositions_from_file
+
+URL = 'http://127.0.0.1:8000'
+NAME = 'human-based-2018'
+NUM_REQUESTS = 2000
+NUM_CLIENTS = [1, 8, 32, 128]
+TASKS = ['srl', 'mlm', 'srl+mlm']
+
+
+def send(task_and_data) -> float:
+    task, data = task_and_data
+    request = urllib.request.Request(f'{URL}/{task}', data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        json.loads(response.read())
+    return time.perf_counter() - start
+
+
+random.seed(0)
+propositions = load_propositions_from_file(config.Dirs.data / 'training' / f'{NAME}_srl.txt')[:NUM_REQUESTS]
+srl_requests = [('srl', json.dumps({'words': words, 'verb_index': verb_index}).encode())
+                for words, verb_index, _ in propositions]
+mlm_requests = []
+for words, _, _ in propositions:
+    masked_index = random.randrange(len(words))
+    masked = ['[MASK]' if i == masked_index else w for i, w in enumerate(words)]
+    mlm_requests.append(('mlm', json.dumps({'words': masked}).encode()))
+task2requests = {'srl': srl_requests,
+                 'mlm': mlm_requests,
+                 'srl+mlm': [pair[n % 2] for n, pair in enumerate(zip(srl_requests, mlm_requests))]}
+
+for task in TASKS:
+    requests = task2requests[task]
+    for num_clients in NUM_CLIENTS:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_clients) as executor:
+            latencies = np.array(list(executor.map(send, requests))) * 1000
+        elapsed = time.perf_counter() - start
+        print(f'task={task:<8} clients={num_clients:>4} '
+              f'p50={np.percentile(latencies, 50):>7.1f}ms '
+              f'p99={np.percentile(latencies, 99):>7.1f}ms '
+              f'throughput={len(requests) / elapsed:>8,.0f} requests/sec')
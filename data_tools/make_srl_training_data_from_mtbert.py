@@ -0,0 +1,202 @@
+"""
+Annotate CHILDES utterances with SRL tags using a locally trained model (see babybertsrl/checkpoint.py),
+instead of the remote Allen NLP predictor in make_srl_training_data_from_model.py.
+
+- runs offline, on all CPU cores
+- utterances are streamed from the corpus in chunks to a process pool, each worker holds its own model
+- within a chunk, propositions are batched by their length in word pieces, with a budget on the number of word pieces
+  per batch
+- lines are written to a temporary file as soon as a chunk is done, in the order of the corpus,
+  which replaces the output file when all chunks are done
+- duplicate lines are not written
+- resumable: chunks which are listed in the progress file are skipped when the script is restarted
+- an existing output file is only replaced with --overwrite
+
+predicate candidates are words tagged as VERB by spacy.
+unlike make_srl_training_data_from_model.py, utterances are not segmented with DeepSegment,
+which requires tensorflow and a GPU.
+
+usage:
+    python data_tools/make_srl_training_data_from_mtbert.py
+    python data_tools/make_srl_training_data_from_mtbert.py --overwrite
+    python data_tools/make_srl_training_data_from_mtbert.py --checkpoint runs/param_002/checkpoint
+"""
+
+import argparse
+import hashlib
+import math
+import os
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator, List, Tuple
+import numpy as np
+import torch
+import spacy
+from spacy.tokens import Doc
+
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl import config
+from babybertsrl.checkpoint import load_checkpoint
+from babybertsrl.converter import make_inference_batch
+from babybertsrl.io import LengthStats, gen_utterances_from_file
+from babybertsrl.word_pieces import CachedWordpieceTokenizer
+
+CORPUS_NAME = 'childes-20191206'
+NUM_WORKERS = os.cpu_count()
+CHUNK_SIZE = 2000  # number of utterances per task submitted to the pool
+MAX_NUM_WORD_PIECES = 8192  # per batch, including padding
+
+# set in each worker
+model = None
+wordpiece_tokenizer = None
+nlp = None
+
+
+def init_worker(checkpoint_path: Path):
+    global model, wordpiece_tokenizer, nlp
+    torch.set_num_threads(1)  # parallelism comes from the number of workers
+    model, input_vocab = load_checkpoint(checkpoint_path)
+    wordpiece_tokenizer = CachedWordpieceTokenizer(WordpieceTokenizer(input_vocab))
+    nlp = spacy.load('en_core_web_sm', disable=['parser', 'ner'])
+
+
+def find_predicate_candidates(words: List[str]) -> List[int]:
+    spacy_doc = Doc(nlp.vocab, words=words)
+    for _, pipe in nlp.pipeline:
+        pipe(spacy_doc)  # this does POS tagging
+    return [token.i for token in spacy_doc if token.pos_ == 'VERB']
+
+
+def gen_batches(lengths: np.ndarray) -> Iterator[np.ndarray]:
+    """yield indices of propositions of similar length, such that padded size does not exceed budget"""
+    batch = []
+    for n in np.argsort(lengths, kind='stable'):
+        if batch and (len(batch) + 1) * lengths[n] > MAX_NUM_WORD_PIECES:
+            yield np.array(batch)
+            batch = []
+        batch.append(n)
+    if batch:
+        yield np.array(batch)
+
+
+def annotate_chunk(chunk: Tuple[int, List[List[str]]]) -> Tuple[int, List[str], int, int]:
+    chunk_id, utterances = chunk
+
+    propositions = [(words, verb_index)
+                    for words in utterances
+                    for verb_index in find_predicate_candidates(words)]
+
+    # number of word pieces of each proposition, including [CLS] and [SEP]
+    lengths = np.diff(wordpiece_tokenizer.encode([words for words, _ in propositions]).sentence_offsets)
+
+    lines = []
+    num_no_verb = 0
+    num_only_verb = 0
+    for batch_ids in gen_batches(lengths):
+        sentences = [propositions[n] for n in batch_ids]
+        with torch.no_grad():
+            output_dict = model('srl', **make_inference_batch(sentences, wordpiece_tokenizer))
+        for (words, _), tags in zip(sentences, model.decode(output_dict, task='srl')):
+
+            # sometimes there is no B-V
+            if 'B-V' not in tags:
+                num_no_verb += 1
+                continue
+
+            # sometimes there is only a verb but no arguments (e.g. auxiliary word) - skip
+            if not [tag for tag in tags if 'ARG' in tag]:
+                num_only_verb += 1
+                continue
+
+            # make line
+            verb_index = tags.index('B-V')
+            x_string = " ".join(words)
+            y_string = " ".join(tags)
+            lines.append(f'{verb_index} {x_string} ||| {y_string}')
+
+    return chunk_id, lines, num_no_verb, num_only_verb
+
+
+def hash_line(line: str) -> bytes:
+    return hashlib.md5(line.encode()).digest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=Path, default=Path('runs') / 'param_001' / 'checkpoint',
+                        help='saved at end of job.main')
+    parser.add_argument('--overwrite', action='store_true', help='replace an existing output file')
+    args = parser.parse_args()
+
+    srl_path = config.Dirs.data / 'training' / f'{CORPUS_NAME}_srl.txt'
+    tmp_path = srl_path.with_suffix('.tmp')
+    progress_path = srl_path.with_suffix('.progress')
+
+    # resume
+    done_chunk_ids = set()
+    line_hashes = set()
+    if progress_path.exists() and tmp_path.exists():
+        done_chunk_ids = set(int(i) for i in progress_path.read_text().split())
+        with tmp_path.open('r') as f:
+            line_hashes = set(hash_line(line.rstrip('\n')) for line in f)
+        print(f'Resuming after {len(done_chunk_ids)} chunks and {len(line_hashes):,} lines')
+    else:
+        if srl_path.exists() and not args.overwrite:
+            raise SystemExit(f'{srl_path} exists. Use --overwrite to replace it')
+        tmp_path.write_text('')
+        progress_path.write_text('')
+
+    # first pass: count utterances, without holding them in memory
+    mlm_path = config.Dirs.data / 'training' / f'{CORPUS_NAME}_mlm.txt'
+    stats = LengthStats()
+    num_utterances = sum(1 for _ in gen_utterances_from_file(mlm_path, stats))
+    stats.print_summary('utterance')
+    num_chunks = math.ceil(num_utterances / CHUNK_SIZE)
+
+    # second pass: annotate chunks of utterances, skipping chunks which are done
+    utterances = gen_utterances_from_file(mlm_path)
+    chunks = ((chunk_id, chunk)
+              for chunk_id, chunk in enumerate(iter(lambda: list(islice(utterances, CHUNK_SIZE)), []))
+              if chunk_id not in done_chunk_ids)
+
+    num_no_verb = 0
+    num_only_verb = 0
+    num_duplicates = 0
+    with Pool(NUM_WORKERS, initializer=init_worker, initargs=(args.checkpoint,)) as pool, \
+            tmp_path.open('a') as srl_file, \
+            progress_path.open('a') as progress_file:
+        # chunks are submitted a few at a time, because the pool would otherwise read the whole corpus ahead.
+        # imap preserves order of chunks, such that output is deterministic
+        for window in iter(lambda: list(islice(chunks, 2 * NUM_WORKERS)), []):
+            for chunk_id, lines, n1, n2 in pool.imap(annotate_chunk, window):
+                num_no_verb += n1
+                num_only_verb += n2
+                for line in lines:
+                    h = hash_line(line)
+                    if h in line_hashes:
+                        num_duplicates += 1
+                        continue
+                    line_hashes.add(h)
+                    srl_file.write(line + '\n')
+
+                # mark chunk as done only after its lines are on disk
+                srl_file.flush()
+                progress_file.write(f'{chunk_id}\n')
+                progress_file.flush()
+                print(f'Done chunk {chunk_id + 1:>6,}/{num_chunks:,} '
+                      f'total lines={len(line_hashes):,}', flush=True)
+
+    # output file is replaced only when complete
+    tmp_path.replace(srl_path)
+    progress_path.unlink()
+
+    print(f'Collected {len(line_hashes):,} lines')
+    print(f'Skipped {num_no_verb} propositions due to absence of B-V tag')
+    print(f'Skipped {num_only_verb} propositions due to presence of only B-V tag')
+    print(f'Skipped {num_duplicates} duplicate lines')
+
+
+if __name__ == '__main__':
+    main()
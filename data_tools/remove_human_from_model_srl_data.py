@@ -1,5 +1,7 @@
+import numpy as np
 
 from babybertsrl import config
+from babybertsrl.corpus_index import CorpusIndex
 
 HUMAN_NAME_1 = 'human-based-2008'
 HUMAN_NAME_2 = 'human-based-2008'
@@ -7,46 +9,27 @@ MODEL_NAME = 'childes-20191206'
 
 
 # load human-based annotations
-srl_path1 = config.Dirs.data / 'training' / f'{HUMAN_NAME_1}_srl.txt'
-text1 = srl_path1.read_text()
-propositions_h1 = [line.split('|||')[0] for line in text1.split('\n')]
-
-# load human-based annotations
-srl_path2 = config.Dirs.data / 'training' / f'{HUMAN_NAME_2}_srl.txt'
-text2 = srl_path2.read_text()
-propositions_h2 = [line.split('|||')[0] for line in text2.split('\n')]
+index_h1 = CorpusIndex.load_or_make(config.Dirs.data / 'training' / f'{HUMAN_NAME_1}_srl.txt')
+index_h2 = CorpusIndex.load_or_make(config.Dirs.data / 'training' / f'{HUMAN_NAME_2}_srl.txt')
 
 # load model-based annotations
-srl_path3 = config.Dirs.data / 'training' / f'{MODEL_NAME}_srl.txt'
-text3 = srl_path3.read_text()
-lines_m = text3.split('\n')[:-1]
-propositions_m = [line.split('|||')[0] for line in lines_m]
-
-
-# make sets
-propositions_h = propositions_h1 + propositions_h2
-set_propositions_h = set(propositions_h)
-set_propositions_m = set(propositions_m)
-print(f'num human unique propositions: {len(set_propositions_h):>9,}/{len(propositions_h):>9,}')
-print(f'num model unique propositions: {len(set_propositions_m):>9,}/{len(propositions_m):>9,}')
-
-# exclude shared
-lines = []
-num_excluded = 0
-for line_m in set(lines_m):
-    prop_m = line_m.split('|||')[0]
-    if prop_m not in set_propositions_h:
-        lines.append(line_m)
-    else:
-        num_excluded += 1
-
-print(f'Excluded {num_excluded:>9,}/{len(lines_m):>9,}')
-
-# write non-shared to file
-print(f'Writing {len(lines)} lines to file...')
+index_m = CorpusIndex.load_or_make(config.Dirs.data / 'training' / f'{MODEL_NAME}_srl.txt')
+
+# count unique propositions (predicate and words) - on hashes
+hashes_h = np.concatenate([index_h1.proposition_hashes, index_h2.proposition_hashes])
+print(f'num human unique propositions: {len(np.unique(hashes_h)):>9,}/{len(hashes_h):>9,}')
+print(f'num model unique propositions: {len(np.unique(index_m.proposition_hashes)):>9,}/{len(index_m):>9,}')
+
+# exclude duplicate lines, and lines whose proposition is shared with human-based annotations
+unique_ids = index_m.get_unique_lines()
+is_shared = index_m.isin(index_h1) | index_m.isin(index_h2)
+keep_ids = unique_ids[~is_shared[unique_ids]]
+num_excluded = len(unique_ids) - len(keep_ids)
+
+print(f'Excluded {num_excluded:>9,}/{len(index_m):>9,}')
+
+# write non-shared to file, in order of the model-based annotations
+print(f'Writing {len(keep_ids)} lines to file...')
 srl_path = config.Dirs.data / 'training' / f'{MODEL_NAME}_no-dev_srl.txt'
 with srl_path.open('w') as f:
-    for n, line in enumerate(lines):
-        f.write(line)
-        if n + 1 != len(lines):  # do not write '\n' at end of file
-            f.write('\n')
\ No newline at end of file
+    f.write('\n'.join(index_m.format_line(i) for i in keep_ids))  # do not write '\n' at end of file
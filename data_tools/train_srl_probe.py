@@ -0,0 +1,109 @@
+"""
+Can SRL be read out of the representations of a trained (e.g. MLM-only) model?
+
+A linear SRL head is trained on word-piece embeddings of the frozen encoder.
+The encoder is run only once over each SRL dataset, and its embeddings are cached (see babybertsrl/features.py),
+such that each epoch of training the head is a pass over a float16 array, with large batches.
+"""
+
+import time
+from pathlib import Path
+import numpy as np
+import torch
+
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl import config
+from babybertsrl.checkpoint import is_quantized, load_checkpoint
+from babybertsrl.features import load_or_make_feature_cache, FeatureCache
+from babybertsrl.scorer import SrlEvalScorer, convert_bio_tags_to_conll_format
+from babybertsrl.word_pieces import CachedWordpieceTokenizer
+
+CHECKPOINT_PATH = Path('runs') / 'param_001' / 'checkpoint'  # saved at end of job.main
+TRAIN_NAME = 'childes-20191206_no-dev'
+DEVEL_NAME = 'human-based-2018'
+BATCH_SIZE = 4096  # word pieces
+NUM_EPOCHS = 10
+LR = 1e-3
+
+
+def get_rows(cache: FeatureCache, row_ids: np.ndarray, device: torch.device) -> torch.Tensor:
+    return torch.from_numpy(cache.features[row_ids].astype(np.float32)).to(device)
+
+
+def evaluate(head: torch.nn.Module,
+             cache: FeatureCache,
+             tags: list,
+             device: torch.device,
+             ) -> float:
+    # predict tag of each word piece
+    predicted_tag_ids = np.empty(len(cache.features), dtype=np.int64)
+    with torch.no_grad():
+        for start in range(0, len(cache.features), BATCH_SIZE):
+            row_ids = np.arange(start, min(start + BATCH_SIZE, len(cache.features)))
+            predicted_tag_ids[row_ids] = head(get_rows(cache, row_ids, device)).argmax(dim=1).cpu().numpy()
+
+    # tag of each word is the tag of its first word piece
+    scorer = SrlEvalScorer(config.Dirs.root / 'perl' / 'srl-eval.pl', ignore_classes=['V'])
+    batch_verb_indices = []
+    batch_sentences = []
+    batch_conll_predicted_tags = []
+    batch_conll_gold_tags = []
+    for n, (words, verb_index, gold_tags) in enumerate(cache.propositions):
+        start_offsets = cache.start_offsets[cache.word_offsets[n]: cache.word_offsets[n + 1]]
+        predicted_tags = [tags[i] for i in predicted_tag_ids[cache.sentence_offsets[n] + start_offsets]]
+        batch_verb_indices.append(verb_index)
+        batch_sentences.append(words)
+        batch_conll_predicted_tags.append(convert_bio_tags_to_conll_format(predicted_tags))
+        batch_conll_gold_tags.append(convert_bio_tags_to_conll_format(gold_tags))
+    scorer(batch_verb_indices, batch_sentences, batch_conll_predicted_tags, batch_conll_gold_tags)
+    return scorer.get_tag2metrics(reset=True)['overall']['f1']
+
+
+def main():
+    # quantized models run on CPU only
+    device = torch.device('cuda' if torch.cuda.is_available() and not is_quantized(CHECKPOINT_PATH) else 'cpu')
+    model, input_vocab = load_checkpoint(CHECKPOINT_PATH)
+    model.to(device)
+    wordpiece_tokenizer = CachedWordpieceTokenizer(WordpieceTokenizer(input_vocab))
+
+    # run encoder once over each dataset
+    start = time.perf_counter()
+    train_cache = load_or_make_feature_cache(model, wordpiece_tokenizer, CHECKPOINT_PATH,
+                                             config.Dirs.data / 'training' / f'{TRAIN_NAME}_srl.txt')
+    devel_cache = load_or_make_feature_cache(model, wordpiece_tokenizer, CHECKPOINT_PATH,
+                                             config.Dirs.data / 'training' / f'{DEVEL_NAME}_srl.txt')
+    print(f'Prepared features in {time.perf_counter() - start:.1f} sec')
+    del model
+
+    # tags of train and devel data share ids, tags which occur only in devel data are never predicted
+    tags = list(train_cache.tags) + [tag for tag in devel_cache.tags if tag not in train_cache.tags]
+    train_tag_ids = torch.from_numpy(np.asarray(train_cache.tag_ids, dtype=np.int64)).to(device)
+
+    # linear probe
+    head = torch.nn.Linear(train_cache.features.shape[1], len(tags)).to(device)
+    optimizer = torch.optim.Adam(head.parameters(), lr=LR)
+    loss_fn = torch.nn.CrossEntropyLoss()
+    num_rows = len(train_cache.features)
+    for epoch in range(NUM_EPOCHS):
+        start = time.perf_counter()
+        head.train()
+        permutation = np.random.permutation(num_rows)
+        loss_sum = 0.0
+        for batch_start in range(0, num_rows, BATCH_SIZE):
+            row_ids = np.sort(permutation[batch_start: batch_start + BATCH_SIZE])  # sorted for memory locality
+            optimizer.zero_grad()
+            loss = loss_fn(head(get_rows(train_cache, row_ids, device)), train_tag_ids[row_ids])
+            loss.backward()
+            optimizer.step()
+            loss_sum += loss.item() * len(row_ids)
+        elapsed = time.perf_counter() - start
+
+        head.eval()
+        devel_f1 = evaluate(head, devel_cache, tags, device)
+        print(f'epoch={epoch + 1:>3} loss={loss_sum / num_rows:.4f} devel-f1={devel_f1:.4f} '
+              f'word pieces/sec={num_rows / elapsed:,.0f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+whole-word masking of ConverterMLM, on word pieces of the whole corpus, is identical to masking each utterance
+after converting it with wordpiece().
+"""
+
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl.converter import ConverterMLM
+from babybertsrl.word_pieces import wordpiece
+
+SEED = 0
+
+TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]',
+          'the', 'dog', 'is', 'look', 'at', 'here', '.', '!', 'play', '##ing', '##s', 'toy', 'un', '##do', '##ne']
+
+SENTENCES = [['the', 'dogs', 'is', 'playing', '.'],  # words of two word pieces
+             ['look', 'at', 'the', 'toys', 'here', '!'],
+             ['undone'],  # word of three word pieces
+             ['the', 'xylophone', 'is', 'undone', '.']]  # out of vocabulary word
+
+
+def make_wordpiece_tokenizer() -> WordpieceTokenizer:
+    return WordpieceTokenizer(OrderedDict((token, n) for n, token in enumerate(TOKENS)))
+
+
+def make_reference_instances(utterances, wordpiece_tokenizer, num_masked):
+    """
+    mask a whole word, i.e. all of its word pieces, in each copy of each utterance.
+    words to mask are sampled exactly like ConverterMLM.make_instances() does.
+    """
+    res = []
+    for words in utterances:
+        words_wp, end_offsets, start_offsets = wordpiece(words, wordpiece_tokenizer, lowercase_input=False)
+        num_words = len(words)
+        for word_id in np.random.choice(num_words, min(num_words, num_masked), replace=False):
+            span = range(start_offsets[word_id], end_offsets[word_id] + 1)
+            mlm_in_wp = ['[MASK]' if i in span else w for i, w in enumerate(words_wp)]
+            mlm_mask_wp = [int(i in span) for i in range(len(words_wp))]
+            res.append((mlm_in_wp, words_wp, mlm_mask_wp, start_offsets))
+    return res
+
+
+@pytest.mark.parametrize('num_masked', [1, 3, 10])
+def test_whole_word_masking_is_identical(num_masked):
+    converter = ConverterMLM(SimpleNamespace(num_masked=num_masked), make_wordpiece_tokenizer())
+    np.random.seed(SEED)
+    instances = converter.make_instances(SENTENCES)
+    np.random.seed(SEED)
+    expected = make_reference_instances(SENTENCES, make_wordpiece_tokenizer(), num_masked)
+
+    assert len(instances) == len(expected)
+    for instance, (mlm_in_wp, mlm_tags_wp, mlm_mask_wp, start_offsets) in zip(instances, expected):
+        assert [t.text for t in instance['tokens'].tokens] == mlm_in_wp
+        assert instance['tags'].labels == mlm_tags_wp
+        assert instance['indicator'].labels == mlm_mask_wp
+        assert instance['metadata'].metadata['start_offsets'] == start_offsets
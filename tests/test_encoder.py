@@ -0,0 +1,109 @@
+"""
+numerical equivalence of the native encoder and pytorch_pretrained_bert.BertModel, on padded batches.
+"""
+
+import pytest
+import torch
+from pytorch_pretrained_bert.modeling import BertModel, BertConfig
+
+from babybertsrl.encoder import NativeBertModel
+from babybertsrl.params import param2default
+
+TOLERANCE = 1e-5
+SEQUENCE_LENGTH = 16
+
+
+def make_config(hidden_size: int = 64,
+                num_layers: int = 2,
+                num_attention_heads: int = 4,
+                intermediate_size: int = 128,
+                ) -> BertConfig:
+    return BertConfig(vocab_size_or_config_json_file=param2default['vocab_size'] + 5,
+                      hidden_size=hidden_size,
+                      num_hidden_layers=num_layers,
+                      num_attention_heads=num_attention_heads,
+                      intermediate_size=intermediate_size)
+
+
+def make_batch(vocab_size: int, batch_size: int = 8):
+    """sequences of different lengths, padded with zeros, with a predicate indicator"""
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(5, vocab_size, (batch_size, SEQUENCE_LENGTH), generator=generator)
+    lengths = torch.randint(3, SEQUENCE_LENGTH + 1, (batch_size,), generator=generator)
+    lengths[0] = SEQUENCE_LENGTH  # at least one sequence without padding
+    attention_mask = (torch.arange(SEQUENCE_LENGTH)[None, :] < lengths[:, None]).long()
+    input_ids = input_ids * attention_mask
+    token_type_ids = torch.zeros_like(input_ids)
+    token_type_ids[:, 1] = 1
+    return input_ids, token_type_ids, attention_mask
+
+
+def assert_equivalent(legacy: torch.nn.Module,
+                      native: torch.nn.Module,
+                      ) -> None:
+    input_ids, token_type_ids, attention_mask = make_batch(legacy.config.vocab_size)
+    with torch.no_grad():
+        legacy_layers, legacy_pooled = legacy(input_ids, token_type_ids, attention_mask)
+        native_layers, native_pooled = native(input_ids, token_type_ids, attention_mask)
+
+    # outputs at padded positions are not used, and differ because legacy attention masks with -10000, not -inf
+    is_valid = attention_mask.bool()
+    assert len(legacy_layers) == len(native_layers)
+    for a, b in zip(legacy_layers, native_layers):
+        assert torch.allclose(a[is_valid], b[is_valid], atol=TOLERANCE)
+    assert torch.allclose(legacy_pooled, native_pooled, atol=TOLERANCE)
+
+
+@pytest.mark.parametrize('config', [make_config(),
+                                    make_config(param2default['hidden_size'],
+                                                param2default['num_layers'],
+                                                param2default['num_attention_heads'],
+                                                param2default['intermediate_size'])])
+def test_legacy_state_dict_in_native(config):
+    torch.manual_seed(0)
+    legacy = BertModel(config).eval()
+    native = NativeBertModel(config).eval()
+    native.load_state_dict(legacy.state_dict())  # strict: parameter names are identical
+    assert_equivalent(legacy, native)
+
+
+def test_native_state_dict_in_legacy():
+    torch.manual_seed(0)
+    config = make_config()
+    native = NativeBertModel(config).eval()
+    legacy = BertModel(config).eval()
+    legacy.load_state_dict(native.state_dict())
+    assert_equivalent(legacy, native)
+
+
+def test_from_legacy():
+    torch.manual_seed(0)
+    legacy = BertModel(make_config()).eval()
+    assert_equivalent(legacy, NativeBertModel.from_legacy(legacy).eval())
+
+
+def test_last_layer_only():
+    torch.manual_seed(0)
+    legacy = BertModel(make_config()).eval()
+    native = NativeBertModel.from_legacy(legacy).eval()
+    input_ids, token_type_ids, attention_mask = make_batch(legacy.config.vocab_size)
+    with torch.no_grad():
+        all_layers, _ = native(input_ids, token_type_ids, attention_mask)
+        last_layer, _ = native(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+        legacy_last_layer, _ = legacy(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+    is_valid = attention_mask.bool()
+    assert torch.equal(all_layers[-1], last_layer)
+    assert torch.allclose(legacy_last_layer[is_valid], last_layer[is_valid], atol=TOLERANCE)
+
+
+def test_padding_does_not_change_outputs():
+    torch.manual_seed(0)
+    native = NativeBertModel(make_config()).eval()
+    input_ids, token_type_ids, attention_mask = make_batch(native.config.vocab_size)
+    length = int(attention_mask[1].sum())
+    with torch.no_grad():
+        padded, _ = native(input_ids[1:2], token_type_ids[1:2], attention_mask[1:2],
+                           output_all_encoded_layers=False)
+        unpadded, _ = native(input_ids[1:2, :length], token_type_ids[1:2, :length], attention_mask[1:2, :length],
+                             output_all_encoded_layers=False)
+    assert torch.allclose(padded[:, :length], unpadded, atol=TOLERANCE)
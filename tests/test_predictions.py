@@ -0,0 +1,43 @@
+"""
+MLM prediction files (.npz), converted to text, are identical to the text written by predict_masked_sentences().
+"""
+
+import pytest
+
+from babybertsrl.eval import predict_masked_sentences
+from babybertsrl.predictions import convert_predictions_to_text, load_predictions
+
+
+class FakeModel:
+    """returns the input as prediction, except at "[MASK]", in place of MTBert"""
+
+    def eval(self):
+        pass
+
+    def __call__(self, task, **batch):
+        return batch
+
+    def decode(self, output_dict, task):
+        return [['dog' if w == '[MASK]' else w for w in words] for words in output_dict['in']]
+
+
+def make_batches():
+    sentences = [['the', '[MASK]', 'is', 'here', '.'],
+                 ['look', 'at', 'the', '[MASK]', '!'],
+                 ['[MASK]']]
+    gold_tags = [['the', 'cat', 'is', 'here', '.'],
+                 ['look', 'at', 'the', 'dogs', '!'],
+                 ['yes']]
+    return [{'in': sentences[:2], 'gold_tags': gold_tags[:2]},
+            {'in': sentences[2:], 'gold_tags': gold_tags[2:]}]
+
+
+@pytest.mark.parametrize('print_gold', [True, False])
+def test_converted_text_is_identical(tmp_path, print_gold):
+    predict_masked_sentences(FakeModel(), make_batches(), tmp_path / 'a.txt', print_gold=print_gold)
+    predict_masked_sentences(FakeModel(), make_batches(), tmp_path / 'a.npz', print_gold=print_gold)
+    assert load_predictions(tmp_path / 'a.npz').has_gold() == print_gold
+
+    # by default, gold tags are printed if they were saved
+    convert_predictions_to_text(tmp_path / 'a.npz', tmp_path / 'b.txt')
+    assert (tmp_path / 'a.txt').read_bytes() == (tmp_path / 'b.txt').read_bytes()
@@ -0,0 +1,96 @@
+"""
+vectorized and cached word piece tokenization is equivalent to the original, per-sentence functions.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from pytorch_pretrained_bert.tokenization import WordpieceTokenizer
+
+from babybertsrl.word_pieces import CachedWordpieceTokenizer, wordpiece
+from babybertsrl.word_pieces import convert_tags_to_wordpiece_tags, convert_verb_indices_to_wordpiece_indices
+from babybertsrl.word_pieces import convert_tags_to_wordpiece_tags_batch
+from babybertsrl.word_pieces import convert_verb_indices_to_wordpiece_indices_batch
+from babybertsrl.word_pieces import encode_bio_tags, decode_bio_tags
+
+TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]',
+          'the', 'dog', 'is', 'look', 'at', 'here', '.', '!', 'play', '##ing', '##s', 'toy', 'un', '##do', '##ne']
+
+SENTENCES = [['the', 'dogs', 'is', 'playing', '.'],
+             ['look', 'at', 'the', 'toys', 'here', '!'],
+             ['undone'],
+             ['the', 'xylophone', 'is', 'undone', '.'],  # out of vocabulary word
+             ['playing', 'playing', 'toys', 'dog']]
+
+
+def make_wordpiece_tokenizer() -> WordpieceTokenizer:
+    return WordpieceTokenizer(OrderedDict((token, n) for n, token in enumerate(TOKENS)))
+
+
+def check_encoded(encoded, sentences, wordpiece_tokenizer):
+    """compare each sentence of an encoded corpus to the output of wordpiece()"""
+    for i, words in enumerate(sentences):
+        pieces, end_offsets, start_offsets = wordpiece(words, wordpiece_tokenizer, lowercase_input=False)
+        ids = encoded.ids[encoded.sentence_offsets[i]: encoded.sentence_offsets[i + 1]]
+        assert ids.tolist() == [wordpiece_tokenizer.vocab[wp] for wp in pieces]
+        word_slice = slice(encoded.word_offsets[i], encoded.word_offsets[i + 1])
+        assert encoded.start_offsets[word_slice].tolist() == start_offsets
+        assert encoded.end_offsets[word_slice].tolist() == end_offsets
+
+
+@pytest.mark.parametrize('max_size', [100_000, 2])
+def test_cached_tokenizer_is_identical(max_size):
+    wordpiece_tokenizer = make_wordpiece_tokenizer()
+    tokenizer = CachedWordpieceTokenizer(wordpiece_tokenizer, max_size=max_size)
+    for _ in range(2):  # the second pass hits the cache, or what is left of it after eviction
+        for words in SENTENCES:
+            for word in words:
+                assert tokenizer.tokenize(word) == wordpiece_tokenizer.tokenize(word)
+        check_encoded(tokenizer.encode(SENTENCES), SENTENCES, wordpiece_tokenizer)
+    assert len(tokenizer._word2ids) <= max_size
+
+
+@pytest.mark.parametrize('max_size', [100_000, 2])
+def test_encode_word_ids_is_identical_to_encode(max_size):
+    wordpiece_tokenizer = make_wordpiece_tokenizer()
+    tokenizer = CachedWordpieceTokenizer(wordpiece_tokenizer, max_size=max_size)
+    words = sorted({w for words in SENTENCES for w in words})
+    word2id = {w: n for n, w in enumerate(words)}
+    word_ids = np.array([word2id[w] for words in SENTENCES for w in words], dtype=np.int64)
+    word_offsets = np.cumsum([0] + [len(words) for words in SENTENCES])
+
+    encoded = tokenizer.encode_word_ids(word_ids, word_offsets, words)
+    check_encoded(encoded, SENTENCES, wordpiece_tokenizer)
+    for actual, expected in zip(encoded, tokenizer.encode(SENTENCES)):
+        assert actual.tolist() == expected.tolist()
+
+
+def test_batch_conversion_is_identical():
+    wordpiece_tokenizer = make_wordpiece_tokenizer()
+    tokenizer = CachedWordpieceTokenizer(wordpiece_tokenizer)
+    sentences = SENTENCES[:4]
+    tags = [['B-ARG0', 'I-ARG0', 'B-V', 'B-ARG1', 'O'],
+            ['B-V', 'B-ARG1', 'I-ARG1', 'I-ARG1', 'B-ARGM-LOC', 'O'],
+            ['B-V'],
+            ['B-ARG1', 'I-ARG1', 'O', 'B-V', 'O']]
+    verb_indices = [[0, 0, 1, 0, 0],
+                    [1, 0, 0, 0, 0, 0],
+                    [1],
+                    [0, 0, 0, 1, 0]]
+    encoded = tokenizer.encode(sentences)
+
+    label2id = {}
+    bio, label_ids = encode_bio_tags([t for sentence_tags in tags for t in sentence_tags], label2id)
+    labels = sorted(label2id, key=label2id.get)
+    wp_bio, wp_label_ids = convert_tags_to_wordpiece_tags_batch(bio, label_ids, encoded)
+    wp_verb_indices = convert_verb_indices_to_wordpiece_indices_batch(
+        np.array([i for indices in verb_indices for i in indices]), encoded)
+
+    for i, words in enumerate(sentences):
+        _, end_offsets, _ = wordpiece(words, wordpiece_tokenizer, lowercase_input=False)
+        sentence_slice = slice(encoded.sentence_offsets[i], encoded.sentence_offsets[i + 1])
+        expected_tags = convert_tags_to_wordpiece_tags(tags[i], end_offsets)
+        assert decode_bio_tags(wp_bio[sentence_slice], wp_label_ids[sentence_slice], labels) == expected_tags
+        expected_verb_indices = convert_verb_indices_to_wordpiece_indices(verb_indices[i], end_offsets)
+        assert wp_verb_indices[sentence_slice].tolist() == expected_verb_indices